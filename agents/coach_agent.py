@@ -1,7 +1,11 @@
+import json
 import os
-import google.generativeai as genai
 from dotenv import load_dotenv
-import requests
+import threading
+import agents.model_registry
+import resilience
+from agents.exercise_names import canonical_exercise
+from cache import TwoTierCache
 
 load_dotenv()
 # Loading the GEMINI key
@@ -11,6 +15,51 @@ GEMINI_API_KEY = os.getenv('GOOGLE_API_KEY')
 API_KEY = os.getenv("gymini-search-key")
 CX = "d5cf4b299c6f14de3"
 
+# Tips barely change week to week: cache both the raw search results and the
+# rewritten coaching text per canonical exercise name. Both are shared by every
+# user, so the rewrite is stored before personalization (see get_cached_tip).
+TIP_TTL = 7 * 24 * 3600
+SEARCH_CACHE = TwoTierCache("search_results", max_entries=256, ttl=TIP_TTL)
+TIP_CACHE = TwoTierCache("coach_tip_rewrites", max_entries=256, ttl=TIP_TTL)
+
+# Keep-alive session for cache misses, instead of a new connection per request.
+# Created (and requests imported) on the first search.
+_http = None
+_http_lock = threading.Lock()
+
+
+def get_http():
+    global _http
+    if _http is None:
+        with _http_lock:
+            if _http is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+                _http = session
+    return _http
+
+def is_transient_http(error: Exception) -> bool:
+    import requests
+    if isinstance(error, requests.HTTPError):
+        status = error.response.status_code if error.response is not None else None
+        return status == 429 or (status is not None and status >= 500)
+    return isinstance(error, (requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError))
+
+
+# Queries per minute allowed for the search key (0 disables the limit).
+SEARCH_QPM = float(os.getenv("GYMINI_SEARCH_QPM", "100"))
+
+SEARCH_POLICY = resilience.CallPolicy(
+    "custom_search", timeout=float(os.getenv("GYMINI_SEARCH_TIMEOUT", "10")), max_attempts=3,
+    base_delay=0.5, is_retryable=is_transient_http, hedge=True,
+    limiter=resilience.rate_limiter("custom_search", API_KEY, SEARCH_QPM),
+)
+# Concurrent lookups of the same exercise share one search request.
+SEARCH_FLIGHTS = resilience.single_flight("custom_search")
+
+
 def search_web_impl(query: str):
     url = "https://www.googleapis.com/customsearch/v1"
     params = {
@@ -19,9 +68,13 @@ def search_web_impl(query: str):
         "cx": CX,
         "num": 5
     }
-    response = requests.get(url, params=params)
-    response.raise_for_status()
-    return response.json()
+
+    def fetch(timeout):
+        response = get_http().get(url, params=params, timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+
+    return SEARCH_POLICY.call(fetch)
 
 def format_tips(results, exercise: str) -> str:
     items = results.get("items", [])
@@ -38,22 +91,51 @@ def format_tips(results, exercise: str) -> str:
 
 
 def coach_tools(exercise: str):
-    query = f"{exercise} exercise tips best practices"
-    results = search_web_impl(query)
+    key = canonical_exercise(exercise)
+    results = SEARCH_CACHE.get(key)
+    if results is None:
+        results = SEARCH_FLIGHTS.do(key, lambda: _search_and_cache(key, exercise))
     return format_tips(results, exercise)
 
+
+def _search_and_cache(key: str, exercise: str):
+    results = search_web_impl(f"{exercise} exercise tips best practices")
+    SEARCH_CACHE.set(key, results)
+    return results
+
+
+def get_cached_tip(exercise: str) -> str | None:
+    """
+    Returns the coaching text for `exercise` if it was rewritten recently. It is
+    not personalized yet: pass it through gymini_agent.personalize_response.
+    """
+    return TIP_CACHE.get(canonical_exercise(exercise))
+
+
+def store_tip(exercise: str, tip: str):
+    """Caches Gymini's raw (not personalized) rewrite of the tips for `exercise`."""
+    TIP_CACHE.set(canonical_exercise(exercise), tip)
+
+
+def get_cache_stats() -> dict:
+    return {"search_results": SEARCH_CACHE.stats(), "coach_tips": TIP_CACHE.stats()}
+
+COACH_INSTRUCTIONS = """You are Coach Agent.
+When asked to call a tool, respond ONLY with a raw JSON object. Do not use backticks or code fences.
+If the user asks for exercise tips, respond ONLY with:
+{
+  "tool": "search_web",
+  "query": "<exercise_name>"
+}
+Do not provide explanations, text, or code fences. Output only the JSON."""
+agents.model_registry.register("coach", COACH_INSTRUCTIONS)
+
+
 def ask_coach(user_input: str):
     #print(f"Data inside ASK_COACH : {user_input}")
-    model = genai.GenerativeModel("models/gemini-2.5-flash")
-    response = model.generate_content(f"""
-    You are Coach Agent.
-    When asked to call a tool, respond ONLY with a raw JSON object. Do not use backticks or code fences."                                       
-    If the user asks for exercise tips, respond ONLY with:
-    {{
-      "tool": "search_web",
-      "query": "<exercise_name>"
-    }}
-    Do not provide explanations, text, or code fences. Output only the JSON.
-    User: {user_input}
-    """)
+    try:
+        response = agents.model_registry.generate("coach", f"User: {user_input}")
+    except resilience.DependencyUnavailable:
+        # Degraded: the coach only turns the exercise into a search query anyway.
+        return json.dumps({"tool": "search_web", "query": user_input})
     return response.text
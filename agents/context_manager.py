@@ -0,0 +1,176 @@
+import os
+from collections import deque
+from agents.router_agent import LOG_CONFIRMATION_RE, TIPS_HEADER_RE, SWITCH_EXERCISE_RE
+
+# Bounded conversation context.
+# Keeps the last few turns verbatim, folds older turns into a short running
+# summary and tracks the active exercise / recent logs as plain state, so the
+# rendered prompt stays the same size however long the session runs.
+# `on_switch(exercise)` is called when the user switches the active exercise
+# ("now I'm doing squats"); the chat sessions use it to prefetch the tip.
+
+MAX_TURNS = int(os.getenv("GYMINI_CONTEXT_TURNS", "6"))
+TOKEN_BUDGET = int(os.getenv("GYMINI_CONTEXT_TOKENS", "1200"))
+MAX_SUMMARY_LINES = 8
+MAX_MESSAGE_CHARS = 400
+RECENT_LOGS = 5
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token), good enough for budgeting."""
+    return len(text) // 4 + 1
+
+
+def _message_text(message: dict) -> str:
+    return " ".join(part.get("text") or "" for part in message.get("parts", []))
+
+
+class ConversationContext:
+    """
+    Drop-in replacement for the CHAT_HISTORY list: append() chat messages as
+    before, iterate it to get the verbatim recent messages, and call render()
+    for the prompt text.
+    """
+
+    def __init__(self, max_turns: int = MAX_TURNS, token_budget: int = TOKEN_BUDGET, on_switch=None):
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.on_switch = on_switch
+        self.turns = deque()
+        self.summary = deque(maxlen=MAX_SUMMARY_LINES)
+        self.state = {"active_exercise": None, "recent_logs": deque(maxlen=RECENT_LOGS)}
+        self.turn_count = 0
+        self._pending_user = None
+        self._turn_tokens = 0
+        self._rendered = None
+
+    # List-like surface used by the router and the chat loop
+    def append(self, message: dict):
+        text = _message_text(message) or ""
+        if message.get("role") == "model":
+            self._add_turn(self._pending_user, message, text)
+            self._pending_user = None
+        else:
+            if self._pending_user is not None:
+                self._add_turn(self._pending_user, None, "")
+            self._pending_user = message
+            self._track_user(text)
+        self._rendered = None
+
+    def __iter__(self):
+        for turn in self.turns:
+            yield from turn["messages"]
+        if self._pending_user is not None:
+            yield self._pending_user
+
+    def __reversed__(self):
+        return reversed(list(self))
+
+    def __len__(self):
+        return sum(len(turn["messages"]) for turn in self.turns) + (self._pending_user is not None)
+
+    # State queries (no LLM call needed)
+    def active_exercise(self) -> dict | None:
+        active = self.state["active_exercise"]
+        return dict(active) if active else None
+
+    def recent_logs(self) -> list[dict]:
+        return list(self.state["recent_logs"])
+
+    def render(self) -> str:
+        """Prompt text: state record, running summary, then the recent turns verbatim."""
+        if self._rendered is None:
+            lines = []
+            active = self.state["active_exercise"]
+            if active or self.state["recent_logs"]:
+                lines.append(f"Session state: {self._state_text()}")
+            if self.summary:
+                lines.append("Earlier in this session: " + "; ".join(self.summary))
+            lines.extend(turn["rendered"] for turn in self.turns)
+            self._rendered = "\n".join(lines) + ("\n" if lines else "")
+        return self._rendered
+
+    def _state_text(self) -> str:
+        parts = []
+        active = self.state["active_exercise"]
+        if active:
+            parts.append(f"active exercise is {active['exercise']}")
+        if self.state["recent_logs"]:
+            logs = ", ".join(
+                f"{log['exercise']} {log['sets']}x{log['reps']} at {log['weight_kg']:g}kg"
+                for log in self.state["recent_logs"]
+            )
+            parts.append(f"recent logs: {logs}")
+        return "; ".join(parts)
+
+    def _add_turn(self, user_message: dict | None, model_message: dict | None, model_text: str):
+        messages = [m for m in (user_message, model_message) if m is not None]
+        user_text = _message_text(user_message) if user_message else ""
+        rendered = "\n".join(
+            f"{m.get('role', 'user').capitalize()}: {(_message_text(m) or '')[:MAX_MESSAGE_CHARS]}"
+            for m in messages
+        )
+        logged = self._track_model(model_text)
+        turn = {
+            "messages": messages,
+            "rendered": rendered,
+            "tokens": estimate_tokens(rendered),
+            "summary": self._summarize(user_text, logged),
+        }
+        self.turns.append(turn)
+        self._turn_tokens += turn["tokens"]
+        self.turn_count += 1
+        self._compact()
+
+    def _compact(self):
+        # Fold the oldest verbatim turns into the summary until both limits hold.
+        while self.turns and (
+            len(self.turns) > self.max_turns or (len(self.turns) > 1 and self._turn_tokens > self.token_budget)
+        ):
+            oldest = self.turns.popleft()
+            self._turn_tokens -= oldest["tokens"]
+            if oldest["summary"]:
+                self.summary.append(oldest["summary"])
+
+    @staticmethod
+    def _summarize(user_text: str, logged: list[dict]) -> str:
+        if logged:
+            return "logged " + ", ".join(
+                f"{log['exercise']} {log['sets']}x{log['reps']} at {log['weight_kg']:g}kg" for log in logged
+            )
+        user_text = " ".join(user_text.split())
+        if not user_text:
+            return ""
+        ellipsis = "…" if len(user_text) > 60 else ""
+        return f"user said \"{user_text[:60]}{ellipsis}\""
+
+    def _track_user(self, text: str):
+        switched = SWITCH_EXERCISE_RE.match(" ".join(text.split()).rstrip(".!"))
+        if switched:
+            exercise = switched.group("exercise").strip().title()
+            self.state["active_exercise"] = {"exercise": exercise}
+            if self.on_switch:
+                self.on_switch(exercise)
+
+    def _track_model(self, text: str) -> list[dict]:
+        # A bulk log confirms one line per exercise; the last one becomes active.
+        logs = [
+            {
+                "exercise": logged.group(3),
+                "sets": int(logged.group(1)),
+                "reps": int(logged.group(2)),
+                "weight_kg": float(logged.group(4)),
+            }
+            for logged in LOG_CONFIRMATION_RE.finditer(text)
+        ]
+        if logs:
+            self.state["active_exercise"] = dict(logs[-1])
+            self.state["recent_logs"].extend(logs)
+            return logs
+        tips = TIPS_HEADER_RE.search(text)
+        if tips:
+            exercise = tips.group(1).strip()
+            active = self.state["active_exercise"]
+            if not active or active["exercise"].lower() != exercise.lower():
+                self.state["active_exercise"] = {"exercise": exercise}
+        return []
@@ -1,32 +1,280 @@
+import argparse
+import contextvars
 import json
+import os
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 import agents.logging_agent
 import agents.coach_agent
+import agents.memory_agent
+import agents.router_agent
+import agents.stateful_agent
+import agents.gymini_agent
+import agents.intent_classifier
+import agents.response_parser
+import agents.tool_schemas
+import logs
+import resilience
+from agents.context_manager import ConversationContext
+from agents.exercise_names import canonical_exercise
+from db.backend import sandbox
+
+# Labeled utterances: {"id", "text", "expected": tool command or null (fallback),
+# optional "history": [{"user", "model"}]} evaluated against the routing layer.
+DATASET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "eval_dataset.jsonl")
+
+EVAL_WORKERS = int(os.getenv("GYMINI_EVAL_WORKERS", "8"))
+# Gemini requests per second the evaluation may send (local-router hits are free).
+EVAL_RATE = float(os.getenv("GYMINI_EVAL_RATE", "5"))
+
+WEIGHT_TOLERANCE_KG = 0.1
+
+# The offline classifier is trained on the same labeled file, so "offline" mode
+# is scored by k-fold cross-validation: each item is routed by a model trained
+# without its fold.
+CV_FOLDS = 5
+
+
+def load_dataset(path: str = DATASET_PATH, limit: int | None = None) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        items = [json.loads(line) for line in f if line.strip()]
+    return items[:limit] if limit else items
+
+
+def _history(item: dict) -> ConversationContext:
+    history = ConversationContext()
+    for turn in item.get("history", []):
+        history.append({"role": "user", "parts": [{"text": turn["user"]}]})
+        history.append({"role": "model", "parts": [{"text": turn["model"]}]})
+    return history
+
+
+def _parse_command(text: str) -> dict | None:
+    try:
+        return agents.response_parser.parse_command(text)
+    except ValueError:
+        # The controller falls back on commands it cannot run.
+        return None
+
+
+def route(text: str, history, mode: str = "chain",
+          limiter: resilience.RateLimiter | None = None, model=None) -> tuple[dict | None, str]:
+    """
+    Routes one utterance the way main.handle_turn does, without running the tool.
+    Mode "local" only checks the local router (no Gemini calls; misses count as
+    fallback); "offline" sends misses to the local intent classifier (or `model`) instead of Gemini.
+    Returns (command or None for fallback, "local", "offline" or "llm").
+    """
+    command = agents.router_agent.route_locally(text, history)
+    if command is not None or mode == "local":
+        return command, "local"
+    if mode == "offline":
+        return agents.intent_classifier.classify(text, history, model), "offline"
+    if limiter:
+        limiter.acquire()
+    if mode == "unified":
+        return agents.stateful_agent.route_with_history(text, history), "llm"
+    routed = agents.stateful_agent.ask_main_agent_with_history(text, history)
+    # The chain's controller re-asks Gymini for the tool JSON.
+    if limiter:
+        limiter.acquire()
+    return _parse_command(agents.gymini_agent.ask_gymini(routed)), "llm"
+
+
+def _workout_rows(exercises) -> list[tuple] | None:
+    try:
+        entries = agents.tool_schemas.validate_workout(exercises)
+    except ValueError:
+        return None
+    return [
+        (canonical_exercise(row["exercise"]), row["sets"], row["reps"], row["weight_kg"])
+        for entry in entries for row in agents.logging_agent.expand_sets(entry)
+    ]
+
+
+def _args_match(expected: dict, predicted: dict) -> dict:
+    """Per-argument correctness for a command whose tool was predicted correctly."""
+    matches = {}
+    defaults = agents.tool_schemas.ARG_DEFAULTS.get(expected["tool"], {})
+    for arg, kind in agents.tool_schemas.TOOL_ARGS[expected["tool"]].items():
+        want, got = expected.get(arg, defaults.get(arg)), predicted.get(arg, defaults.get(arg))
+        if kind is list:
+            # log_workout: compare the rows each side would store.
+            matches[arg] = _workout_rows(want) == _workout_rows(got)
+        elif arg == "exercise":
+            matches[arg] = got is not None and canonical_exercise(str(got)) == canonical_exercise(str(want))
+        elif kind is float:
+            matches[arg] = got is not None and abs(float(got) - float(want)) <= WEIGHT_TOLERANCE_KG
+        elif kind is str:
+            matches[arg] = got is not None and str(got).strip().lower() == str(want).strip().lower()
+        else:
+            matches[arg] = got == want
+    return matches
+
+
+def evaluate_item(item: dict, mode: str, limiter: resilience.RateLimiter | None, model=None) -> dict:
+    # Every item gets its own memory and storage sandbox, so nothing leaks
+    # between concurrent items or into the user's data. Its Gemini calls also
+    # queue behind interactive turns in the shared rate limiter.
+    agents.memory_agent.use_memory({})
+    with sandbox(), resilience.priority("background"):
+        start = time.perf_counter()
+        error = None
+        try:
+            predicted, source = route(item["text"], _history(item), mode, limiter, model)
+        except Exception as e:
+            predicted, source, error = None, "error", f"{type(e).__name__}: {e}"
+        latency_ms = (time.perf_counter() - start) * 1000
+    expected = item.get("expected")
+    expected_tool = expected["tool"] if expected else None
+    predicted_tool = predicted["tool"] if predicted else None
+    result = {
+        "id": item["id"],
+        "expected_tool": expected_tool,
+        "predicted_tool": predicted_tool,
+        "source": source,
+        "latency_ms": round(latency_ms, 2),
+        "intent_ok": expected_tool == predicted_tool,
+        "predicted": predicted,
+        "error": error,
+    }
+    if expected and predicted and result["intent_ok"] and agents.tool_schemas.TOOL_ARGS[expected_tool]:
+        result["args"] = _args_match(expected, predicted)
+    return result
+
+
+def _percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return round(ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))], 2)
+
+
+def summarize(results: list[dict], elapsed: float) -> dict:
+    total = len(results)
+    with_args = [r for r in results if "args" in r]
+    arg_names = sorted({arg for r in with_args for arg in r["args"]})
+    per_tool = {}
+    for r in results:
+        per_tool.setdefault(r["expected_tool"] or "fallback", []).append(r)
+    return {
+        "items": total,
+        "elapsed_s": round(elapsed, 2),
+        "intent_accuracy": round(sum(r["intent_ok"] for r in results) / total, 3) if total else 0.0,
+        "argument_accuracy": round(sum(all(r["args"].values()) for r in with_args) / len(with_args), 3) if with_args else None,
+        "argument_accuracy_by_field": {
+            arg: round(sum(r["args"][arg] for r in with_args if arg in r["args"])
+                       / sum(1 for r in with_args if arg in r["args"]), 3)
+            for arg in arg_names
+        },
+        "fallback_rate": round(sum(r["predicted_tool"] is None for r in results) / total, 3) if total else 0.0,
+        "local_route_rate": round(sum(r["source"] == "local" for r in results) / total, 3) if total else 0.0,
+        "errors": sum(r["error"] is not None for r in results),
+        "per_tool": {
+            tool: {
+                "items": len(rows),
+                "accuracy": round(sum(r["intent_ok"] for r in rows) / len(rows), 3),
+                "p50_ms": _percentile([r["latency_ms"] for r in rows], 50),
+                "p95_ms": _percentile([r["latency_ms"] for r in rows], 95),
+            }
+            for tool, rows in sorted(per_tool.items())
+        },
+        "mistakes": [
+            {"id": r["id"], "expected": r["expected_tool"], "predicted": r["predicted"], "error": r["error"]}
+            for r in results if not r["intent_ok"] or ("args" in r and not all(r["args"].values()))
+        ],
+    }
+
+
+def _held_out_models(items: list[dict]) -> dict:
+    """Item id -> offline classifier trained without the item's fold (nor any training line with its text)."""
+    training = agents.intent_classifier.load_training_items()
+    fold = {item["id"]: zlib.crc32(item["id"].encode("utf-8")) % CV_FOLDS for item in items}
+    models = {}
+    for k in range(CV_FOLDS):
+        held_out = {item["text"] for item in items if fold[item["id"]] == k}
+        models[k] = agents.intent_classifier.train([t for t in training if t["text"] not in held_out])
+    return {item["id"]: models[fold[item["id"]]] for item in items}
+
+
+def _use_evaluation_counters():
+    logs.use_metrics(logs.Metrics())
+    agents.router_agent.use_router_stats({"hits": 0, "misses": 0})
+    agents.intent_classifier.use_offline_stats({"routed": 0, "fallback": 0})
+
+
+def run_dataset(items: list[dict] | None = None, mode: str = "chain", workers: int = EVAL_WORKERS,
+                rate: float = EVAL_RATE) -> dict:
+    """Evaluates the routing layer on the labeled dataset with a bounded, rate-limited pool."""
+    items = load_dataset() if items is None else items
+    # Its own cap on top of the shared per-key limiter: one request every 1/rate seconds.
+    limiter = resilience.RateLimiter("evaluation", rate * 60, burst=1) if rate else None
+    models = _held_out_models(items) if mode == "offline" else {}
+    # Evaluation routes are counted apart from the session's router hit rates and latency metrics.
+    context = contextvars.copy_context()
+    context.run(_use_evaluation_counters)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gymini-eval") as pool:
+        futures = [
+            pool.submit(context.copy().run, evaluate_item, item, mode, limiter, models.get(item["id"]))
+            for item in items
+        ]
+        results = [future.result() for future in futures]
+    return summarize(results, time.perf_counter() - start)
+
 
 class EvaluationAgent:
-  
+
     def evaluate_log_session(self):
-        result = agents.logging_agent.log_session("squats", 3, 10, 50.0)
+        # Written to a throwaway sandbox store, never to the user's database.
+        with sandbox() as store:
+            result = agents.logging_agent.log_session("squats", 3, 10, 50.0)
+            logged = sum(len(session["exercises"]) for session in store.get_all_logs().values())
         assert isinstance(result, dict), "Expected dict return"
         assert "message" in result, "Missing success message"
+        assert logged == 1, "Sandbox store did not receive the log"
         return "log_session passed ✅"
 
     def evaluate_coach_agent(self):
         response = agents.coach_agent.ask_coach("squats")
-        try:
-            json.loads(response)
+        if agents.response_parser.extract_json(response) is not None:
             return "coach_agent passed ✅"
-        except json.JSONDecodeError:
-            return "coach_agent failed ❌"
+        return "coach_agent failed ❌"
+
+    def evaluate_routing(self, mode: str = "local"):
+        # The chat command only scores the local router: routing the whole dataset
+        # through Gemini costs a request per item and would blow the turn budget.
+        # `python -m agents.evaluation_agent` runs the full evaluation.
+        summary = run_dataset(mode=mode)
+        return {key: summary[key] for key in ("items", "intent_accuracy", "argument_accuracy", "fallback_rate", "errors")}
 
     def run_all(self):
-        return {
-            "log_session": self.evaluate_log_session(),
-            "coach_agent": self.evaluate_coach_agent(),
-            
-        }
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            checks = {
+                "log_session": pool.submit(contextvars.copy_context().run, self.evaluate_log_session),
+                "coach_agent": pool.submit(contextvars.copy_context().run, self.evaluate_coach_agent),
+                "routing": pool.submit(contextvars.copy_context().run, self.evaluate_routing),
+            }
+            return {name: future.result() for name, future in checks.items()}
+
+
 if __name__ == "__main__":
-    evaluator = EvaluationAgent()
-    results = evaluator.run_all()
-    print("Evaluation Results:")
-    for agent, status in results.items():
-        print(f"- {agent}: {status}")
+    parser = argparse.ArgumentParser(description="Evaluate Gymini's routing on the labeled intent dataset.")
+    parser.add_argument("--dataset", default=DATASET_PATH)
+    parser.add_argument("--mode", choices=("chain", "unified", "local", "offline"), default=os.getenv("GYMINI_ROUTING_MODE", "chain").lower())
+    parser.add_argument("--workers", type=int, default=EVAL_WORKERS)
+    parser.add_argument("--rate", type=float, default=EVAL_RATE, help="max Gemini requests per second (0 = unlimited)")
+    parser.add_argument("--limit", type=int, help="only evaluate the first N items")
+    parser.add_argument("--checks", action="store_true", help="run the agent smoke checks instead")
+    args = parser.parse_args()
+
+    if args.checks:
+        evaluator = EvaluationAgent()
+        results = evaluator.run_all()
+        print("Evaluation Results:")
+        for agent, status in results.items():
+            print(f"- {agent}: {status}")
+    else:
+        summary = run_dataset(load_dataset(args.dataset, args.limit), args.mode, args.workers, args.rate)
+        print(json.dumps(summary, indent=2, ensure_ascii=False))
@@ -0,0 +1,50 @@
+import re
+
+# Canonical exercise names, so "squats", "Back Squat" and "barbell squat"
+# share one cache key / one history series.
+ALIASES = {
+    "squat": "squat",
+    "back squat": "squat",
+    "barbell squat": "squat",
+    "barbell back squat": "squat",
+    "bench": "bench press",
+    "bench press": "bench press",
+    "flat bench": "bench press",
+    "flat bench press": "bench press",
+    "barbell bench press": "bench press",
+    "deadlift": "deadlift",
+    "conventional deadlift": "deadlift",
+    "barbell deadlift": "deadlift",
+    "dl": "deadlift",
+    "rdl": "romanian deadlift",
+    "romanian deadlift": "romanian deadlift",
+    "ohp": "overhead press",
+    "overhead press": "overhead press",
+    "military press": "overhead press",
+    "shoulder press": "overhead press",
+    "pull up": "pull-up",
+    "pullup": "pull-up",
+    "chin up": "chin-up",
+    "chinup": "chin-up",
+    "push up": "push-up",
+    "pushup": "push-up",
+    "barbell row": "barbell row",
+    "bent over row": "barbell row",
+}
+
+
+def _singular(word: str) -> str:
+    if word.endswith("sses"):
+        return word[:-2]
+    if len(word) > 2 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def canonical_exercise(name: str) -> str:
+    """Returns the lowercase canonical name for an exercise (e.g. 'Back Squats' -> 'squat')."""
+    cleaned = re.sub(r"[^a-z0-9\- ]", " ", (name or "").lower())
+    cleaned = re.sub(r"\b(exercise|tips?|best practices|form)\b", " ", cleaned)
+    words = [_singular(word) for word in cleaned.replace("-", " ").split()]
+    key = " ".join(words)
+    return ALIASES.get(key, key)
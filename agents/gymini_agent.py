@@ -1,87 +1,187 @@
-import datetime as dt
-import time
-import google.generativeai as genai
 import agents.memory_agent
-from google.api_core.exceptions import ResourceExhausted, InternalServerError, ServiceUnavailable, DeadlineExceeded
+import resilience
+import agents.model_registry
+import agents.response_cache
+
+
+GYMINI_INSTRUCTIONS = """You are Gymini. If the user provides workout details (exercise, sets, reps, weight),
+respond ONLY with a JSON object in this format:
+{
+  "tool": "log_session",
+  "exercise": "<name>",
+  "sets": <int>,
+  "reps": <int>,
+  "weight_kg": <float>
+}
+- If the user logs several exercises in one message, or sets with different reps or weights
+(e.g., "bench 3x10 at 80, then squats 5x5 at 100, last set only 4 reps"),
+respond ONLY with a JSON object in this format ("set_details" only when the sets differ):
+{
+  "tool": "log_workout",
+  "exercises": [
+    {"exercise": "<name>", "sets": <int>, "reps": <int>, "weight_kg": <float>,
+     "set_details": [{"reps": <int>, "weight_kg": <float>}, ...]}
+  ]
+}
+- If the user asks for a workout summary (e.g., "Give me my last session summary"),
+respond ONLY with a JSON object in this format:
+{
+    "tool": "get_summary"
+}
+- If the user asks how an exercise has progressed (e.g., "how has my bench moved in the last 8 weeks?"),
+respond ONLY with a JSON object in this format ("weeks" defaults to 8; a month is 4 weeks):
+{
+    "tool": "get_progress",
+    "exercise": "<exercise_name>",
+    "weeks": <int>
+}
+
+# Coach Agent
+If the user asks for exercise tips, respond ONLY with a JSON object in this format:
+{
+    "tool": "coach_agent",
+    "exercise": "<exercise_name>"
+}
+# Coach Agent Formatter
+If you are given raw search results (snippets + links) from the coach_agent,
+rewrite them into a clear, user-friendly coaching response.
+
+Guidelines:
+- Summarize into 3–5 actionable tips.
+- Use a numbered or bulleted list.
+- Keep each tip short, practical, and motivational.
+- Preserve source links at the end of each tip.
+- Speak in a supportive, coach-like tone.
+- Begin with: "🏋️ Tips for <exercise_name>:"
+
+# Memory tools
+- If the user introduces themselves (e.g., "my name is <X>", "call me <X>"),
+respond ONLY with this JSON object:
+{
+"tool": "set_name",
+"name": "<X>"
+}
+- If the user asks to recall their identity (e.g., "what is my name?", "do you remember my name?"),
+respond ONLY with:
+{
+"tool": "get_name"
+}
+# Evaluation tools
+- If the user ask to run an evaluation or evaluate all the agents.
+respond ONLY with:
+{
+"tool": "evaluate_agents"
+}
+If the user asks "who made you", "who created you", or similar,
+respond ONLY with:
+{"tool": "get_creator"}
+If the user asks "what can you do", or similar,
+respond ONLY with:
+{"tool": "help"}
+
+Otherwise, answer normally.
+"""
+agents.model_registry.register("gymini", GYMINI_INSTRUCTIONS)
+
+FAILURE_MESSAGE = "Gymini couldn't respond after multiple attempts. Please try again later."
 
 
 # Gymini LLM model
-def ask_gymini(user_input: str, max_attempts=5, delay=1, backoff=2)-> str:
-    attempt = 0
-    while attempt < max_attempts:
-        try:
-            model = genai.GenerativeModel("models/gemini-2.5-flash")
-            response = model.generate_content(f"""
-        You are Gymini. If the user provides workout details (exercise, sets, reps, weight),
-        respond ONLY with a JSON object in this format:
-        {{
-          "tool": "log_session",
-          "exercise": "<name>",
-          "sets": <int>,
-          "reps": <int>,
-          "weight_kg": <float>
-        }}
-        - If the user asks for a workout summary (e.g., "Give me my last session summary"),
-        respond ONLY with a JSON object in this format:
-        {{
-            "tool": "get_summary"
-        }}
-                                              
-        # Coach Agent
-        If the user asks for exercise tips, respond ONLY with a JSON object in this format:
-        {{
-            "tool": "coach_agent",
-            "exercise": "<exercise_name>"
-        }}
-        # Coach Agent Formatter
-        If you are given raw search results (snippets + links) from the coach_agent,
-        rewrite them into a clear, user-friendly coaching response.
-
-        Guidelines:
-        - Summarize into 3–5 actionable tips.
-        - Use a numbered or bulleted list.
-        - Keep each tip short, practical, and motivational.
-        - Preserve source links at the end of each tip.
-        - Speak in a supportive, coach-like tone.
-        - Begin with: "🏋️ Tips for <exercise_name>:"
-                                                     
-        # Memory tools                                      
-        - If the user introduces themselves (e.g., "my name is <X>", "call me <X>"),
-        respond ONLY with this JSON object:
-        {{
-        "tool": "set_name",
-        "name": "<X>"
-        }}
-        - If the user asks to recall their identity (e.g., "what is my name?", "do you remember my name?"),
-        respond ONLY with:
-        {{
-        "tool": "get_name"
-        }}
-        # Evaluation tools
-        - If the user ask to run an evaluation or evaluate all the agents.
-        respond ONLY with:
-        {{
-        "tool": "evaluate_agents"
-        }}
-        If the user asks "who made you", "who created you", or similar,
-        respond ONLY with:
-        {{"tool": "get_creator"}}
-        If the user asks "what can you do", or similar,
-        respond ONLY with:
-        {{"tool": "help"}}                                      
-                                                                                    
-        Otherwise, answer normally.
-        User: {user_input}
-        """)
-            raw_text = response.text
-            return personalize_response(raw_text)
-        except (ResourceExhausted, InternalServerError, ServiceUnavailable, DeadlineExceeded) as e:
-            print(f"Attempt {attempt + 1} failed: {e}")
-            time.sleep(delay)
-            delay *= backoff
-            attempt += 1
-    return "Gymini couldn't respond after multiple attempts. Please try again later."
+# Retries, timeouts and the circuit breaker live in model_registry.GEMINI_POLICY;
+# when Gemini stays unavailable the user gets `offline` (a templated reply for
+# this request) or FAILURE_MESSAGE right away.
+# `cache_branch` opts the prompt into agents.response_cache (e.g. "help").
+def ask_gymini(user_input: str, cache_branch: str | None = None, offline: str | None = None)-> str:
+    text = generate_reply(user_input, cache_branch)
+    if text is None:
+        return offline if offline is not None else FAILURE_MESSAGE
+    return personalize_response(text)
+
+
+# Gymini's raw reply, before personalization (for results shared across users,
+# e.g. coaching tips), or None when Gemini is unavailable.
+def generate_reply(user_input: str, cache_branch: str | None = None) -> str | None:
+    cached = agents.response_cache.lookup(cache_branch, "gymini", user_input)
+    if cached is not None:
+        return cached
+    try:
+        return _generate_text(user_input, cache_branch)
+    except resilience.DependencyUnavailable as e:
+        print(f"Gymini unavailable: {e}")
+        return None
+    except ValueError as e:
+        # response.text raises ValueError when the reply was blocked and has no text.
+        print(f"Gymini returned no text: {e}")
+        return None
+
+
+# Identical concurrent prompts of a cached branch share one Gemini request
+# (the answer would be cached and reused anyway).
+GYMINI_FLIGHTS = resilience.single_flight("gymini")
+
+
+def _generate_text(user_input: str, cache_branch: str | None) -> str:
+    def generate():
+        text = agents.model_registry.generate("gymini", f"User: {user_input}").text
+        agents.response_cache.store(cache_branch, "gymini", user_input, text)
+        return text
+
+    if not agents.response_cache.enabled(cache_branch):
+        return generate()
+    return GYMINI_FLIGHTS.do(agents.response_cache.cache_key("gymini", user_input), generate)
+
 
+# Streaming variant of ask_gymini for free-text replies: yields the answer in
+# chunks as Gemini produces them. Only opening the stream is retried, since a
+# partially shown answer cannot be taken back.
+def stream_gymini(user_input: str, cache_branch: str | None = None, offline: str | None = None, on_done=None):
+    """
+    Streams a personalized reply. `on_done(raw)` is called with the complete raw
+    (not personalized) reply once it has been streamed in full.
+    """
+    cached = agents.response_cache.lookup(cache_branch, "gymini", user_input)
+    if cached is not None:
+        yield personalize_response(cached)
+        if on_done:
+            on_done(cached)
+        return
+    try:
+        response = agents.model_registry.generate("gymini", f"User: {user_input}", stream=True)
+    except resilience.DependencyUnavailable as e:
+        print(f"Gymini unavailable: {e}")
+        yield offline if offline is not None else FAILURE_MESSAGE
+        return
+    # Hold back the last few characters so "Hey there" split across
+    # chunks is still personalized.
+    name = agents.memory_agent.get_name()
+    pending = ""
+    raw = []
+    try:
+        for chunk in response:
+            raw.append(chunk.text or "")
+            pending += chunk.text or ""
+            if name:
+                pending = pending.replace("Hey there", f"Hey {name}")
+            cut = max(0, len(pending) - len("Hey there") + 1)
+            if cut:
+                yield pending[:cut]
+                pending = pending[cut:]
+    except Exception as e:
+        # A dropped connection, or e.g. a ValueError from chunk.text when the
+        # reply is blocked mid-stream: end the stream with what can be shown.
+        print(f"Gymini stream failed: {type(e).__name__}: {e}")
+        if not any(raw):
+            yield offline if offline is not None else FAILURE_MESSAGE
+        elif agents.model_registry.is_transient(e):
+            yield pending + " … (Gymini lost the connection, please ask again.)"
+        else:
+            yield pending + " … (Gymini couldn't finish this reply, please ask again.)"
+        return
+    if pending:
+        yield pending
+    agents.response_cache.store(cache_branch, "gymini", user_input, "".join(raw))
+    if on_done:
+        on_done("".join(raw))
 
 
 # A wrapper function for Gymini LLM to make the response more personalized
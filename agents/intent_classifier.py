@@ -0,0 +1,324 @@
+import contextvars
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+import agents.tool_schemas
+from agents.router_agent import (
+    ANOTHER_SET_RE, EXERCISE_NAME_RE, LAST_SET_RE, LOG_FILLER, NOT_EXERCISE, PROGRESS_WINDOW_RE, PRONOUNS,
+    SEGMENT_SPLIT_RE, SETS_OF_REPS_RE, SETS_X_REPS_RE, WEIGHT_RE, _count, _route_workout, _to_kg,
+    last_exercise_context,
+)
+from agents.exercise_names import ALIASES, canonical_exercise
+
+# Quota-free routing for when Gemini is unavailable (circuit open, quota
+# exhausted, turn budget spent): a character n-gram naive Bayes classifier
+# trained on the labeled utterances in agents/eval_dataset.jsonl picks the
+# intent, and a rule-based slot extractor fills in exercise/sets/reps/weight.
+# The model is trained on first use (a few milliseconds) and kept in memory.
+# Commands are validated like model output; anything uncertain returns None.
+
+DATASET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "eval_dataset.jsonl")
+
+# Minimum posterior probability of the predicted intent.
+MIN_CONFIDENCE = float(os.getenv("GYMINI_OFFLINE_CONFIDENCE", "0.5"))
+NGRAM_SIZES = (2, 3, 4)
+
+FALLBACK = "fallback"
+
+OFFLINE_STATS = {"routed": 0, "fallback": 0}
+_OFFLINE_STATS = contextvars.ContextVar("gymini_offline_stats", default=OFFLINE_STATS)
+
+LOG_TOOLS = ("log_session", "log_workout")
+# get_progress needs one of these; "did some deadlifts" is not a progress question.
+PROGRESS_CUE_RE = re.compile(
+    r"\b(?:progress\w*|moved?|improv\w*|better|worse|trend\w*|gone|going|been|stronger|weaker|increas\w*|"
+    r"changed?|lately|recently|(?:last|past)\s+(?:\w+\s+)?(?:weeks?|months?|years?))\b",
+    re.I,
+)
+# Past-tense logging without a set scheme: offline, Gymini asks for the numbers.
+LOG_CUE_RE = re.compile(r"\b(?:did|done|finished|hit|trained|worked on|logged?)\b", re.I)
+
+# Words that belong to the request rather than to the exercise name.
+INTENT_WORDS = {
+    "tips", "tip", "advice", "cues", "cue", "pointers", "form", "technique", "teach", "me", "how", "to", "do",
+    "should", "i", "my", "the", "a", "an", "any", "some", "give", "show", "get", "for", "on", "about", "with",
+    "properly", "correctly", "safely", "better", "improve", "improved", "progress", "progressed", "progressing",
+    "moved", "move", "has", "have", "is", "are", "did", "been", "going", "gone", "over", "in", "last", "past",
+    "weeks", "week", "months", "month", "year", "years", "lately", "recently", "what", "can", "you", "doing",
+    "brace", "breathe", "grip", "stance", "setup", "please", "it's", "its", "gotten", "of", "at", "proper",
+    "during", "heavy", "deep", "when", "focus",
+}
+# The exercise name usually follows the last of these words ("tips for X", "how to do X").
+EXERCISE_ANCHORS = {"for", "on", "about", "do", "doing", "my", "with"}
+# Log phrasing the strict router leaves to the LLM: verbs naming the lift, and filler.
+LIFT_VERBS = {"squatted": "Squat", "benched": "Bench Press", "deadlifted": "Deadlift", "pressed": "Overhead Press"}
+LOG_VERBS = {"hit", "managed", "completed", "extra", "an", "worked", "went", "up", "did", "today"}
+SET_OF_REPS_RE = re.compile(r"\bset\s+of\s+(\d+)\b", re.I)
+SET_NAME_SLOT_RE = re.compile(r"\b(?:name is|name's|call me|i am|i'm)\s+([a-z][a-z'\-]*)", re.I)
+# Words that follow "call me" / "i'm" without being a name ("call me maybe", "i'm tired").
+NOT_A_NAME = {
+    "maybe", "later", "sometime", "anytime", "whatever", "anything", "back", "now", "soon", "tomorrow", "if",
+    "so", "very", "really", "just", "still", "also", "always", "never", "here", "there", "sure", "fine", "ok",
+    "okay", "ready", "sorry", "tired", "sore", "new", "good", "great", "bad", "feeling", "trying", "gonna",
+    "crazy", "stuck", "curious", "wondering", "thinking", "looking", "all", "out", "by", "up", "off", "coach",
+}
+
+
+def _tokens(text: str) -> Counter:
+    """Character 2-4 grams of the padded, lowercased text (digits folded to 0) plus word unigrams."""
+    text = re.sub(r"\d", "0", " ".join(text.lower().split()))
+    padded = f" {text} "
+    features = Counter(padded[i:i + n] for n in NGRAM_SIZES for i in range(len(padded) - n + 1))
+    features.update(f"w:{word}" for word in re.findall(r"[a-z0']+", text))
+    return features
+
+
+class NaiveBayes:
+    """Multinomial naive Bayes over sparse feature counts, with Laplace smoothing."""
+
+    def __init__(self, alpha: float = 0.1):
+        self.alpha = alpha
+        self.priors = {}
+        self.weights = {}
+        self.unseen = {}
+
+    def fit(self, texts: list[str], labels: list[str]) -> "NaiveBayes":
+        counts, totals, docs = {}, Counter(), Counter(labels)
+        vocabulary = set()
+        for text, label in zip(texts, labels):
+            features = _tokens(text)
+            counts.setdefault(label, Counter()).update(features)
+            totals[label] += sum(features.values())
+            vocabulary.update(features)
+        for label, label_counts in counts.items():
+            denominator = totals[label] + self.alpha * len(vocabulary)
+            self.priors[label] = math.log(docs[label] / len(labels))
+            self.weights[label] = {f: math.log((c + self.alpha) / denominator) for f, c in label_counts.items()}
+            self.unseen[label] = math.log(self.alpha / denominator)
+        self.vocabulary = vocabulary
+        return self
+
+    def predict_proba(self, text: str) -> dict:
+        features = {f: c for f, c in _tokens(text).items() if f in self.vocabulary}
+        scores = {
+            label: self.priors[label] + sum(c * weights.get(f, self.unseen[label]) for f, c in features.items())
+            for label, weights in self.weights.items()
+        }
+        top = max(scores.values())
+        exp = {label: math.exp(score - top) for label, score in scores.items()}
+        total = sum(exp.values())
+        return {label: value / total for label, value in exp.items()}
+
+    def predict(self, text: str) -> tuple[str, float]:
+        probabilities = self.predict_proba(text)
+        label = max(probabilities, key=probabilities.get)
+        return label, probabilities[label]
+
+
+_model = None
+_lock = threading.Lock()
+
+
+def load_training_items() -> list[dict]:
+    with open(DATASET_PATH, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def train(items: list[dict]) -> NaiveBayes:
+    """
+    Fits a classifier on labeled utterances ({"text", "expected": command or
+    null}). The canonical exercise names of the labeled commands (plus the
+    ALIASES) are kept as `exercise_names`: a coach or progress request must name one.
+    """
+    model = NaiveBayes().fit(
+        [item["text"] for item in items],
+        [item["expected"]["tool"] if item["expected"] else FALLBACK for item in items],
+    )
+    names = set(ALIASES) | set(ALIASES.values())
+    for item in items:
+        expected = item["expected"] or {}
+        names.add(expected.get("exercise") or "")
+        names.update(entry.get("exercise") or "" for entry in expected.get("exercises") or [])
+    model.exercise_names = {canonical_exercise(name) for name in names if name}
+    return model
+
+
+def get_model() -> NaiveBayes:
+    """Trains the classifier from the labeled dataset on first call."""
+    global _model
+    if _model is None:
+        with _lock:
+            if _model is None:
+                _model = train(load_training_items())
+    return _model
+
+
+def _exercise(text: str, history) -> str | None:
+    words = re.findall(r"[a-z][a-z\-']*", text.lower())
+    context = last_exercise_context(history)
+    if context and any(word in PRONOUNS for word in words):
+        return context["exercise"]
+    anchors = [i for i, word in enumerate(words) if word in EXERCISE_ANCHORS]
+    if anchors and anchors[-1] < len(words) - 1:
+        words = words[anchors[-1] + 1:]
+    # The name is the first run of non-request words ("my squat is stuck" -> "squat").
+    name_words = []
+    for word in words:
+        if word in INTENT_WORDS or word in PRONOUNS or word in NOT_EXERCISE:
+            if name_words:
+                break
+            continue
+        name_words.append(word)
+    name = " ".join(name_words[:4])
+    if name and EXERCISE_NAME_RE.match(name):
+        return name.title()
+    return context["exercise"] if context else None
+
+
+def _log_slots(text: str, history) -> dict | None:
+    """
+    Lenient version of the local router's log parsing. The set count must be in
+    the message; reps and weight may come from the last logged set, but only
+    when it was the same exercise ("another set of 8" after bench). Missing
+    numbers are left out, so validation rejects the command instead of logging
+    invented data.
+    """
+    context = last_exercise_context(history) or {}
+    remaining = text
+    sets = reps = weight_kg = None
+    match = SETS_X_REPS_RE.search(remaining) or SETS_OF_REPS_RE.search(remaining)
+    if match:
+        sets, reps = _count(match.group(1)), int(match.group(2))
+        remaining = remaining.replace(match.group(0), " ")
+    elif ANOTHER_SET_RE.search(remaining):
+        sets = 1
+        reps_match = SET_OF_REPS_RE.search(remaining)
+        if reps_match:
+            reps = int(reps_match.group(1))
+        remaining = ANOTHER_SET_RE.sub(" ", remaining)
+    weight = WEIGHT_RE.search(remaining)
+    if weight:
+        value, unit = (weight.group(1), weight.group(2)) if weight.group(1) else (weight.group(3), weight.group(4))
+        weight_kg = _to_kg(value, unit)
+        remaining = remaining.replace(weight.group(0), " ")
+    words = []
+    for word in re.findall(r"[a-z][a-z\-']*", remaining.lower()):
+        if word in NOT_EXERCISE:
+            # The rest is commentary ("..., felt strong").
+            break
+        if word not in LOG_FILLER and word not in LOG_VERBS and word not in PRONOUNS:
+            words.append(word)
+    name = " ".join(words[:4])
+    if len(words) == 1 and words[0] in LIFT_VERBS:
+        exercise = LIFT_VERBS[words[0]]
+    else:
+        exercise = name.title() if name and EXERCISE_NAME_RE.match(name) else None
+    exercise = exercise or context.get("exercise")
+    same = bool(exercise and context.get("exercise")) and (
+        canonical_exercise(exercise) == canonical_exercise(context["exercise"])
+    )
+    return {
+        "tool": "log_session",
+        "exercise": exercise,
+        "sets": sets,
+        "reps": reps if reps is not None or not same else context.get("reps"),
+        "weight_kg": weight_kg if weight_kg is not None or not same else context.get("weight_kg"),
+    }
+
+
+def _slots(tool: str, text: str, history) -> dict:
+    if tool == "log_session":
+        return _log_slots(text, history)
+    if tool == "log_workout":
+        segments = [s for s in SEGMENT_SPLIT_RE.split(text) if s and s.strip()]
+        return _route_workout(text, history) or {
+            "tool": tool, "exercises": [_log_slots(segment, history) for segment in segments],
+        }
+    if tool in ("coach_agent", "get_progress"):
+        command = {"tool": tool, "exercise": _exercise(text, history)}
+        window = PROGRESS_WINDOW_RE.search(text.rstrip("?"))
+        if tool == "get_progress" and window:
+            count = _count(window.group(1)) if window.group(1) else 1
+            unit = window.group(2).lower()
+            command["weeks"] = count * (52 if unit.startswith("year") else 4 if unit.startswith("month") else 1)
+        return command
+    if tool == "set_name":
+        names = [name for name in SET_NAME_SLOT_RE.findall(text) if not _not_a_name(name)]
+        return {"tool": tool, "name": names[0].capitalize() if names else None}
+    return {"tool": tool}
+
+
+def _not_a_name(word: str) -> bool:
+    word = word.lower()
+    return any(word in words for words in (NOT_A_NAME, INTENT_WORDS, PRONOUNS, NOT_EXERCISE, LOG_FILLER))
+
+
+def _log_tool(text: str) -> str | None:
+    """Messages with a sets/reps scheme are logs whatever the classifier says; several schemes are a workout."""
+    schemes = len(SETS_X_REPS_RE.findall(text)) + len(SETS_OF_REPS_RE.findall(text))
+    corrections = any(LAST_SET_RE.match(s.strip()) for s in SEGMENT_SPLIT_RE.split(text) if s and s.strip())
+    if schemes > 1 or (schemes and corrections):
+        return "log_workout"
+    if schemes or ANOTHER_SET_RE.search(text):
+        return "log_session"
+    return None
+
+
+def _predict(user_input: str, model: NaiveBayes | None) -> tuple[str, float]:
+    tool, confidence = (model or get_model()).predict(user_input)
+    log_tool = _log_tool(user_input)
+    if log_tool:
+        return log_tool, 1.0
+    if tool == "get_progress" and not PROGRESS_CUE_RE.search(user_input):
+        return FALLBACK, confidence
+    return tool, confidence
+
+
+def classify(user_input: str, history, model: NaiveBayes | None = None) -> dict | None:
+    """
+    Routes a message without Gemini. Returns a validated tool command, or None
+    when the message looks like small talk, the intent is uncertain or a
+    required slot cannot be filled. `model` replaces the shared classifier
+    (the evaluation scores held-out folds with their own models).
+    """
+    model = model or get_model()
+    tool, confidence = _predict(user_input, model)
+    command = None
+    if tool != FALLBACK and confidence >= MIN_CONFIDENCE:
+        try:
+            command = agents.tool_schemas.validate_command(_slots(tool, user_input, history))
+        except ValueError:
+            command = None
+    if command and tool in ("coach_agent", "get_progress") and not _known_exercise(command["exercise"], model, history):
+        # "how much protein do I need" is not a coaching request about "Need",
+        # nor "I hate squats" one about "Hate Squats".
+        command = None
+    _OFFLINE_STATS.get()["routed" if command else "fallback"] += 1
+    return command
+
+
+def _known_exercise(name: str, model: NaiveBayes, history) -> bool:
+    """True when `name` is a known exercise phrase, or the exercise the lifter just logged."""
+    key = canonical_exercise(name)
+    context = last_exercise_context(history)
+    return key in model.exercise_names or bool(context) and key == canonical_exercise(context["exercise"])
+
+
+def is_incomplete_log(user_input: str) -> bool:
+    """True for a message that logs training but lacks the numbers classify() needs ("did some deadlifts")."""
+    tool, confidence = _predict(user_input, None)
+    if tool in LOG_TOOLS and confidence >= MIN_CONFIDENCE:
+        return True
+    return bool(LOG_CUE_RE.search(user_input)) and not SETS_X_REPS_RE.search(user_input)
+
+
+def use_offline_stats(stats: dict):
+    """Counts the current context's offline routing in `stats` ({"routed", "fallback"}) instead of OFFLINE_STATS."""
+    return _OFFLINE_STATS.set(stats)
+
+
+def get_offline_stats() -> dict:
+    return dict(OFFLINE_STATS)
@@ -1,10 +1,8 @@
-import os
 import datetime as dt
-from db.mock_db import log_session_mock
-from db.firebase_db import save_session
-
-# Checking firebase Key exists
-USE_FIREBASE = os.path.exists("db/serviceAccountKey.json")
+import db.aggregates
+from db.backend import active_backend, current_sandbox, current_user, get_backend
+import resilience
+from logs import log_event, span
 
 # Agent that log each exercise, either on Firebase or on a Mock_db (depends on the environment)
 def log_session(
@@ -27,6 +25,8 @@ def log_session(
     Returns:
         A success message indicating the data has been logged.
     """
+    # Load the rollups before writing so the new entry is counted exactly once.
+    aggregates = get_aggregates([exercise])
     today = dt.date.today().isoformat()
     new_exercise = {
         "timestamp": dt.datetime.now().isoformat(),
@@ -35,10 +35,121 @@ def log_session(
         "reps": reps,
         "weight_kg": weight_kg,
     }
-    if USE_FIREBASE:
-        print("✅ Using FIREBASE DB...")
-        results = save_session(today, new_exercise)
-        return results 
-    else:
-        print("✅ Using Mock DB...")
-        return log_session_mock(exercise, sets, reps, weight_kg)
\ No newline at end of file
+    backend = active_backend()
+    user = current_user()
+    with span("db.write", backend=backend):
+        if backend == "firebase":
+            print("✅ Using FIREBASE DB...")
+            results = get_backend().save_session(today, new_exercise, user_id=user)
+        elif backend == "sqlite":
+            print("✅ Using SQLite DB...")
+            results = get_backend().log_session_sqlite(exercise, sets, reps, weight_kg, user_id=user)
+        else:
+            print("✅ Using Mock DB...")
+            results = get_backend().log_session_mock(exercise, sets, reps, weight_kg, user_id=user)
+
+    flags = aggregates.record({**new_exercise, "date_string": today})
+    if flags["weight_pr"] or flags["e1rm_pr"]:
+        results["message"] += f" 🏆 New personal record for {exercise}!"
+    return results
+
+
+def expand_sets(entry: dict) -> list[dict]:
+    """
+    Turns one validated log_workout entry into stored rows: uniform sets stay a
+    single row, per-set detail becomes one row per run of identical sets
+    (e.g. 4x5 at 100kg + 1x4 at 100kg), so volume and PRs stay exact.
+    """
+    details = entry.get("set_details")
+    if not details:
+        return [{key: entry[key] for key in ("exercise", "sets", "reps", "weight_kg")}]
+    rows = []
+    for detail in details:
+        if rows and rows[-1]["reps"] == detail["reps"] and rows[-1]["weight_kg"] == detail["weight_kg"]:
+            rows[-1]["sets"] += 1
+        else:
+            rows.append({"exercise": entry["exercise"], "sets": 1, "reps": detail["reps"], "weight_kg": detail["weight_kg"]})
+    return rows
+
+
+def log_workout(exercises: list[dict]) -> dict:
+    """
+    Logs a whole workout (validated log_workout entries) with one bulk write
+    to the active backend. Returns the ids of the stored rows and one
+    confirmation line per row.
+    """
+    aggregates = get_aggregates([entry["exercise"] for entry in exercises])
+    today = dt.date.today().isoformat()
+    start = dt.datetime.now()
+    rows = [row for entry in exercises for row in expand_sets(entry)]
+    for offset, row in enumerate(rows):
+        # Distinct timestamps keep the rows in the order they were logged.
+        row["timestamp"] = (start + dt.timedelta(microseconds=offset)).isoformat()
+
+    backend = active_backend()
+    user = current_user()
+    with span("db.write", backend=backend, rows=len(rows)):
+        if backend == "firebase":
+            results = get_backend().save_sessions(today, rows, user_id=user)
+        elif backend == "sqlite":
+            results = get_backend().log_sessions_sqlite(rows, user_id=user)
+        else:
+            results = get_backend().log_sessions_mock(rows, user_id=user)
+
+    records = []
+    for row in rows:
+        flags = aggregates.record({**row, "date_string": today})
+        if (flags["weight_pr"] or flags["e1rm_pr"]) and row["exercise"] not in records:
+            records.append(row["exercise"])
+    message = "\n".join(result["message"] for result in results)
+    if records:
+        message += f"\n🏆 New personal record for {', '.join(records)}!"
+    return {"ids": [result["id"] for result in results], "message": message}
+
+
+def get_aggregates(exercises=()) -> db.aggregates.TrainingAggregates:
+    """
+    The current user's training rollups, loaded the first time they are needed.
+    SQLite and the mock store rebuild them from the whole history. Firestore
+    seeds them from the latest session, then each exercise in `exercises` from
+    that exercise's history on first use, so no turn reads the whole collection.
+    """
+    store = current_sandbox()
+    aggregates = store.aggregates if store is not None else db.aggregates.for_user(current_user())
+    try:
+        if not aggregates.loaded:
+            if active_backend() == "firebase":
+                aggregates.rebuild(query_logs(last_sessions=1), complete=False)
+            else:
+                aggregates.rebuild(_history_entries())
+        for exercise in exercises:
+            if aggregates.needs_seed(exercise):
+                aggregates.seed_exercise(exercise, query_logs(exercise))
+    except resilience.DependencyUnavailable as e:
+        # The history cannot be read right now: use empty throwaway rollups (no PR
+        # is ever flagged against them) and retry loading on the next call.
+        log_event("Logging Agent", f"Training rollups unavailable: {e}")
+        return db.aggregates.TrainingAggregates()
+    return aggregates
+
+
+def query_logs(exercise: str | None = None, start_date: str | None = None, end_date: str | None = None,
+               last_sessions: int | None = None) -> list[dict]:
+    """
+    Logged exercises in a window (exercise, inclusive ISO date range, last N
+    sessions; all optional), oldest first. Each backend filters natively, so
+    reads stay proportional to the window rather than to the whole history.
+    """
+    backend = active_backend()
+    with span("db.query", backend=backend) as current:
+        rows = get_backend().query_logs(exercise, start_date, end_date, last_sessions, user_id=current_user())
+        current.set(rows=len(rows))
+    return rows
+
+
+def _history_entries():
+    # The user's whole history, read once per process: PR flags need every earlier set.
+    user = current_user()
+    if active_backend() == "sqlite":
+        return get_backend().iter_logs(user_id=user)
+    return [ex for session in get_backend().get_all_logs(user_id=user).values() for ex in session["exercises"]]
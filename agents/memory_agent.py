@@ -1,11 +1,23 @@
+import contextvars
+
 memory = {}
 
+# Memory used by the current session. The CLI keeps the module-level dict;
+# server sessions bind their own dict with use_memory().
+_ACTIVE_MEMORY = contextvars.ContextVar("gymini_memory", default=memory)
+
+
+def use_memory(session_memory: dict):
+    """Binds `session_memory` as the name memory for the current context."""
+    return _ACTIVE_MEMORY.set(session_memory)
+
+
 def set_name(name):
     #print(f"Set name function here, and I am saving : {name}")
-    memory["user_name"] = name.title()
+    _ACTIVE_MEMORY.get()["user_name"] = name.title()
     return f"Got it, I'll remember your name is {name.title()}."
 
 def get_name():
     #print(f"Get name function here, and I am returning : {memory}")
-    name = memory.get("user_name")
+    name = _ACTIVE_MEMORY.get().get("user_name")
     return name
@@ -0,0 +1,146 @@
+import os
+import threading
+import time
+import datetime as dt
+import resilience
+from dotenv import load_dotenv
+from logs import annotate, log_event, span
+
+load_dotenv()
+
+# Shared Gemini model registry.
+# Each agent registers its static prompt once as a system instruction; the
+# GenerativeModel is built on first use (or by warm_up() at startup) and then
+# reused by every call and every thread, so requests only carry the dynamic
+# part of the prompt. google.generativeai itself is only imported (and
+# configured with GOOGLE_API_KEY) when the first model is built.
+
+MODEL_NAME = "models/gemini-2.5-flash"
+
+# Opt-in context caching for the system instructions. The API rejects caches
+# below its minimum token count, in which case we keep the plain model.
+USE_CONTEXT_CACHE = os.getenv("GYMINI_CONTEXT_CACHE", "0") == "1"
+CACHE_TTL = dt.timedelta(hours=1)
+
+# Every Gemini request (from any agent) goes through this policy: one circuit
+# breaker for the API, retries with jittered backoff on transient errors, and
+# hedging of slow calls when GYMINI_HEDGE_PERCENTILE is set.
+GEMINI_TIMEOUT = float(os.getenv("GYMINI_GEMINI_TIMEOUT", "20"))
+# Requests per minute allowed for this API key and model, shared by every
+# thread and session (0 disables the limit). Routing agents get interactive
+# priority; callers can lower it with resilience.priority("background").
+GEMINI_RPM = float(os.getenv("GYMINI_GEMINI_RPM", "1000"))
+AGENT_PRIORITY = {"router": "interactive", "stateful": "interactive"}
+
+
+def is_transient(error: Exception) -> bool:
+    # Imported lazily: google.api_core pulls in gRPC.
+    from google.api_core.exceptions import DeadlineExceeded, InternalServerError, ResourceExhausted, ServiceUnavailable
+    return isinstance(error, (ResourceExhausted, InternalServerError, ServiceUnavailable, DeadlineExceeded,
+                              ConnectionError, TimeoutError))
+
+
+GEMINI_POLICY = resilience.CallPolicy(
+    "gemini", timeout=GEMINI_TIMEOUT, max_attempts=5, base_delay=1.0, is_retryable=is_transient, hedge=True,
+    limiter=resilience.rate_limiter(f"gemini/{MODEL_NAME}", os.getenv("GOOGLE_API_KEY"), GEMINI_RPM),
+)
+
+_REGISTERED = {}
+_MODELS = {}
+_LOCK = threading.Lock()
+_genai = None
+
+
+def get_genai():
+    """Imports and configures google.generativeai on first use."""
+    global _genai
+    if _genai is None:
+        import google.generativeai as genai
+        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+        _genai = genai
+    return _genai
+
+
+def register(agent: str, system_instruction: str, options=None):
+    """
+    Registers an agent's static instructions. `options` is an optional callable
+    returning extra GenerativeModel arguments (e.g. tools), resolved lazily.
+    """
+    with _LOCK:
+        _REGISTERED[agent] = {"system_instruction": system_instruction, "options": options}
+        _MODELS.pop(agent, None)
+
+
+def _build(agent: str) -> dict:
+    genai = get_genai()
+    spec = _REGISTERED[agent]
+    options = spec["options"]() if spec["options"] else {}
+    if USE_CONTEXT_CACHE:
+        try:
+            cached = genai.caching.CachedContent.create(
+                model=MODEL_NAME,
+                display_name=f"gymini-{agent}",
+                system_instruction=spec["system_instruction"],
+                ttl=CACHE_TTL,
+                **options,
+            )
+            log_event("Model Registry", f"Context cache created for {agent}: {cached.name}")
+            return {
+                "model": genai.GenerativeModel.from_cached_content(cached),
+                "expires_at": time.monotonic() + CACHE_TTL.total_seconds() * 0.9,
+            }
+        except Exception as e:
+            log_event("Model Registry", f"Context cache unavailable for {agent}, using system instruction: {e}")
+    model = genai.GenerativeModel(MODEL_NAME, system_instruction=spec["system_instruction"], **options)
+    return {"model": model, "expires_at": None}
+
+
+def get_model(agent: str):
+    """Returns the shared model for `agent`, building it once (thread-safe)."""
+    entry = _MODELS.get(agent)
+    if entry and (entry["expires_at"] is None or entry["expires_at"] > time.monotonic()):
+        return entry["model"]
+    with _LOCK:
+        entry = _MODELS.get(agent)
+        if not entry or (entry["expires_at"] is not None and entry["expires_at"] <= time.monotonic()):
+            entry = _build(agent)
+            _MODELS[agent] = entry
+        return entry["model"]
+
+
+def generate(agent: str, prompt: str, **kwargs):
+    """Sends `prompt` to the agent's model under GEMINI_POLICY."""
+    level = resilience.current_priority(AGENT_PRIORITY.get(agent, "normal"))
+    with span(f"llm.{agent}", agent=agent, stream=bool(kwargs.get("stream")), priority=level), resilience.priority(level):
+        model = get_model(agent)
+        response = GEMINI_POLICY.call(
+            lambda timeout: model.generate_content(prompt, request_options={"timeout": timeout}, **kwargs)
+        )
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            annotate(prompt_tokens=usage.prompt_token_count, output_tokens=usage.candidates_token_count)
+        return response
+
+
+def available() -> bool:
+    """False while Gemini calls would be refused at once (circuit open or the turn budget spent)."""
+    remaining = resilience.remaining_budget()
+    return not GEMINI_POLICY.breaker.is_open() and (remaining is None or remaining > 0)
+
+
+def warm_up():
+    """Builds every registered model and opens the API connection ahead of the first prompt."""
+    start = time.perf_counter()
+    for agent in list(_REGISTERED):
+        get_model(agent)
+    try:
+        get_genai().get_model(MODEL_NAME)
+    except Exception as e:
+        log_event("Model Registry", f"Warm-up request failed: {e}")
+    log_event("Model Registry", f"Warmed {len(_MODELS)} models in {time.perf_counter() - start:.2f}s")
+
+
+def warm_up_in_background() -> threading.Thread:
+    thread = threading.Thread(target=warm_up, name="gymini-warm-up", daemon=True)
+    thread.start()
+    return thread
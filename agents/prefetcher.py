@@ -0,0 +1,315 @@
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+import agents.coach_agent
+import agents.gymini_agent
+import agents.model_registry
+import agents.response_cache
+import agents.summary_agent
+import resilience
+from agents.exercise_names import canonical_exercise
+from logs import SESSION_ID, log_event, root_span
+
+# Speculative prefetch of coaching tips and summary rewrites.
+# Users usually ask for tips on the exercise they just logged (or switched to)
+# and for a summary right after logging, so those turns schedule the follow-up
+# work on a small pool of background workers: the coach pipeline (search +
+# Gemini rewrite) fills the tip cache, and the summary rewrite fills the
+# response cache. The foreground request then finds the warm result, or waits
+# for a prefetch that is already running instead of repeating it.
+#
+# Prefetching only uses idle time and a bounded share of the API quota: jobs
+# start only while no foreground turn is running, at most
+# GYMINI_PREFETCH_BUDGET jobs per hour are started, and nothing starts while
+# the Gemini circuit is open; its API calls run at background priority in the
+# shared rate limiters. Queued jobs are cancelled when the user moves on to
+# another exercise or asks for the result first. Off unless GYMINI_PREFETCH=1.
+# Keys are scoped by session (logs.SESSION_ID), so one lifter's warm summary or
+# pending tip is never claimed or cancelled by another.
+
+PREFETCH_ENABLED = os.getenv("GYMINI_PREFETCH", "0") == "1"
+PREFETCH_WORKERS = int(os.getenv("GYMINI_PREFETCH_WORKERS", "2"))
+PREFETCH_QUEUE = int(os.getenv("GYMINI_PREFETCH_QUEUE", "8"))
+PREFETCH_BUDGET = int(os.getenv("GYMINI_PREFETCH_BUDGET", "30"))
+BUDGET_WINDOW = 3600
+# Latency budget of one prefetch job, and how long a foreground request waits for a running one.
+PREFETCH_TIMEOUT = float(os.getenv("GYMINI_PREFETCH_TIMEOUT", "30"))
+PREFETCH_WAIT = float(os.getenv("GYMINI_PREFETCH_WAIT", "10"))
+# Finished results nobody asked for yet; the oldest are forgotten (and counted as wasted).
+MAX_WARMED = 64
+
+def summary_key() -> tuple:
+    return ("summary", SESSION_ID.get())
+
+
+def tip_key(exercise: str) -> tuple:
+    return ("tip", SESSION_ID.get(), canonical_exercise(exercise))
+
+
+class Job:
+    def __init__(self, key: tuple, fn, context: contextvars.Context | None = None):
+        self.key = key
+        self.fn = fn
+        # Runs in the scheduling turn's context (session memory, storage sandbox).
+        self.context = context or contextvars.copy_context()
+        self.done = threading.Event()
+        # Set (to the refreshing turn's context) when the inputs changed while
+        # the job was running: its result is stale and the job runs again.
+        self.rerun = None
+
+
+class Prefetcher:
+    def __init__(self, workers: int = PREFETCH_WORKERS, max_queue: int = PREFETCH_QUEUE,
+                 budget: int = PREFETCH_BUDGET, window: float = BUDGET_WINDOW, enabled: bool = PREFETCH_ENABLED):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.budget = budget
+        self.window = window
+        self.enabled = enabled
+        self.stats = {
+            "scheduled": 0, "started": 0, "completed": 0, "failed": 0, "cancelled": 0, "dropped": 0,
+            "skipped": 0, "hits": 0, "misses": 0, "wasted": 0,
+        }
+        self._queue = deque()
+        self._queued = {}
+        self._running = {}
+        self._warmed = OrderedDict()
+        self._started_at = deque()
+        self._active = {}
+        self._foreground = 0
+        self._threads = []
+        self._closed = False
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def foreground(self):
+        """Marks a foreground turn as running: no prefetch job starts until it ends."""
+        with self._cond:
+            self._foreground += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._foreground -= 1
+                self._cond.notify_all()
+
+    def submit(self, key: tuple, fn, refresh: bool = False, context: contextvars.Context | None = None) -> bool:
+        """
+        Queues `fn()` to warm the result named `key`, unless it is already queued,
+        running or warm. `refresh=True` means earlier results for `key` are stale
+        (e.g. the summary after a new log): they are discarded and recomputed.
+        Returns True if a job was queued.
+        """
+        if not self.enabled:
+            return False
+        with self._cond:
+            if self._closed or key in self._queued:
+                return False
+            if key in self._running:
+                if refresh:
+                    self._running[key].rerun = contextvars.copy_context()
+                return False
+            if key in self._warmed:
+                if not refresh:
+                    return False
+                del self._warmed[key]
+                self.stats["wasted"] += 1
+            if len(self._queue) >= self.max_queue:
+                # The newest request is the likeliest follow-up: drop the oldest one.
+                oldest = self._queue.popleft()
+                del self._queued[oldest.key]
+                self.stats["dropped"] += 1
+            job = Job(key, fn, context)
+            self._queue.append(job)
+            self._queued[key] = job
+            self.stats["scheduled"] += 1
+            self._start_workers()
+            self._cond.notify_all()
+        return True
+
+    def cancel(self, key: tuple) -> bool:
+        """Cancels a queued job (a running one finishes). Returns True if one was queued."""
+        with self._cond:
+            job = self._queued.pop(key, None)
+            if job is None:
+                return False
+            self._queue.remove(job)
+            self.stats["cancelled"] += 1
+            job.done.set()
+            return True
+
+    def cancel_all(self):
+        with self._cond:
+            keys = list(self._queued)
+        for key in keys:
+            self.cancel(key)
+
+    def set_active(self, key: tuple) -> tuple | None:
+        """Records the session's active exercise key and returns the previous one (if it changed)."""
+        session = SESSION_ID.get()
+        with self._cond:
+            previous = self._active.get(session)
+            self._active[session] = key
+        return previous if previous != key else None
+
+    def claim(self, key: tuple, timeout: float | None = None) -> bool:
+        """
+        Called by the foreground request for `key`: waits for a running prefetch
+        (up to `timeout` seconds), cancels a queued one (the caller is about to do
+        the work itself) and returns True if a warm result is ready to be used.
+        """
+        if not self.enabled:
+            return False
+        self.cancel(key)
+        with self._cond:
+            job = self._running.get(key)
+        if job is not None:
+            if timeout is None:
+                remaining = resilience.remaining_budget()
+                timeout = PREFETCH_WAIT if remaining is None else min(PREFETCH_WAIT, max(0.0, remaining))
+            job.done.wait(timeout)
+        with self._cond:
+            if self._warmed.pop(key, None) is not None:
+                self.stats["hits"] += 1
+                return True
+            self.stats["misses"] += 1
+            return False
+
+    def get_stats(self) -> dict:
+        with self._cond:
+            claims = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "queued": len(self._queue),
+                "running": len(self._running),
+                "unused": len(self._warmed),
+                "hit_rate": round(self.stats["hits"] / claims, 3) if claims else 0.0,
+            }
+
+    def close(self, timeout: float | None = 5.0):
+        """Cancels queued jobs and stops the workers."""
+        self.cancel_all()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _start_workers(self):
+        # Called with the lock held; workers are only started once something is queued.
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._run, name=f"gymini-prefetch-{len(self._threads)}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def _within_budget(self) -> bool:
+        now = time.monotonic()
+        while self._started_at and now - self._started_at[0] >= self.window:
+            self._started_at.popleft()
+        if len(self._started_at) >= self.budget:
+            return False
+        self._started_at.append(now)
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and (not self._queue or self._foreground):
+                    self._cond.wait()
+                if self._closed:
+                    return
+                job = self._queue.popleft()
+                del self._queued[job.key]
+                if not self._within_budget() or not agents.model_registry.available():
+                    # Over budget, or Gemini is down: leave the quota to foreground turns.
+                    self.stats["skipped"] += 1
+                    job.done.set()
+                    continue
+                self._running[job.key] = job
+                self.stats["started"] += 1
+            ok = False
+            try:
+                ok = job.context.run(self._execute, job)
+            except Exception as e:
+                log_event("Prefetch", f"{job.key} failed: {type(e).__name__}: {e}")
+            with self._cond:
+                del self._running[job.key]
+                if not ok:
+                    self.stats["failed"] += 1
+                elif job.rerun is not None:
+                    self.stats["wasted"] += 1
+                else:
+                    self.stats["completed"] += 1
+                    self._warmed[job.key] = time.monotonic()
+                    while len(self._warmed) > MAX_WARMED:
+                        self._warmed.popitem(last=False)
+                        self.stats["wasted"] += 1
+                job.done.set()
+                self._cond.notify_all()
+            if ok and job.rerun is not None:
+                self.submit(job.key, job.fn, context=job.rerun)
+
+    @staticmethod
+    def _execute(job: Job) -> bool:
+        # Own trace and latency budget: the scheduling turn has usually ended by now.
+        with root_span("prefetch", key="/".join(str(part) for part in job.key)), resilience.turn_budget(PREFETCH_TIMEOUT), \
+                resilience.priority("background"):
+            return bool(job.fn())
+
+
+PREFETCHER = Prefetcher()
+
+
+def _warm_tip(exercise: str) -> bool:
+    """The coach branch's search + rewrite, stored in the tip cache."""
+    if agents.coach_agent.get_cached_tip(exercise):
+        return True
+    results = agents.coach_agent.coach_tools(exercise)
+    tip = agents.gymini_agent.generate_reply(results, "coach_rewrite")
+    if tip is None:
+        return False
+    agents.coach_agent.store_tip(exercise, tip)
+    return True
+
+
+def _warm_summary() -> bool:
+    """The summary branch's Gemini rewrite, stored in the response cache."""
+    prompt = agents.summary_agent.rewrite_prompt(agents.summary_agent.get_summary())
+    return agents.gymini_agent.ask_gymini(prompt, "summary") != agents.gymini_agent.FAILURE_MESSAGE
+
+
+def prefetch_tip(exercise: str):
+    """The session's active exercise is now `exercise`: warm its tip, drop the previous one's."""
+    if not PREFETCHER.enabled:
+        return
+    key = tip_key(exercise)
+    previous = PREFETCHER.set_active(key)
+    if previous is not None:
+        PREFETCHER.cancel(previous)
+    if agents.coach_agent.get_cached_tip(exercise) is None:
+        PREFETCHER.submit(key, lambda: _warm_tip(exercise))
+
+
+def after_log(exercise: str):
+    """Called after a log: warm the tip for the exercise and the (now changed) summary rewrite."""
+    if not PREFETCHER.enabled:
+        return
+    prefetch_tip(exercise)
+    # Without the response cache there is nowhere to keep a warm rewrite.
+    if agents.response_cache.enabled("summary"):
+        PREFETCHER.submit(summary_key(), _warm_summary, refresh=True)
+
+
+def claim_tip(exercise: str) -> bool:
+    return PREFETCHER.claim(tip_key(exercise))
+
+
+def claim_summary() -> bool:
+    return PREFETCHER.claim(summary_key())
+
+
+def get_stats() -> dict:
+    return PREFETCHER.get_stats()
@@ -0,0 +1,75 @@
+import hashlib
+import os
+import re
+import threading
+from agents.context_manager import estimate_tokens
+from agents.model_registry import MODEL_NAME
+from cache import CACHE_PATH, TwoTierCache
+
+# Response cache for repeated free-text prompts.
+# Branches whose prompts repeat (the fixed help prompt, the summary rewrite of
+# the same rollup, fallback suggestions, coach rewrites of the same search
+# results) opt in by name; the cached value is Gemini's raw text, so
+# personalization is still applied per user on every hit.
+
+# Comma-separated list of branches allowed to use the cache ("" disables it).
+CACHED_BRANCHES = {
+    branch.strip()
+    for branch in os.getenv("GYMINI_RESPONSE_CACHE", "help,summary,fallback,coach_rewrite").split(",")
+    if branch.strip()
+}
+RESPONSE_TTL = float(os.getenv("GYMINI_RESPONSE_CACHE_TTL", str(24 * 3600)))
+PERSIST = os.getenv("GYMINI_RESPONSE_CACHE_PERSIST", "1") == "1"
+
+RESPONSE_CACHE = TwoTierCache(
+    "llm_responses",
+    max_entries=int(os.getenv("GYMINI_RESPONSE_CACHE_SIZE", "512")),
+    ttl=RESPONSE_TTL,
+    path=CACHE_PATH if PERSIST else None,
+)
+
+_BRANCH_STATS = {}
+_stats_lock = threading.Lock()
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Collapses whitespace and case so trivially different prompts share an entry."""
+    return re.sub(r"\s+", " ", prompt).strip().casefold()
+
+
+def cache_key(agent: str, prompt: str) -> str:
+    raw = f"{MODEL_NAME}|{agent}|{normalize_prompt(prompt)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def enabled(branch: str | None) -> bool:
+    return branch is not None and branch in CACHED_BRANCHES
+
+
+def lookup(branch: str | None, agent: str, prompt: str) -> str | None:
+    """Returns the cached raw response for this prompt, or None (always None for opted-out branches)."""
+    if not enabled(branch):
+        return None
+    text = RESPONSE_CACHE.get(cache_key(agent, prompt))
+    with _stats_lock:
+        stats = _BRANCH_STATS.setdefault(branch, {"hits": 0, "misses": 0, "saved_tokens": 0})
+        if text is None:
+            stats["misses"] += 1
+        else:
+            stats["hits"] += 1
+            stats["saved_tokens"] += estimate_tokens(prompt) + estimate_tokens(text)
+    return text
+
+
+def store(branch: str | None, agent: str, prompt: str, text: str):
+    if enabled(branch) and text:
+        RESPONSE_CACHE.set(cache_key(agent, prompt), text)
+
+
+def get_stats() -> dict:
+    with _stats_lock:
+        branches = {}
+        for branch, stats in _BRANCH_STATS.items():
+            lookups = stats["hits"] + stats["misses"]
+            branches[branch] = {**stats, "hit_rate": round(stats["hits"] / lookups, 3) if lookups else 0.0}
+    return {"branches": branches, "cache": RESPONSE_CACHE.stats()}
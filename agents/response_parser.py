@@ -0,0 +1,171 @@
+import json
+import threading
+import agents.tool_schemas
+
+# Tolerant parsing of the tool JSON the models write as text.
+# Replies often wrap the object in code fences or a sentence, or break JSON in
+# small ways (trailing commas, single quotes, Python literals, unquoted keys,
+# smart quotes, a cut-off closing brace). The first object in the reply is
+# decoded as is when possible, otherwise repaired in one pass and decoded again,
+# then checked (and coerced) against agents.tool_schemas. Only replies that
+# cannot be recovered locally need another Gemini request.
+
+# '{' positions tried before giving up on a reply (prose can contain braces too).
+MAX_CANDIDATES = 3
+
+PARSE_STATS = {"clean": 0, "repaired": 0, "invalid": 0, "no_json": 0, "retries": 0}
+_stats_lock = threading.Lock()
+_decoder = json.JSONDecoder()
+
+SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "‘": "'", "’": "'"})
+PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+CLOSERS = {"{": "}", "[": "]"}
+
+
+def _count(outcome: str):
+    with _stats_lock:
+        PARSE_STATS[outcome] += 1
+
+
+def _read_string(text: str, start: int) -> tuple[str, int]:
+    """Reads the string literal opening at `start` (either quote). Returns it as JSON and the index after it."""
+    quote = text[start]
+    chars = []
+    i = start + 1
+    while i < len(text):
+        char = text[i]
+        if char == "\\" and i + 1 < len(text):
+            escaped = text[i + 1]
+            # \' is not a JSON escape; everything else is kept as written.
+            chars.append("'" if escaped == "'" else char + escaped)
+            i += 2
+            continue
+        if char == quote:
+            return '"' + "".join(chars) + '"', i + 1
+        if char == '"':
+            chars.append('\\"')
+        elif char == "\n":
+            chars.append("\\n")
+        else:
+            chars.append(char)
+        i += 1
+    # Unterminated: the reply was cut off.
+    return '"' + "".join(chars) + '"', i
+
+
+def repair(text: str, start: int = 0) -> str:
+    """
+    Rewrites the object opening at `text[start]` as strict JSON: single-quoted
+    strings, unquoted keys, Python literals and trailing commas are fixed, and
+    brackets left open at the end of the reply are closed. Text after the
+    object is ignored.
+    """
+    text = text.translate(SMART_QUOTES)
+    out = []
+    stack = []
+    i = start
+    while i < len(text):
+        char = text[i]
+        if char in "\"'":
+            literal, i = _read_string(text, i)
+            out.append(literal)
+            continue
+        if char in CLOSERS:
+            stack.append(CLOSERS[char])
+        elif char in "}]":
+            if not stack:
+                break
+            # Drop a trailing comma before the closing bracket.
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+            out.append(stack.pop())
+            i += 1
+            if not stack:
+                break
+            continue
+        elif char.isalpha() or char == "_":
+            end = i
+            while end < len(text) and (text[end].isalnum() or text[end] in "_-"):
+                end += 1
+            word = text[i:end]
+            rest = text[end:].lstrip()
+            if rest.startswith(":"):
+                out.append(json.dumps(word))
+            else:
+                out.append(PYTHON_LITERALS.get(word, word))
+            i = end
+            continue
+        out.append(char)
+        i += 1
+    while out and (out[-1].isspace() or out[-1] == ","):
+        out.pop()
+    out.extend(reversed(stack))
+    return "".join(out)
+
+
+def extract_json(text: str) -> dict | None:
+    """Returns the first JSON object in `text` (fenced, embedded in prose or slightly malformed), or None."""
+    if not text:
+        return None
+    start = text.find("{")
+    for _ in range(MAX_CANDIDATES):
+        if start < 0:
+            break
+        try:
+            data, _end = _decoder.raw_decode(text, start)
+            if isinstance(data, dict):
+                _count("clean")
+                return data
+        except json.JSONDecodeError:
+            try:
+                data = json.loads(repair(text, start))
+                if isinstance(data, dict):
+                    _count("repaired")
+                    return data
+            except json.JSONDecodeError:
+                pass
+        start = text.find("{", start + 1)
+    _count("no_json")
+    return None
+
+
+def parse_command(text: str) -> dict:
+    """
+    Extracts the tool command in a model reply and validates it with
+    agents.tool_schemas.validate_command. Raises ValueError when the reply holds
+    no JSON object or the command is invalid.
+    """
+    data = extract_json(text)
+    if data is None:
+        raise ValueError("no JSON object in the reply")
+    try:
+        return agents.tool_schemas.validate_command(data)
+    except ValueError:
+        _count("invalid")
+        raise
+
+
+def parse_with_retry(text: str, ask_again) -> dict | None:
+    """
+    parse_command, escalating to one more request only when the reply tried to
+    be a command and could not be recovered: `ask_again(error)` returns the new
+    reply. Returns None when there is no usable command (e.g. a free-text answer).
+    """
+    try:
+        return parse_command(text)
+    except ValueError as e:
+        if "tool" not in text:
+            return None
+        error = str(e)
+    _count("retries")
+    try:
+        return parse_command(ask_again(error))
+    except ValueError:
+        return None
+
+
+def get_stats() -> dict:
+    with _stats_lock:
+        return dict(PARSE_STATS)
@@ -0,0 +1,330 @@
+import contextvars
+import re
+import agents.tool_schemas
+from logs import traced
+
+# Local fast-path router: recognizes unambiguous commands with plain regexes
+# and emits the same tool JSON the controller dispatches on, so those turns
+# never reach Gemini. Anything it is not sure about returns None and falls
+# back to the LLM router.
+
+ROUTER_STATS = {"hits": 0, "misses": 0}
+# Stats the current context counts in (evaluations keep their own).
+_ROUTER_STATS = contextvars.ContextVar("gymini_router_stats", default=ROUTER_STATS)
+
+KG_PER_LB = 0.45359237
+
+NUMBER_WORDS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+    "seven": 7, "eight": 8, "nine": 9, "ten": 10, "twelve": 12, "fifteen": 15,
+}
+COUNT = r"(\d+|" + "|".join(NUMBER_WORDS) + r")"
+UNIT = r"(kg|kgs|kilos?|kilograms?|lbs?|pounds?)"
+
+SETS_X_REPS_RE = re.compile(r"\b(\d+)\s*[x×]\s*(\d+)\b", re.I)
+SETS_OF_REPS_RE = re.compile(COUNT + r"\s*sets?\s*(?:of|x)?\s*(\d+)\s*(?:reps?|repetitions?)?\b", re.I)
+ANOTHER_SET_RE = re.compile(r"\b(?:another|one more|1 more|an extra|extra)\s+set\b", re.I)
+REPS_ONLY_RE = re.compile(r"\b(?:of|for)?\s*(\d+)\s*(?:reps?|repetitions?)\b", re.I)
+WEIGHT_RE = re.compile(
+    r"(?:(?:\bat\b|@|\bwith\b|\busing\b)\s*(\d+(?:\.\d+)?)\s*" + UNIT + r"?\b"
+    r"|\b(\d+(?:\.\d+)?)\s*" + UNIT + r"\b)",
+    re.I,
+)
+
+# Words that can surround a log command without being part of the exercise name.
+LOG_FILLER = {
+    "log", "logged", "record", "add", "save", "please", "i", "i've", "ive", "did",
+    "just", "done", "have", "finished", "of", "for", "on", "reps", "rep", "sets",
+    "set", "at", "with", "kg", "the", "a", "my", "today", "x", "also", "got",
+}
+# Words that signal commentary or a question rather than an exercise name.
+NOT_EXERCISE = {
+    "but", "and", "then", "because", "felt", "feel", "hurt", "hurts", "how", "what",
+    "why", "should", "could", "can", "not", "don't", "didn't", "was", "is", "too",
+}
+# Multi-exercise messages: split into one segment per exercise, plus
+# "last set only 4 reps"-style corrections of the previous segment.
+SEGMENT_SPLIT_RE = re.compile(r"\s*(?:[;,\n]|\band then\b|\bthen\b|\bfollowed by\b|\bplus\b)\s*", re.I)
+LAST_SET_RE = re.compile(
+    r"^(?:but |and |with )?(?:the |my )?(?:last|final) set (?:was |only |just |was only )*"
+    r"(?:(?P<reps>\d+)(?: reps?)?)?\s*(?:(?:at|with|@)\s*(?P<weight>\d+(?:\.\d+)?)\s*" + UNIT + r"?)?$",
+    re.I,
+)
+PRONOUNS = {"it", "that", "them", "this", "those", "same", "again", "same exercise"}
+EXERCISE_NAME_RE = re.compile(r"^[a-z][a-z\- ]{1,40}$", re.I)
+
+SUMMARY_RE = re.compile(
+    r"^(?:(?:give|show|get|send) me )?(?:a |my |the )?(?:last |latest |today'?s )?"
+    r"(?:workout |session |training )?(?:summary|recap)"
+    r"(?: (?:of|for) (?:my |the |today'?s )?(?:last |latest )?(?:workout|session|training))?$"
+    r"|^summari[sz]e (?:my |the |today'?s )?(?:last |latest )?(?:workout|session|training)$"
+    r"|^how did (?:i|my (?:workout|session)) do today$",
+    re.I,
+)
+TIP_RE = re.compile(
+    r"^(?:(?:can you |could you )?(?:give|get|show|send)(?: me)? )?(?:some |a |any |more )?"
+    r"(?:tips?|advice|cues|pointers|form tips?)\s+(?:for|on|about)\s+(?:my |the |doing )?"
+    r"(?P<exercise>[a-z][a-z \-]{1,40})$",
+    re.I,
+)
+PROGRESS_RE = re.compile(
+    r"^(?:(?:show|give|get)(?: me)? )?(?:my |the )?(?P<a>[a-z][a-z \-]{1,40}?) progress(?:ion)?$"
+    r"|^(?:(?:show|give|get)(?: me)? )?(?:my |the )?progress (?:on|for|with|in) (?:my |the )?(?P<b>[a-z][a-z \-]{1,40})$"
+    r"|^how (?:has|have|is|are|did) (?:my |the )?(?P<c>[a-z][a-z \-]{1,40}?) "
+    r"(?:moved|move|progressed|progressing|progress|improved|improving|improve|developed|going|been going|changed)$",
+    re.I,
+)
+PROGRESS_WINDOW_RE = re.compile(
+    r"\s+(?:in|over|for|during|across)\s+(?:the\s+)?(?:last|past)\s+(?:" + COUNT + r"\s+)?(weeks?|months?|years?)$",
+    re.I,
+)
+# Progress questions about training as a whole are left to the LLM.
+NOT_PROGRESS_EXERCISE = {"training", "workout", "workouts", "session", "sessions", "lifting", "gym", "strength"}
+SET_NAME_RE = re.compile(
+    r"^(?:(?:hi|hey|hello),? )?(?:my name is|my name's|call me)\s+"
+    r"(?P<name>[a-z][a-z'\-]*(?: [a-z][a-z'\-]*)?)$",
+    re.I,
+)
+GET_NAME_RE = re.compile(r"^(?:what(?:'s| is) my name|do you (?:know|remember) my name|who am i)$", re.I)
+HELP_RE = re.compile(r"^(?:help|what can you do|what do you do|what are your features|how can you help(?: me)?)$", re.I)
+CREATOR_RE = re.compile(r"^who (?:made|created|built) you$", re.I)
+EVALUATE_RE = re.compile(r"^(?:run (?:an |the )?evaluation|evaluate (?:all )?(?:the )?agents)$", re.I)
+
+# History patterns used to resolve "it"/"them" to the last exercise.
+LOG_CONFIRMATION_RE = re.compile(
+    r"Successfully logged (\d+) sets of (\d+) reps of (.+?) at (\d+(?:\.\d+)?)kg", re.I
+)
+TIPS_HEADER_RE = re.compile(r"Tips for (.+?):", re.I)
+SWITCH_EXERCISE_RE = re.compile(
+    r"^(?:now |next )?(?:i'?m |i am )?(?:doing|switching to|moving on to|moving to|starting)\s+"
+    r"(?:some |the )?(?P<exercise>[a-z][a-z \-]{1,40})$",
+    re.I,
+)
+
+
+def _clean(user_input: str) -> str:
+    text = " ".join(user_input.strip().split())
+    text = re.sub(r"^(?:please|ok|okay|now),?\s+", "", text, flags=re.I)
+    text = re.sub(r"[\s,]*(?:please|thanks|thank you)$", "", text, flags=re.I)
+    return text.rstrip(".!").strip()
+
+
+def _count(token: str) -> int:
+    return int(token) if token.isdigit() else NUMBER_WORDS[token.lower()]
+
+
+def _to_kg(value: str, unit: str | None) -> float:
+    weight = float(value)
+    if unit and unit.lower().startswith(("lb", "pound")):
+        weight *= KG_PER_LB
+    return round(weight, 1)
+
+
+def _history_text(message: dict) -> str:
+    return " ".join(part.get("text", "") for part in message.get("parts", []))
+
+
+def last_exercise_context(history: list[dict]) -> dict | None:
+    """
+    Walks the chat history backwards and returns the most recently mentioned
+    exercise, with the reps/weight of its last logged set when known.
+    A ConversationContext already tracks this as state, so it is read directly.
+    """
+    if hasattr(history, "active_exercise"):
+        return history.active_exercise()
+    for message in reversed(history or []):
+        text = _history_text(message) or ""
+        if message.get("role") == "model":
+            logged = LOG_CONFIRMATION_RE.search(text)
+            if logged:
+                return {
+                    "exercise": logged.group(3),
+                    "sets": int(logged.group(1)),
+                    "reps": int(logged.group(2)),
+                    "weight_kg": float(logged.group(4)),
+                }
+            tips = TIPS_HEADER_RE.search(text)
+            if tips:
+                return {"exercise": tips.group(1).strip()}
+        else:
+            switched = SWITCH_EXERCISE_RE.match(_clean(text))
+            if switched:
+                return {"exercise": switched.group("exercise").strip().title()}
+    return None
+
+
+def _resolve_exercise(name: str, history: list[dict]) -> tuple[str | None, dict | None]:
+    name = name.strip()
+    if not name or name.lower() in PRONOUNS:
+        context = last_exercise_context(history)
+        return (context["exercise"], context) if context else (None, None)
+    if not EXERCISE_NAME_RE.match(name) or len(name.split()) > 4:
+        return None, None
+    return name.title(), None
+
+
+def _route_log(text: str, history: list[dict]) -> dict | None:
+    if "?" in text:
+        return None
+    remaining = text
+    sets = reps = None
+
+    matches = SETS_X_REPS_RE.findall(remaining) + SETS_OF_REPS_RE.findall(remaining)
+    if len(matches) > 1:
+        # Several exercises or set schemes in one message: leave it to the LLM.
+        return None
+    if matches:
+        sets, reps = _count(matches[0][0]), int(matches[0][1])
+        remaining = SETS_X_REPS_RE.sub(" ", remaining)
+        remaining = SETS_OF_REPS_RE.sub(" ", remaining)
+    elif ANOTHER_SET_RE.search(remaining):
+        sets = 1
+        remaining = ANOTHER_SET_RE.sub(" ", remaining)
+        reps_match = REPS_ONLY_RE.search(remaining)
+        if reps_match:
+            reps = int(reps_match.group(1))
+            remaining = REPS_ONLY_RE.sub(" ", remaining)
+    else:
+        return None
+
+    weights = WEIGHT_RE.findall(remaining)
+    if len(weights) != 1:
+        return None
+    value, unit = (weights[0][0], weights[0][1]) if weights[0][0] else (weights[0][2], weights[0][3])
+    weight_kg = _to_kg(value, unit)
+    remaining = WEIGHT_RE.sub(" ", remaining)
+
+    words = [w for w in re.split(r"[\s,]+", remaining.lower()) if w and w not in LOG_FILLER]
+    if any(any(ch.isdigit() for ch in w) or w in NOT_EXERCISE for w in words):
+        return None
+    exercise, context = _resolve_exercise(" ".join(words), history)
+    if not exercise:
+        return None
+    if reps is None:
+        if not context or "reps" not in context:
+            return None
+        reps = context["reps"]
+
+    return {
+        "tool": "log_session",
+        "exercise": exercise,
+        "sets": sets,
+        "reps": reps,
+        "weight_kg": weight_kg,
+    }
+
+
+def _route_workout(text: str, history: list[dict]) -> dict | None:
+    """Several exercises (or a last-set correction) in one message -> one log_workout command."""
+    if "?" in text:
+        return None
+    segments = [s for s in SEGMENT_SPLIT_RE.split(text) if s and s.strip()]
+    if len(segments) < 2:
+        return None
+    exercises = []
+    for segment in segments:
+        last_set = LAST_SET_RE.match(segment.strip())
+        if last_set and (last_set.group("reps") or last_set.group("weight")):
+            if not exercises:
+                return None
+            entry = exercises[-1]
+            details = entry.setdefault(
+                "set_details", [{"reps": entry["reps"], "weight_kg": entry["weight_kg"]} for _ in range(entry["sets"])]
+            )
+            if last_set.group("reps"):
+                details[-1]["reps"] = int(last_set.group("reps"))
+            if last_set.group("weight"):
+                details[-1]["weight_kg"] = _to_kg(last_set.group("weight"), last_set.group(3))
+            continue
+        command = _route_log(segment, history)
+        if command is None:
+            # Any segment we cannot read with certainty sends the whole message to the LLM.
+            return None
+        exercises.append({key: command[key] for key in ("exercise", "sets", "reps", "weight_kg")})
+    if len(exercises) == 1 and "set_details" not in exercises[0]:
+        return None
+    return {"tool": "log_workout", "exercises": exercises}
+
+
+def _route_progress(text: str, history: list[dict]) -> dict | None:
+    text = text.rstrip("?").strip()
+    weeks = None
+    window = PROGRESS_WINDOW_RE.search(text)
+    if window:
+        count = _count(window.group(1)) if window.group(1) else 1
+        unit = window.group(2).lower()
+        weeks = count * (52 if unit.startswith("year") else 4 if unit.startswith("month") else 1)
+        text = text[:window.start()]
+    match = PROGRESS_RE.match(text)
+    if not match:
+        return None
+    name = match.group("a") or match.group("b") or match.group("c")
+    if name.lower().strip() in NOT_PROGRESS_EXERCISE:
+        return None
+    exercise, _ = _resolve_exercise(name, history)
+    if not exercise:
+        return None
+    command = {"tool": "get_progress", "exercise": exercise}
+    if weeks:
+        command["weeks"] = weeks
+    return command
+
+
+def _route_tip(text: str, history: list[dict]) -> dict | None:
+    match = TIP_RE.match(text.rstrip("?"))
+    if not match:
+        return None
+    exercise, _ = _resolve_exercise(match.group("exercise"), history)
+    if not exercise:
+        return None
+    return {"tool": "coach_agent", "exercise": exercise}
+
+
+def _route_fixed(text: str) -> dict | None:
+    text = text.rstrip("?").strip()
+    if SUMMARY_RE.match(text):
+        return {"tool": "get_summary"}
+    name = SET_NAME_RE.match(text)
+    if name:
+        return {"tool": "set_name", "name": name.group("name")}
+    if GET_NAME_RE.match(text):
+        return {"tool": "get_name"}
+    if HELP_RE.match(text):
+        return {"tool": "help"}
+    if CREATOR_RE.match(text):
+        return {"tool": "get_creator"}
+    if EVALUATE_RE.match(text):
+        return {"tool": "evaluate_agents"}
+    return None
+
+
+@traced("router.local")
+def route_locally(user_input: str, history: list[dict]) -> dict | None:
+    """
+    Returns a tool command dict for unambiguous inputs, or None when the input
+    should go to the LLM router. Updates the router stats either way.
+    """
+    text = _clean(user_input)
+    command = (
+        _route_fixed(text) or _route_tip(text, history) or _route_progress(text, history) or _route_log(text, history)
+        or _route_workout(text, history)
+    )
+    if command is not None:
+        # Same checks as model-produced commands ("log 0x10 bench" must not be written).
+        try:
+            command = agents.tool_schemas.validate_command(command)
+        except ValueError:
+            command = None
+    _ROUTER_STATS.get()["misses" if command is None else "hits"] += 1
+    return command
+
+
+def use_router_stats(stats: dict):
+    """Counts the current context's local routing in `stats` ({"hits", "misses"}) instead of ROUTER_STATS."""
+    return _ROUTER_STATS.set(stats)
+
+
+def get_router_stats() -> dict:
+    total = ROUTER_STATS["hits"] + ROUTER_STATS["misses"]
+    hit_rate = ROUTER_STATS["hits"] / total if total else 0.0
+    return {**ROUTER_STATS, "total": total, "hit_rate": round(hit_rate, 3)}
@@ -1,11 +1,54 @@
-import google.generativeai as genai
+import agents.model_registry
+import agents.tool_schemas
+from logs import traced
 
+STATEFUL_INSTRUCTIONS = """You are the Gymini Assistant.
+Your sole job is to analyze the conversation history and the latest user message
+to determine the appropriate tool command.
 
+Rules:
+- ONLY output a raw JSON object.
+- Do not use backticks or code fences.
+- Use the history to resolve pronouns or missing context
+  (e.g., 'it', 'them' refers to the last mentioned exercise)."""
+
+ROUTER_INSTRUCTIONS = """You are the Gymini Assistant.
+Pick the single tool that handles the latest user message.
+Use the history to resolve pronouns or missing context
+(e.g., 'it', 'them' refers to the last mentioned exercise)."""
+
+agents.model_registry.register("stateful", STATEFUL_INSTRUCTIONS)
+agents.model_registry.register(
+    "router",
+    ROUTER_INSTRUCTIONS,
+    options=lambda: {
+        "tools": [agents.tool_schemas.function_declarations()],
+        "tool_config": {"function_calling_config": {"mode": "ANY"}},
+    },
+)
+
+
+def render_history(history: list[dict]) -> str:
+    """Renders the chat history as 'Role: text' lines for the prompt."""
+    if hasattr(history, "render"):
+        # ConversationContext keeps its bounded rendering up to date incrementally.
+        return history.render()
+    history_text = ""
+    for msg in history:
+        role = msg.get("role", "user")
+        parts = " ".join(part.get("text", "") for part in msg.get("parts", []))
+        history_text += f"{role.capitalize()}: {parts}\n"
+    return history_text
+
+
+@traced("router.chain")
 def ask_main_agent_with_history(user_input: str, history: list[dict]) -> str:
     """
-    Calls the main agent model, passing the entire chat history for context.
+    Calls the main agent model, passing the chat history (or its bounded
+    ConversationContext rendering) for context.
     Ensures pronouns or vague references are resolved using past conversation.
     Returns ONLY a raw JSON object.
+    Raises resilience.DependencyUnavailable when Gemini cannot be reached.
     """
     # Exceptions to passthrough to ask_gymini() LLM 
     lowered = user_input.lower()
@@ -17,29 +60,35 @@ def ask_main_agent_with_history(user_input: str, history: list[dict]) -> str:
     if "what can you do" in lowered or "help" in lowered:
       return user_input
     
-    model = genai.GenerativeModel("models/gemini-2.5-flash")
-
     # Build the conversation history string
-    history_text = ""
-    for msg in history:
-        role = msg.get("role", "user")
-        parts = " ".join(part.get("text", "") for part in msg.get("parts", []))
-        history_text += f"{role.capitalize()}: {parts}\n"
-    
-    response = model.generate_content(f"""
-    You are the Gymini Assistant.
-    Your sole job is to analyze the conversation history and the latest user message
-    to determine the appropriate tool command.
-
-    Rules:
-    - ONLY output a raw JSON object.
-    - Do not use backticks or code fences.
-    - Use the history to resolve pronouns or missing context
-      (e.g., 'it', 'them' refers to the last mentioned exercise).
-
-    Conversation History:
-    {history_text}
-
-    User: {user_input}
-    """)
+    history_text = render_history(history)
+
+    response = agents.model_registry.generate("stateful", f"""Conversation History:
+{history_text}
+
+User: {user_input}""")
     return response.text.strip()
+
+
+@traced("router.unified")
+def route_with_history(user_input: str, history: list[dict]) -> dict | None:
+    """
+    Unified routing: a single history-aware call that must answer with one of
+    the declared tools (function calling), so the controller can dispatch the
+    command directly instead of sending it through ask_gymini again.
+    Returns a validated tool command, or None when no tool applies.
+    Raises resilience.DependencyUnavailable when Gemini cannot be reached.
+    """
+    history_text = render_history(history)
+
+    response = agents.model_registry.generate("router", f"""Conversation History:
+{history_text}
+
+User: {user_input}""")
+    for part in response.candidates[0].content.parts:
+        if part.function_call.name:
+            if part.function_call.name == "fallback":
+                return None
+            command = {"tool": part.function_call.name, **dict(part.function_call.args)}
+            return agents.tool_schemas.validate_command(command)
+    return None
@@ -1,29 +1,67 @@
-import db.mock_db
-from db.firebase_db import get_last_session
 import datetime as dt
+import agents.logging_agent
+import agents.memory_agent
 
 
-def get_summary(last_session=True) -> dict:
+def get_summary() -> dict:
     """
-    Summarize the latest workout session from Firebase.
+    Summarize the latest workout session from the precomputed training rollups
+    (db.aggregates), which log_session keeps up to date on every write.
     Returns a dict with id + message for consistency.
     """
-    session = get_last_session()
-    if not session:
-        return {"id": "summary", "message": "No workouts logged yet."}
+    return agents.logging_agent.get_aggregates().day_summary()
 
-    date = session["date"]
-    exercises = session.get("exercises", [])
 
-    if not exercises:
-        return {"id": "summary", "message": f"No exercises logged for {date}."}
+def rewrite_prompt(raw_summary: dict) -> str:
+    """The Gemini prompt turning a raw summary into the motivational reply (shared with agents.prefetcher)."""
+    user_name = agents.memory_agent.get_name()
+    if user_name:
+        return (
+            f"Rewrite this workout summary in a motivational tone, "
+            f"and address the user by name ({user_name}): {raw_summary}"
+        )
+    return f"Rewrite this workout summary in a motivational tone: {raw_summary}"
 
-    summary_parts = []
-    for ex in exercises:
-        weight = int(ex["weight_kg"]) if float(ex["weight_kg"]).is_integer() else ex["weight_kg"]
-        summary_parts.append(f"{ex['sets']}×{ex['reps']} {ex['exercise']} at {weight}kg")
 
-    return {
-        "id": "summary",
-        "message": f"On {date}, you did " + " and ".join(summary_parts) + "."
-    }
+def get_progress(exercise: str, weeks: int = 8) -> dict:
+    """
+    Summarize how `exercise` moved over the last `weeks` weeks: sessions, best
+    estimated 1RM at the start and end of the window, top set, weekly tonnage
+    and PRs. Only the window is read from the store (logging_agent.query_logs).
+    Returns a dict with id + message, like get_summary.
+    """
+    from db.columnar import ColumnarHistory
+    end = dt.date.today()
+    start = end - dt.timedelta(weeks=weeks)
+    rows = agents.logging_agent.query_logs(exercise, start.isoformat(), end.isoformat())
+    if not rows:
+        return {"id": "progress", "message": f"No {exercise} logged in the last {weeks} weeks."}
+
+    history = ColumnarHistory.from_entries(rows)
+    name = history.labels[0]
+    curve = history.e1rm_curve(exercise)
+    tonnage = history.weekly_tonnage(exercise)
+    # PRs are all-time: each row must also beat the best from before the window
+    # (kept in the rollups, so the earlier history is not read again).
+    aggregates = agents.logging_agent.get_aggregates([exercise])
+    records = []
+    if aggregates.loaded:
+        baseline = aggregates.best_before(exercise, start.isoformat())
+        records = history.personal_records(exercise, baseline=baseline)
+    top = max(rows, key=lambda row: (row["weight_kg"], row["reps"]))
+
+    parts = [f"{name}, last {weeks} weeks ({start.isoformat()} to {end.isoformat()}): {len(curve)} session{'s' if len(curve) != 1 else ''}."]
+    first_date, first_e1rm = curve[0]
+    last_date, last_e1rm = curve[-1]
+    if len(curve) > 1:
+        parts.append(f"Estimated 1RM went from {first_e1rm}kg ({first_date}) to {last_e1rm}kg ({last_date}), "
+                     f"{last_e1rm - first_e1rm:+.1f}kg.")
+    else:
+        parts.append(f"Estimated 1RM {last_e1rm}kg on {last_date}.")
+    parts.append(f"Top set: {top['sets']}×{top['reps']} at {top['weight_kg']}kg.")
+    if len(tonnage) > 1:
+        parts.append(f"Weekly tonnage went from {tonnage[0][1]:.0f}kg to {tonnage[-1][1]:.0f}kg.")
+    if records:
+        noun = "new best" if len(records) == 1 else "new bests"
+        parts.append(f"{len(records)} {noun} in this window, latest on {records[-1]['date']}.")
+    return {"id": "progress", "message": " ".join(parts)}
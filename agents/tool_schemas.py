@@ -0,0 +1,217 @@
+import math
+import re
+from collections.abc import Mapping, Sequence
+import agents.router_agent
+
+# Argument types for every tool command the controller dispatches on.
+# Used both to build the Gemini function declarations and to validate
+# (and coerce) the commands that come back from the model.
+TOOL_ARGS = {
+    "log_session": {"exercise": str, "sets": int, "reps": int, "weight_kg": float},
+    "log_workout": {"exercises": list},
+    "get_summary": {},
+    "get_progress": {"exercise": str, "weeks": int},
+    "coach_agent": {"exercise": str},
+    "set_name": {"name": str},
+    "get_name": {},
+    "evaluate_agents": {},
+    "get_creator": {},
+    "help": {},
+}
+
+# Optional arguments and the value used when the command leaves them out.
+ARG_DEFAULTS = {"get_progress": {"weeks": 8}}
+MAX_PROGRESS_WEEKS = 520
+
+# Each log_workout entry, with optional per-set reps/weight in set_details.
+WORKOUT_ENTRY_ARGS = {"exercise": str, "sets": int, "reps": int, "weight_kg": float}
+SET_DETAIL_ARGS = {"reps": int, "weight_kg": float}
+MAX_WORKOUT_EXERCISES = 30
+MAX_SETS_PER_EXERCISE = 20
+# Logged weights above this are treated as typos rather than lifts (also used by importer.py).
+MAX_WEIGHT_KG = 1000.0
+
+TOOL_DESCRIPTIONS = {
+    "log_workout": (
+        "Log several exercises in one message, or an exercise whose sets differ in reps or weight "
+        "(e.g. 'bench 3x10 at 80, then squats 5x5 at 100, last set only 4 reps')."
+    ),
+    "get_summary": "Summarize the user's latest workout session (e.g. 'give me my last session summary').",
+    "get_progress": (
+        "Show how an exercise has progressed over recent weeks "
+        "(e.g. 'how has my bench moved in the last 8 weeks?')."
+    ),
+    "coach_agent": "Give technique and safety tips for an exercise.",
+    "set_name": "Remember the user's name when they introduce themselves ('my name is X', 'call me X').",
+    "get_name": "Recall the user's name ('what is my name?', 'do you remember my name?').",
+    "evaluate_agents": "Run an evaluation of all the agents.",
+    "get_creator": "Answer 'who made you', 'who created you' or similar.",
+    "help": "Explain what Gymini can do ('what can you do', 'help').",
+    "fallback": "Use only when the message matches none of the other tools.",
+}
+
+ARG_DESCRIPTIONS = {
+    "log_workout": {"exercises": "Every exercise the user logged, in order."},
+    "get_progress": {
+        "exercise": "The exercise to report on, resolved from history if the user says 'it'.",
+        "weeks": "How many weeks back to look (8 if the user does not say; a month is 4 weeks).",
+    },
+    "coach_agent": {"exercise": "The exercise to give tips for, resolved from history if the user says 'it'."},
+    "set_name": {"name": "The user's name."},
+}
+
+# Numbers the model wrote as text, with an optional unit ("80kg", "175 lbs", "10 reps").
+NUMBER_TEXT = re.compile(r"\s*(-?\d+(?:[.,]\d+)?)\s*([a-z]*)\.?\s*", re.IGNORECASE)
+LB_UNITS = {"lb", "lbs", "pound", "pounds"}
+
+JSON_TYPES = {str: "string", int: "integer", float: "number", list: "array"}
+
+
+def _object_schema(args: dict, descriptions: dict | None = None, defaults: dict | None = None) -> dict:
+    properties = {}
+    for arg, kind in args.items():
+        properties[arg] = {"type": JSON_TYPES[kind]}
+        if descriptions and arg in descriptions:
+            properties[arg]["description"] = descriptions[arg]
+    return {"type": "object", "properties": properties, "required": [arg for arg in args if arg not in (defaults or {})]}
+
+
+def _workout_schema() -> dict:
+    entry = _object_schema(WORKOUT_ENTRY_ARGS)
+    entry["properties"]["set_details"] = {
+        "type": "array",
+        "description": "Only when sets differ: one item per set, in order.",
+        "items": _object_schema(SET_DETAIL_ARGS),
+    }
+    return {
+        "type": "array",
+        "description": ARG_DESCRIPTIONS["log_workout"]["exercises"],
+        "items": entry,
+    }
+
+
+def function_declarations():
+    """
+    Builds the Gemini tool declarations for the unified router. log_session is
+    declared straight from its signature and docstring; the other tools from
+    TOOL_ARGS and TOOL_DESCRIPTIONS.
+    """
+    import agents.logging_agent
+    from google.generativeai.types import FunctionDeclaration, Tool
+
+    declarations = [FunctionDeclaration.from_function(agents.logging_agent.log_session)]
+    for tool, args in TOOL_ARGS.items():
+        if tool == "log_session":
+            continue
+        declaration = {"name": tool, "description": TOOL_DESCRIPTIONS[tool]}
+        if tool == "log_workout":
+            declaration["parameters"] = {"type": "object", "properties": {"exercises": _workout_schema()},
+                                         "required": ["exercises"]}
+        elif args:
+            declaration["parameters"] = _object_schema(args, ARG_DESCRIPTIONS[tool], ARG_DEFAULTS.get(tool))
+        declarations.append(FunctionDeclaration(**declaration))
+    declarations.append(FunctionDeclaration(name="fallback", description=TOOL_DESCRIPTIONS["fallback"]))
+    return Tool(function_declarations=declarations)
+
+
+def validate_command(command: dict) -> dict:
+    """
+    Checks a tool command against TOOL_ARGS, fills in ARG_DEFAULTS and coerces
+    its argument types (Gemini returns every number as a float). Raises
+    ValueError when the tool is unknown or an argument is missing or malformed.
+    """
+    tool = command.get("tool")
+    if tool not in TOOL_ARGS:
+        raise ValueError(f"Unknown tool: {tool}")
+    if tool == "log_workout":
+        return {"tool": tool, "exercises": validate_workout(command.get("exercises"))}
+    data = {**ARG_DEFAULTS.get(tool, {}), **{arg: value for arg, value in command.items() if value is not None}}
+    validated = _validate_args(tool, TOOL_ARGS[tool], data)
+    if tool == "log_session":
+        _check_ranges(tool, validated)
+    if tool == "get_progress" and not 1 <= validated["weeks"] <= MAX_PROGRESS_WEEKS:
+        raise ValueError(f"get_progress needs 1 to {MAX_PROGRESS_WEEKS} weeks")
+    return {"tool": tool, **validated}
+
+
+def _validate_args(owner: str, spec: dict, data) -> dict:
+    validated = {}
+    for arg, kind in spec.items():
+        value = data.get(arg)
+        if value is None or value == "":
+            raise ValueError(f"{owner} is missing '{arg}'")
+        try:
+            validated[arg] = _coerce(kind, value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{owner} has an invalid '{arg}': {value!r}")
+    return validated
+
+
+def _coerce(kind: type, value):
+    if kind not in (int, float):
+        return kind(value)
+    if isinstance(value, bool):
+        raise ValueError(value)
+    if isinstance(value, str):
+        match = NUMBER_TEXT.fullmatch(value)
+        if match is None:
+            raise ValueError(value)
+        number = float(match[1].replace(",", "."))
+        if kind is float and match[2].lower() in LB_UNITS:
+            number *= agents.router_agent.KG_PER_LB
+        value = number
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(value)
+    if kind is float:
+        return round(number, 1)
+    # Gemini sends whole numbers as floats (3.0); anything fractional is not a count.
+    if not number.is_integer():
+        raise ValueError(value)
+    return int(number)
+
+
+def _check_ranges(owner: str, item: dict):
+    if "sets" in item and not 1 <= item["sets"] <= MAX_SETS_PER_EXERCISE:
+        raise ValueError(f"{owner} needs 1 to {MAX_SETS_PER_EXERCISE} sets")
+    if item["reps"] < 1 or not 0 <= item["weight_kg"] <= MAX_WEIGHT_KG:
+        raise ValueError(f"{owner} has out-of-range reps or weight")
+
+
+def _is_list(value) -> bool:
+    # Gemini function-call arguments arrive as proto sequences/maps, not list/dict.
+    return isinstance(value, Sequence) and not isinstance(value, (str, bytes))
+
+
+def validate_workout(entries) -> list[dict]:
+    """
+    Validates the exercises of a log_workout command. When set_details is given,
+    `sets` is taken from its length. Raises ValueError on malformed entries.
+    """
+    if not _is_list(entries) or not entries:
+        raise ValueError("log_workout needs a non-empty 'exercises' list")
+    if len(entries) > MAX_WORKOUT_EXERCISES:
+        raise ValueError(f"log_workout accepts at most {MAX_WORKOUT_EXERCISES} exercises")
+    validated = []
+    for index, entry in enumerate(entries, start=1):
+        owner = f"log_workout exercise {index}"
+        if not isinstance(entry, Mapping):
+            raise ValueError(f"{owner} is not an object")
+        details = entry.get("set_details")
+        if details:
+            if not _is_list(details) or len(details) > MAX_SETS_PER_EXERCISE:
+                raise ValueError(f"{owner} has invalid 'set_details'")
+            set_details = [_validate_args(f"{owner} set {n}", SET_DETAIL_ARGS, d if isinstance(d, Mapping) else {})
+                           for n, d in enumerate(details, start=1)]
+            for n, detail in enumerate(set_details, start=1):
+                _check_ranges(f"{owner} set {n}", detail)
+            # Overall reps/weight default to the first set when only the detail is given.
+            entry = {"sets": len(set_details), **set_details[0], **entry}
+            item = _validate_args(owner, WORKOUT_ENTRY_ARGS, entry)
+            item["sets"] = len(set_details)
+            item["set_details"] = set_details
+        else:
+            item = _validate_args(owner, WORKOUT_ENTRY_ARGS, entry)
+        _check_ranges(owner, item)
+        validated.append(item)
+    return validated
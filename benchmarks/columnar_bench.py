@@ -0,0 +1,112 @@
+import argparse
+import datetime as dt
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+# Columnar history benchmark: generates synthetic multi-year logs for several
+# users and compares the dict representation with db.columnar.ColumnarHistory
+# on memory and on progress-query latency (weekly tonnage, e1RM curve, PRs).
+#
+#   python benchmarks/columnar_bench.py --users 50 --years 5
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+EXERCISES = ("Bench Press", "Squats", "Deadlift", "Barbell Rows", "Overhead Press", "Curls", "Pull-ups", "Lunges")
+
+
+def synthetic_logs(years: int, rng: random.Random) -> list[dict]:
+    """About four sessions a week of four exercises each, with slowly rising weights."""
+    start = dt.date.today() - dt.timedelta(days=365 * years)
+    entries = []
+    for day in range(365 * years):
+        if rng.random() > 4 / 7:
+            continue
+        date = start + dt.timedelta(days=day)
+        for exercise in rng.sample(EXERCISES, 4):
+            entries.append({
+                "id": f"{rng.getrandbits(32):08x}",
+                "exercise": exercise,
+                "sets": rng.randint(2, 5),
+                "reps": rng.randint(1, 12),
+                "weight_kg": round(40 + day / 30 + rng.uniform(-10, 10), 1),
+                "timestamp": f"{date.isoformat()}T18:{rng.randint(0, 59):02d}:00",
+                "date_string": date.isoformat(),
+                "user_id": "bench_user",
+            })
+    return entries
+
+
+def dict_queries(entries: list[dict]):
+    """The same queries as plain Python loops over the dicts, for comparison."""
+    from agents.exercise_names import canonical_exercise
+    weeks, curve, best = {}, {}, {}
+    for entry in entries:
+        date = dt.date.fromisoformat(entry["date_string"])
+        monday = (date - dt.timedelta(days=date.weekday())).isoformat()
+        weeks[monday] = weeks.get(monday, 0.0) + entry["sets"] * entry["reps"] * entry["weight_kg"]
+        key = canonical_exercise(entry["exercise"])
+        e1rm = entry["weight_kg"] * (1 + entry["reps"] / 30) if entry["reps"] > 1 else entry["weight_kg"]
+        if key == "bench press":
+            curve[entry["date_string"]] = max(curve.get(entry["date_string"], 0.0), e1rm)
+        best[key] = max(best.get(key, 0.0), e1rm)
+    return weeks, curve, best
+
+
+def timed(fn, repeat: int) -> float:
+    """Best wall time of `fn` in ms."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare dict and columnar training histories.")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    from db.columnar import ColumnarHistory
+
+    rng = random.Random(args.seed)
+    tracemalloc.start()
+    users = [synthetic_logs(args.years, rng) for _ in range(args.users)]
+    dict_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    histories = [ColumnarHistory.from_entries(entries) for entries in users]
+    build_ms = (time.perf_counter() - start) * 1000
+    columnar_bytes = sum(history.nbytes for history in histories)
+    rows = sum(len(history) for history in histories)
+
+    def columnar_queries():
+        for history in histories:
+            history.weekly_tonnage()
+            history.e1rm_curve("bench press")
+            history.personal_records()
+
+    def plain_queries():
+        for entries in users:
+            dict_queries(entries)
+
+    columnar_ms = timed(columnar_queries, args.repeat)
+    plain_ms = timed(plain_queries, args.repeat)
+    print(f"{args.users} users x {args.years} years: {rows} logged exercises")
+    print(f"memory: dicts {dict_bytes / 1024:.0f} KB, columnar {columnar_bytes / 1024:.0f} KB "
+          f"({columnar_bytes / dict_bytes:.1%})")
+    print(f"build columnar history: {build_ms:.1f} ms total")
+    print(f"progress queries per user: columnar {columnar_ms / args.users:.2f} ms, "
+          f"dict loops {plain_ms / args.users:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
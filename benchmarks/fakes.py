@@ -0,0 +1,214 @@
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+# Offline stand-ins for Gymini's external services, used by offline_bench.py:
+#   FakeGemini    - replaces agents.model_registry.get_model; replays recorded
+#                   responses, otherwise answers from the scripted command of
+#                   the current turn (or canned free text)
+#   FakeSearchHTTP - replaces the Custom Search HTTP session in agents.coach_agent
+#   FakeFirestore  - db.fake_firestore, behind db.firebase_db
+# Each one sleeps for a latency drawn from a log-normal distribution.
+
+
+class Latency:
+    def __init__(self, median_ms: float, sigma: float = 0.5, rng: random.Random | None = None):
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self.rng = rng or random.Random()
+        self._lock = threading.Lock()
+
+    def sample(self) -> float:
+        """Seconds to wait for one call."""
+        if self.median_ms <= 0:
+            return 0.0
+        with self._lock:
+            return self.rng.lognormvariate(math.log(self.median_ms), self.sigma) / 1000
+
+    def sleep(self):
+        delay = self.sample()
+        if delay:
+            time.sleep(delay)
+
+
+def _usage(prompt: str, text: str):
+    return SimpleNamespace(prompt_token_count=len(prompt) // 4 + 1, candidates_token_count=len(text) // 4 + 1)
+
+
+def _text_response(prompt: str, text: str):
+    part = SimpleNamespace(text=text, function_call=SimpleNamespace(name="", args={}))
+    return SimpleNamespace(
+        text=text,
+        usage_metadata=_usage(prompt, text),
+        candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]))],
+    )
+
+
+def _function_response(prompt: str, name: str, args: dict):
+    part = SimpleNamespace(text="", function_call=SimpleNamespace(name=name, args=args))
+    return SimpleNamespace(
+        text="",
+        usage_metadata=_usage(prompt, json.dumps(args)),
+        candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]))],
+    )
+
+
+FREE_TEXT = (
+    "Hey there! Great question. Here is what I would focus on: keep your form tight, "
+    "control the lowering phase, breathe out on the effort and add weight only when "
+    "every rep looks the same. Consistency beats intensity, so keep showing up. 💪"
+)
+
+
+class FakeGemini:
+    """
+    Stand-in for the Gemini models. `expect(command)` sets the tool command the
+    routing agents should produce for the current turn (None means no tool
+    applies). With `recording`, recorded responses are replayed first; with
+    `record=True` the real models are called and their answers saved instead.
+    """
+
+    def __init__(self, latency: Latency, recording: str | None = None, record: bool = False, real_get_model=None):
+        self.latency = latency
+        self.recording = recording
+        self.record = record
+        self.real_get_model = real_get_model
+        self.recorded = {}
+        if recording and os.path.exists(recording):
+            with open(recording, encoding="utf-8") as f:
+                self.recorded = json.load(f)
+        self.calls = 0
+        self.calls_by_agent = {}
+        self._pending = None
+        self._lock = threading.Lock()
+
+    def expect(self, command: dict | None):
+        self._pending = {"command": command}
+
+    def get_model(self, agent: str):
+        return FakeModel(self, agent)
+
+    def save(self):
+        if self.record and self.recording:
+            with open(self.recording, "w", encoding="utf-8") as f:
+                json.dump(self.recorded, f, indent=2, ensure_ascii=False)
+
+    @staticmethod
+    def key(agent: str, prompt: str) -> str:
+        return hashlib.sha256(f"{agent}|{' '.join(prompt.split())}".encode("utf-8")).hexdigest()
+
+    def _count(self, agent: str):
+        with self._lock:
+            self.calls += 1
+            self.calls_by_agent[agent] = self.calls_by_agent.get(agent, 0) + 1
+
+    def _take_command(self):
+        """The scripted command for this turn, handed to the first routing call only."""
+        with self._lock:
+            pending, self._pending = self._pending, None
+        return pending
+
+    def respond(self, agent: str, prompt: str):
+        key = self.key(agent, prompt)
+        if self.record:
+            response = self.real_get_model(agent).generate_content(prompt)
+            self.recorded[key] = self._capture(response)
+            return response
+        if key in self.recorded:
+            return self._replay(prompt, self.recorded[key])
+        return self._scripted(agent, prompt)
+
+    @staticmethod
+    def _capture(response) -> dict:
+        for part in response.candidates[0].content.parts:
+            if part.function_call.name:
+                return {"function_call": {"name": part.function_call.name, "args": dict(part.function_call.args)}}
+        return {"text": response.text}
+
+    @staticmethod
+    def _replay(prompt: str, entry: dict):
+        if "function_call" in entry:
+            return _function_response(prompt, entry["function_call"]["name"], entry["function_call"]["args"])
+        return _text_response(prompt, entry["text"])
+
+    def _scripted(self, agent: str, prompt: str):
+        user_text = prompt.rsplit("User: ", 1)[-1].strip()
+        if agent == "router":
+            pending = self._take_command()
+            command = (pending or {}).get("command")
+            if not command:
+                return _function_response(prompt, "fallback", {})
+            return _function_response(prompt, command["tool"], {k: v for k, v in command.items() if k != "tool"})
+        if agent == "stateful":
+            pending = self._take_command()
+            command = (pending or {}).get("command")
+            return _text_response(prompt, json.dumps(command) if command else "I am not sure what you mean.")
+        if agent == "coach":
+            return _text_response(prompt, json.dumps({"tool": "search_web", "query": user_text}))
+        # gymini: echoes tool JSON it is asked to re-emit, routes passthrough
+        # messages from the scripted command, otherwise writes free text.
+        if user_text.startswith("{"):
+            return _text_response(prompt, user_text)
+        pending = self._take_command()
+        if pending and pending["command"]:
+            return _text_response(prompt, json.dumps(pending["command"]))
+        return _text_response(prompt, FREE_TEXT)
+
+
+class FakeModel:
+    def __init__(self, fake: FakeGemini, agent: str):
+        self.fake = fake
+        self.agent = agent
+
+    def generate_content(self, prompt, request_options=None, stream=False, **kwargs):
+        self.fake._count(self.agent)
+        self.fake.latency.sleep()
+        response = self.fake.respond(self.agent, prompt)
+        if not stream:
+            return response
+        words = re.findall(r"\S+\s*", response.text) or [""]
+        return [SimpleNamespace(text="".join(words[i:i + 8])) for i in range(0, len(words), 8)]
+
+
+class FakeSearchHTTP:
+    """Stand-in for the requests.Session used by agents.coach_agent.search_web_impl."""
+
+    def __init__(self, latency: Latency):
+        self.latency = latency
+        self.calls = 0
+
+    def get(self, url, params=None, timeout=None):
+        self.calls += 1
+        self.latency.sleep()
+        query = (params or {}).get("q", "")
+        items = [
+            {"snippet": f"Tip {i + 1} for {query}: brace, control the tempo and keep a full range of motion.",
+             "link": f"https://example.com/{i + 1}"}
+            for i in range(5)
+        ]
+        return SimpleNamespace(json=lambda: {"items": items}, raise_for_status=lambda: None)
+
+
+def install(gemini: FakeGemini, search: FakeSearchHTTP, firestore_latency: float = 0.0):
+    """Points Gymini's model registry, search session and Firestore client at the fakes."""
+    import agents.coach_agent
+    import agents.model_registry
+    import db.firebase_db
+    from db.fake_firestore import ArrayUnion, FakeFirestore
+    from db.write_behind import WriteBehindQueue
+
+    if gemini.record and gemini.real_get_model is None:
+        gemini.real_get_model = agents.model_registry.get_model
+    agents.model_registry.get_model = gemini.get_model
+    agents.coach_agent._http = search
+    firestore = FakeFirestore(latency=firestore_latency)
+    db.firebase_db._db = firestore
+    if db.firebase_db.WRITE_BEHIND:
+        db.firebase_db._write_queue = WriteBehindQueue(firestore, collection="sessions", array_union=ArrayUnion)
+    return firestore
@@ -0,0 +1,209 @@
+import argparse
+import contextlib
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Offline throughput/latency benchmark: replays the scripted sessions in
+# sessions.jsonl through main.handle_turn (the chat loop's turn logic) against
+# the fakes in benchmarks/fakes.py, so it needs no API keys or network, and
+# compares the result with the stored baseline.
+#
+#   python benchmarks/offline_bench.py                   # check against baseline.json
+#   python benchmarks/offline_bench.py --update-baseline # store a new baseline
+#   python benchmarks/offline_bench.py --mode unified --stream --backend sqlite
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Stages whose p95 latency is guarded against regressions.
+GUARDED_STAGES = ("turn", "controller", "router.local", "router.chain", "router.unified")
+
+
+class SpanCollector:
+    """logs exporter keeping every span duration, for exact percentiles."""
+
+    def __init__(self, metrics):
+        # Only spans recorded in `metrics` (logs.METRICS) count: evaluation runs keep their own.
+        self.metrics = metrics
+        self.durations = {}
+
+    def start(self, current):
+        pass
+
+    def end(self, current):
+        if current.metrics is not self.metrics:
+            return
+        self.durations.setdefault(current.name, []).append(current.duration_ms)
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+    return round(ordered[index], 3)
+
+
+def load_sessions(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def run(args) -> dict:
+    # Configure Gymini before main is imported: backends and caches read the environment once.
+    workdir = tempfile.mkdtemp(prefix="gymini-bench-")
+    os.environ["GYMINI_DB"] = args.backend
+    os.environ["GYMINI_DB_PATH"] = os.path.join(workdir, "gymini.sqlite3")
+    os.environ["GYMINI_CACHE_PATH"] = os.path.join(workdir, "cache.sqlite3")
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, HERE)
+
+    import fakes
+    import logs
+    import main
+    import agents.memory_agent
+    from agents.context_manager import ConversationContext
+
+    rng = random.Random(args.seed)
+    gemini = fakes.FakeGemini(fakes.Latency(args.gemini_ms, args.sigma, rng), recording=args.recording, record=args.record)
+    search = fakes.FakeSearchHTTP(fakes.Latency(args.search_ms, args.sigma, rng))
+    firestore = fakes.install(gemini, search, firestore_latency=args.firestore_ms / 1000)
+    main.ROUTING_MODE = args.mode
+
+    collector = SpanCollector(logs.METRICS)
+    logs.EXPORTERS.append(collector)
+    logging.disable(logging.INFO)
+
+    sessions = load_sessions(args.sessions)
+    turns = 0
+    memory_samples = []
+    tracemalloc.start()
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for repeat in range(args.repeat):
+            for session in sessions:
+                # One long-running conversation per scripted session and repeat.
+                history = ConversationContext()
+                agents.memory_agent.use_memory({})
+                for turn in session["turns"]:
+                    gemini.expect(turn.get("command"))
+                    reply = main.handle_turn(turn["user"], history, stream=args.stream)
+                    if reply is not None and not isinstance(reply, str):
+                        "".join(reply)
+                    turns += 1
+            memory_samples.append(tracemalloc.get_traced_memory()[0])
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    logging.disable(logging.NOTSET)
+    logs.EXPORTERS.remove(collector)
+    gemini.save()
+
+    # Growth after the first pass (which fills caches and imports lazily loaded modules).
+    steady_turns = turns - turns // args.repeat
+    growth = memory_samples[-1] - memory_samples[0] if args.repeat > 1 else 0
+    return {
+        "config": config_key(args),
+        "turns": turns,
+        "elapsed_s": round(elapsed, 3),
+        "turns_per_sec": round(turns / elapsed, 2),
+        "llm_calls_per_turn": round(gemini.calls / turns, 3),
+        "llm_calls_by_agent": gemini.calls_by_agent,
+        "search_calls": search.calls,
+        "firestore_rpcs": firestore.rpc_count,
+        "memory_growth_kb_per_turn": round(growth / 1024 / steady_turns, 3) if steady_turns else 0.0,
+        "memory_peak_kb": round(peak / 1024, 1),
+        "stages": {
+            name: {"count": len(values), "p50_ms": percentile(values, 50), "p95_ms": percentile(values, 95),
+                   "p99_ms": percentile(values, 99)}
+            for name, values in sorted(collector.durations.items())
+        },
+    }
+
+
+def config_key(args) -> str:
+    return f"{args.mode}/{args.backend}/{'stream' if args.stream else 'buffered'}"
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Returns the regressions of `report` against `baseline`."""
+    failures = []
+    if report["turns_per_sec"] < baseline["turns_per_sec"] * (1 - tolerance):
+        failures.append(f"throughput {report['turns_per_sec']} turns/s < baseline {baseline['turns_per_sec']}")
+    if report["llm_calls_per_turn"] > baseline["llm_calls_per_turn"] + 0.001:
+        failures.append(f"LLM calls/turn {report['llm_calls_per_turn']} > baseline {baseline['llm_calls_per_turn']}")
+    # Allow a little absolute slack: allocator noise is a few KB per run.
+    memory_limit = max(baseline["memory_growth_kb_per_turn"] * (1 + tolerance), baseline["memory_growth_kb_per_turn"] + 1.0)
+    if report["memory_growth_kb_per_turn"] > memory_limit:
+        failures.append(f"memory growth {report['memory_growth_kb_per_turn']} KB/turn > baseline "
+                        f"{baseline['memory_growth_kb_per_turn']}")
+    for stage in GUARDED_STAGES:
+        current, expected = report["stages"].get(stage), baseline["stages"].get(stage)
+        if current and expected and current["p95_ms"] > expected["p95_ms"] * (1 + tolerance) + 1.0:
+            failures.append(f"{stage} p95 {current['p95_ms']} ms > baseline {expected['p95_ms']} ms")
+    return failures
+
+
+def print_report(report: dict):
+    print(f"{report['config']}: {report['turns']} turns in {report['elapsed_s']}s "
+          f"({report['turns_per_sec']} turns/s), {report['llm_calls_per_turn']} LLM calls/turn, "
+          f"{report['search_calls']} searches, {report['firestore_rpcs']} Firestore RPCs")
+    print(f"memory: {report['memory_growth_kb_per_turn']} KB/turn growth, peak {report['memory_peak_kb']} KB")
+    for name, stage in report["stages"].items():
+        print(f"  {name:<22} n={stage['count']:<5} p50 {stage['p50_ms']:>9.2f} ms  "
+              f"p95 {stage['p95_ms']:>9.2f} ms  p99 {stage['p99_ms']:>9.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay scripted sessions against offline fakes.")
+    parser.add_argument("--sessions", default=os.path.join(HERE, "sessions.jsonl"))
+    parser.add_argument("--baseline", default=os.path.join(HERE, "baseline.json"))
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression")
+    parser.add_argument("--repeat", type=int, default=5, help="passes over the sessions (long-session memory growth)")
+    parser.add_argument("--mode", choices=("chain", "unified"), default="chain")
+    parser.add_argument("--backend", choices=("mock", "sqlite", "firebase"), default="mock")
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--gemini-ms", type=float, default=20.0, help="median fake Gemini latency")
+    parser.add_argument("--search-ms", type=float, default=40.0, help="median fake search latency")
+    parser.add_argument("--firestore-ms", type=float, default=5.0, help="fake Firestore RPC latency")
+    parser.add_argument("--sigma", type=float, default=0.4, help="log-normal spread of the fake latencies")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--recording", help="JSON file of recorded Gemini responses to replay")
+    parser.add_argument("--record", action="store_true", help="call the real Gemini and save responses to --recording")
+    parser.add_argument("--json", action="store_true", help="print the full report as JSON")
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    print_report(report)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baselines = json.load(f)
+    if args.update_baseline:
+        baselines[report["config"]] = report
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline for {report['config']} written to {args.baseline}")
+        return
+    if report["config"] not in baselines:
+        print(f"No baseline for {report['config']}; run with --update-baseline to create one.")
+        return
+    failures = compare(report, baselines[report["config"]], args.tolerance)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+# Startup-time guard: imports main.py under `python -X importtime` and fails
+# when the cumulative import time exceeds the budget, or when a heavy module
+# that should be loaded lazily shows up during startup.
+#
+#   python benchmarks/startup_bench.py --budget-ms 250 --runs 5
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_BUDGET_MS = float(os.getenv("GYMINI_STARTUP_BUDGET_MS", "250"))
+
+# Heavy packages that must only be imported on first use.
+DEFERRED_MODULES = ("firebase_admin", "grpc", "google.generativeai", "google.api_core", "requests", "numpy")
+
+IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$")
+
+
+def measure(module: str = "main") -> tuple[float, list[str]]:
+    """Returns (cumulative import time of `module` in ms, all modules imported)."""
+    env = {**os.environ, "GYMINI_DB": os.getenv("GYMINI_DB", "mock")}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    total_us, imported = 0, []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if not match:
+            continue
+        imported.append(match.group(4))
+        if match.group(4) == module and not match.group(3).strip(" "):
+            total_us = int(match.group(2))
+    return total_us / 1000, imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Guard Gymini's import-time budget.")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--module", default="main")
+    args = parser.parse_args()
+
+    timings, imported = [], []
+    for _ in range(args.runs):
+        elapsed, imported = measure(args.module)
+        timings.append(elapsed)
+    # The best run is the least noisy estimate of the real cost.
+    best = min(timings)
+    print(f"import {args.module}: best {best:.1f} ms, median {sorted(timings)[len(timings) // 2]:.1f} ms "
+          f"over {args.runs} runs (budget {args.budget_ms:.0f} ms)")
+
+    failures = []
+    if best > args.budget_ms:
+        failures.append(f"startup import time {best:.1f} ms exceeds budget {args.budget_ms:.0f} ms")
+    eager = sorted({m for m in imported for heavy in DEFERRED_MODULES if m == heavy or m.startswith(heavy + ".")})
+    if eager:
+        failures.append("heavy modules imported at startup: " + ", ".join(eager[:10]))
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from logs import record_cache
+
+# Shared two-tier cache: a size-bounded in-memory LRU in front of an optional
+# SQLite table that survives restarts. Values must be JSON-serializable.
+# Each SQLite table keeps at most `max_disk_entries` rows: every PRUNE_EVERY
+# writes (and when the table is opened) expired rows are deleted, then the
+# oldest ones beyond the cap.
+
+CACHE_PATH = os.getenv("GYMINI_CACHE_PATH", ".gymini_cache.sqlite3")
+MAX_DISK_ENTRIES = int(os.getenv("GYMINI_CACHE_MAX_ROWS", "5000"))
+PRUNE_EVERY = 100
+
+
+class TwoTierCache:
+    def __init__(self, name: str, max_entries: int = 256, ttl: float = 7 * 24 * 3600, path: str | None = CACHE_PATH,
+                 max_disk_entries: int = MAX_DISK_ENTRIES):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+        self.counters = {
+            "hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "expired": 0,
+            "disk_evictions": 0,
+        }
+        self._writes = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn_ready = False
+        self._sqlite = None
+
+    @property
+    def _conn(self):
+        # The SQLite tier is opened on first lookup, not at import time.
+        if not self._conn_ready:
+            self._conn_ready = True
+            if self.path:
+                self._sqlite = sqlite3.connect(self.path, check_same_thread=False)
+                self._sqlite.execute(
+                    f'CREATE TABLE IF NOT EXISTS "{self.name}" (key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)'
+                )
+                self._sqlite.execute(
+                    f'CREATE INDEX IF NOT EXISTS "{self.name}_stored_at" ON "{self.name}" (stored_at)'
+                )
+                self._prune(self._sqlite)
+        return self._sqlite
+
+    def _prune(self, conn):
+        """Deletes expired rows, then the oldest rows beyond max_disk_entries (called with the lock held)."""
+        expired = conn.execute(f'DELETE FROM "{self.name}" WHERE stored_at < ?', (time.time() - self.ttl,)).rowcount
+        evicted = conn.execute(
+            f'DELETE FROM "{self.name}" WHERE key IN '
+            f'(SELECT key FROM "{self.name}" ORDER BY stored_at DESC LIMIT -1 OFFSET ?)',
+            (self.max_disk_entries,),
+        ).rowcount
+        conn.commit()
+        self.counters["expired"] += expired
+        self.counters["disk_evictions"] += evicted
+
+    def get(self, key: str):
+        """Returns the cached value for `key`, or None on a miss or an expired entry."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry[1] <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self.counters["hits"] += 1
+                    self.counters["memory_hits"] += 1
+                    record_cache(self.name, "hit")
+                    return entry[0]
+                del self._memory[key]
+                self.counters["expired"] += 1
+
+            if self._conn is not None:
+                row = self._conn.execute(
+                    f'SELECT value, stored_at FROM "{self.name}" WHERE key = ?', (key,)
+                ).fetchone()
+                if row and now - row[1] <= self.ttl:
+                    value = json.loads(row[0])
+                    self._remember(key, value, row[1])
+                    self.counters["hits"] += 1
+                    self.counters["disk_hits"] += 1
+                    record_cache(self.name, "hit")
+                    return value
+                if row:
+                    self._conn.execute(f'DELETE FROM "{self.name}" WHERE key = ?', (key,))
+                    self._conn.commit()
+                    self.counters["expired"] += 1
+
+            self.counters["misses"] += 1
+            record_cache(self.name, "miss")
+            return None
+
+    def set(self, key: str, value):
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            if self._conn is not None:
+                self._conn.execute(
+                    f'INSERT OR REPLACE INTO "{self.name}" (key, value, stored_at) VALUES (?, ?, ?)',
+                    (key, json.dumps(value), now),
+                )
+                self._conn.commit()
+                self._writes += 1
+                if self._writes % PRUNE_EVERY == 0:
+                    self._prune(self._conn)
+
+    def _remember(self, key: str, value, stored_at: float):
+        self._memory[key] = (value, stored_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                self._conn.execute(f'DELETE FROM "{self.name}"')
+                self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            hit_rate = self.counters["hits"] / lookups if lookups else 0.0
+            return {**self.counters, "size": len(self._memory), "hit_rate": round(hit_rate, 3)}
@@ -0,0 +1,220 @@
+import datetime as dt
+import os
+import threading
+from collections import OrderedDict
+from agents.exercise_names import canonical_exercise
+
+# Incrementally maintained training rollups.
+# Every logged exercise updates per-day, per-week and per-exercise totals
+# (volume = sets × reps × weight, top set, estimated 1RM, session count) and
+# the day's summary message, so summaries and progress questions are answered
+# from this state instead of re-reading and re-walking the logs.
+
+
+def estimated_1rm(weight_kg: float, reps: int) -> float:
+    """Epley estimate of the one-rep max for a set of `reps` at `weight_kg`."""
+    if reps <= 1:
+        return round(float(weight_kg), 1)
+    return round(weight_kg * (1 + reps / 30), 1)
+
+
+def _format_weight(weight_kg) -> str:
+    return str(int(weight_kg)) if float(weight_kg).is_integer() else str(weight_kg)
+
+
+def _entry_date(entry: dict) -> str:
+    return entry.get("date_string") or entry.get("date") or entry["timestamp"][:10]
+
+
+def _week_key(date: str) -> str:
+    year, week, _ = dt.date.fromisoformat(date).isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+class TrainingAggregates:
+    def __init__(self):
+        self.days = {}
+        self.weeks = {}
+        self.exercises = {}
+        self.last_date = None
+        self.loaded = False
+        # Canonical names of the exercises whose whole history is folded in, when
+        # the rollups were seeded from the latest session only; None after a full rebuild.
+        self.seeded = None
+        # Bumped on every change, so views derived from the logs can tell they are stale.
+        self.version = 0
+        self._lock = threading.Lock()
+
+    def record(self, entry: dict) -> dict:
+        """
+        Folds one logged exercise into the rollups.
+        Returns personal-record flags for it: {"weight_pr": bool, "e1rm_pr": bool}.
+        """
+        date = _entry_date(entry)
+        sets, reps, weight = int(entry["sets"]), int(entry["reps"]), float(entry["weight_kg"])
+        volume = sets * reps * weight
+        e1rm = estimated_1rm(weight, reps)
+        key = canonical_exercise(entry["exercise"])
+
+        with self._lock:
+            day = self.days.get(date)
+            if day is None:
+                day = self.days[date] = {"date": date, "volume": 0.0, "sets": 0, "parts": [], "message": ""}
+            day["volume"] += volume
+            day["sets"] += sets
+            day["parts"].append(f"{sets}×{reps} {entry['exercise']} at {_format_weight(weight)}kg")
+            day["message"] = f"On {date}, you did " + " and ".join(day["parts"]) + "."
+
+            week = self.weeks.setdefault(_week_key(date), {"volume": 0.0, "sets": 0, "dates": set()})
+            week["volume"] += volume
+            week["sets"] += sets
+            week["dates"].add(date)
+
+            stats = self.exercises.get(key)
+            if stats is None:
+                stats = self.exercises[key] = {
+                    "name": entry["exercise"], "volume": 0.0, "sets": 0, "top_set": None,
+                    "best_e1rm": 0.0, "dates": set(), "last_date": None, "day_best": {},
+                }
+            flags = {
+                "weight_pr": stats["top_set"] is not None and weight > stats["top_set"]["weight_kg"],
+                "e1rm_pr": stats["best_e1rm"] > 0 and e1rm > stats["best_e1rm"],
+            }
+            stats["volume"] += volume
+            stats["sets"] += sets
+            if stats["top_set"] is None or weight > stats["top_set"]["weight_kg"]:
+                stats["top_set"] = {"weight_kg": weight, "reps": reps, "date": date}
+            stats["best_e1rm"] = max(stats["best_e1rm"], e1rm)
+            stats["day_best"][date] = max(stats["day_best"].get(date, 0.0), e1rm)
+            stats["dates"].add(date)
+            if stats["last_date"] is None or date >= stats["last_date"]:
+                stats["last_date"] = date
+
+            if self.last_date is None or date >= self.last_date:
+                self.last_date = date
+            self.version += 1
+        return flags
+
+    def rebuild(self, entries, complete: bool = True):
+        """
+        Recomputes every rollup from raw logged exercises (backfills, startup).
+        With complete=False, `entries` are only the latest session: per-exercise
+        stats then need seed_exercise before they are trusted.
+        """
+        fresh = TrainingAggregates()
+        for entry in sorted(entries, key=lambda e: (_entry_date(e), e.get("timestamp", ""))):
+            fresh.record(entry)
+        with self._lock:
+            self.days, self.weeks, self.exercises = fresh.days, fresh.weeks, fresh.exercises
+            self.last_date = fresh.last_date
+            self.seeded = None if complete else set()
+            self.loaded = True
+            self.version += 1
+
+    def needs_seed(self, exercise: str) -> bool:
+        """True when `exercise`'s stats do not cover its whole history yet."""
+        with self._lock:
+            return self.seeded is not None and canonical_exercise(exercise) not in self.seeded
+
+    def seed_exercise(self, exercise: str, entries):
+        """Replaces `exercise`'s stats with a recomputation from its whole history (`entries`)."""
+        key = canonical_exercise(exercise)
+        fresh = TrainingAggregates()
+        for entry in sorted(entries, key=lambda e: (_entry_date(e), e.get("timestamp", ""))):
+            fresh.record(entry)
+        with self._lock:
+            if key in fresh.exercises:
+                self.exercises[key] = fresh.exercises[key]
+            else:
+                self.exercises.pop(key, None)
+            if self.seeded is not None:
+                self.seeded.add(key)
+            self.version += 1
+
+    def invalidate(self):
+        """Marks the rollups stale after writes made elsewhere (e.g. an import in other processes)."""
+        with self._lock:
+            self.loaded = False
+            self.version += 1
+
+    def day_summary(self, date: str | None = None) -> dict:
+        """Summary of `date` (default: the latest session), same shape as summary_agent.get_summary."""
+        date = date or self.last_date
+        day = self.days.get(date) if date else None
+        if day is None:
+            return {"id": "summary", "message": "No workouts logged yet."}
+        return {"id": "summary", "message": day["message"]}
+
+    def best_before(self, exercise: str, date: str) -> float | None:
+        """Best estimated 1RM of `exercise` on days before `date`, or None if it was not logged before."""
+        with self._lock:
+            stats = self.exercises.get(canonical_exercise(exercise))
+            earlier = [best for day, best in stats["day_best"].items() if day < date] if stats else []
+        return max(earlier) if earlier else None
+
+    def snapshot(self) -> dict:
+        """Plain, comparable view of all rollups."""
+        with self._lock:
+            return {
+                "days": {d: {k: v for k, v in day.items() if k != "parts"} for d, day in self.days.items()},
+                "weeks": {w: _week_view(stats) for w, stats in self.weeks.items()},
+                "exercises": {k: _exercise_view(stats) for k, stats in self.exercises.items()},
+                "last_date": self.last_date,
+            }
+
+    def verify(self, entries) -> bool:
+        """True when the incremental rollups match a full recomputation from `entries`."""
+        expected = TrainingAggregates()
+        expected.rebuild(entries)
+        return _rounded(self.snapshot()) == _rounded(expected.snapshot())
+
+
+def _week_view(stats: dict) -> dict:
+    return {"volume": round(stats["volume"], 1), "sets": stats["sets"], "session_count": len(stats["dates"])}
+
+
+def _exercise_view(stats: dict) -> dict:
+    return {
+        "name": stats["name"],
+        "volume": round(stats["volume"], 1),
+        "sets": stats["sets"],
+        "top_set": dict(stats["top_set"]),
+        "best_e1rm": stats["best_e1rm"],
+        "session_count": len(stats["dates"]),
+        "last_date": stats["last_date"],
+    }
+
+
+def _rounded(value):
+    # Float sums can differ in the last bits depending on insertion order.
+    if isinstance(value, float):
+        return round(value, 6)
+    if isinstance(value, dict):
+        return {k: _rounded(v) for k, v in value.items()}
+    return value
+
+
+# Rollups per user, created on first use; beyond GYMINI_ROLLUP_USERS the least
+# recently used are dropped (and rebuilt from the backend if that user returns).
+MAX_USERS = int(os.getenv("GYMINI_ROLLUP_USERS", "256"))
+_USERS = OrderedDict()
+_users_lock = threading.Lock()
+
+
+def for_user(user_id: str) -> TrainingAggregates:
+    """The rollups of `user_id` (not necessarily loaded yet)."""
+    with _users_lock:
+        aggregates = _USERS.get(user_id)
+        if aggregates is None:
+            aggregates = _USERS[user_id] = TrainingAggregates()
+            while len(_USERS) > MAX_USERS:
+                _USERS.popitem(last=False)
+        else:
+            _USERS.move_to_end(user_id)
+    return aggregates
+
+
+def loaded_users() -> dict:
+    """{user_id: rollups} of the users whose rollups are currently loaded."""
+    with _users_lock:
+        return {user_id: aggregates for user_id, aggregates in _USERS.items() if aggregates.loaded}
@@ -0,0 +1,94 @@
+import contextvars
+import importlib
+import os
+from contextlib import contextmanager
+
+# Storage backend selection.
+# The backend module is only imported (and, for Firebase, initialized) the
+# first time it is used, so mock/SQLite runs never load firebase_admin/gRPC.
+
+# Checking firebase Key exists
+USE_FIREBASE = os.path.exists("db/serviceAccountKey.json")
+
+# Storage backend: "firebase", "sqlite" (durable local file) or "mock" (in-memory).
+DB_BACKEND = os.getenv("GYMINI_DB", "firebase" if USE_FIREBASE else "mock").lower()
+
+BACKEND_MODULES = {
+    "firebase": "db.firebase_db",
+    "sqlite": "db.sqlite_db",
+    "mock": "db.mock_db",
+}
+
+
+# User whose history storage calls read and write: each server session binds
+# its own (use_user); the CLI and the importer default to GYMINI_USER_ID.
+DEFAULT_USER_ID = os.getenv("GYMINI_USER_ID", "mock_reviewer")
+_USER_ID = contextvars.ContextVar("gymini_user", default=DEFAULT_USER_ID)
+
+
+def use_user(user_id: str):
+    """Binds `user_id` as the user whose history the current context reads and writes."""
+    return _USER_ID.set(user_id)
+
+
+def current_user() -> str:
+    return _USER_ID.get()
+
+
+# Evaluation sandbox: while active (per thread/task), every read and write goes
+# to a private in-memory store with its own training rollups.
+_SANDBOX = contextvars.ContextVar("gymini_sandbox", default=None)
+
+
+class SandboxStore:
+    """In-memory store with the mock backend's API."""
+
+    def __init__(self):
+        from db.aggregates import TrainingAggregates
+        self.logs = {}
+        self.aggregates = TrainingAggregates()
+
+    def log_session_mock(self, exercise: str, sets: int, reps: int, weight_kg: float,
+                         user_id: str = DEFAULT_USER_ID) -> dict:
+        import db.mock_db
+        return db.mock_db.log_session_mock(exercise, sets, reps, weight_kg, logs=self.logs, user_id=user_id)
+
+    def log_sessions_mock(self, entries: list[dict], user_id: str = DEFAULT_USER_ID) -> list[dict]:
+        import db.mock_db
+        return db.mock_db.log_sessions_mock(entries, logs=self.logs, user_id=user_id)
+
+    def query_logs(self, exercise=None, start_date=None, end_date=None, last_sessions=None,
+                   user_id: str = DEFAULT_USER_ID) -> list[dict]:
+        import db.mock_db
+        return db.mock_db.query_logs(exercise, start_date, end_date, last_sessions, logs=self.logs)
+
+    def get_all_logs(self, user_id: str = DEFAULT_USER_ID) -> dict:
+        # A sandbox holds one evaluation's writes: every user shares it.
+        return self.logs
+
+
+@contextmanager
+def sandbox():
+    """Routes storage calls made inside the block to a fresh SandboxStore."""
+    token = _SANDBOX.set(SandboxStore())
+    try:
+        yield _SANDBOX.get()
+    finally:
+        _SANDBOX.reset(token)
+
+
+def current_sandbox() -> SandboxStore | None:
+    return _SANDBOX.get()
+
+
+def active_backend() -> str:
+    """Name of the backend storage calls go to right now ("mock" inside a sandbox)."""
+    return "mock" if _SANDBOX.get() is not None else DB_BACKEND
+
+
+def get_backend(name: str | None = None):
+    """Returns the backend module for `name` (default: the active backend), importing it on first use."""
+    store = _SANDBOX.get()
+    if store is not None:
+        return store
+    return importlib.import_module(BACKEND_MODULES[name or DB_BACKEND])
@@ -0,0 +1,183 @@
+import datetime as dt
+import numpy as np
+from agents.exercise_names import canonical_exercise
+
+# Columnar training history.
+# A user's logged exercises as parallel NumPy arrays (day number, exercise id,
+# sets, reps, weight) plus an exercise-name dictionary, instead of a list of
+# dicts with ISO timestamp strings. Volume trends, e1RM curves, weekly tonnage
+# and PR detection are vectorized over the arrays, so queries over years of
+# logs take milliseconds and a fraction of the dict representation's memory.
+#
+# numpy is only imported when this module is, i.e. on the first progress
+# query (benchmarks/startup_bench.py keeps it out of startup).
+
+_EPOCH = np.datetime64("1970-01-01", "D")
+
+
+def _entry_date(entry: dict) -> str:
+    return entry.get("date_string") or entry.get("date") or entry["timestamp"][:10]
+
+
+def _iso(day) -> str:
+    return str(_EPOCH + np.timedelta64(int(day), "D"))
+
+
+def _day(date: str | dt.date | None):
+    if date is None:
+        return None
+    return int((np.datetime64(str(date), "D") - _EPOCH).astype(np.int64))
+
+
+class ColumnarHistory:
+    """One user's history, oldest first. Build it with from_entries()."""
+
+    def __init__(self, day, exercise, sets, reps, weight, names: list[str], labels: list[str]):
+        self.day = day            # int32 days since 1970-01-01
+        self.exercise = exercise  # int32 index into names/labels
+        self.sets = sets          # int16
+        self.reps = reps          # int16
+        self.weight = weight      # float32 kg
+        self.names = names        # canonical exercise names
+        self.labels = labels      # display name of each exercise (first seen)
+        self._ids = {name: i for i, name in enumerate(names)}
+
+    @classmethod
+    def from_entries(cls, entries) -> "ColumnarHistory":
+        """Builds the arrays from logged exercise dicts (any backend's shape)."""
+        dates, ids, sets, reps, weights = [], [], [], [], []
+        names, labels, index = [], [], {}
+        for entry in entries:
+            key = canonical_exercise(entry["exercise"])
+            i = index.get(key)
+            if i is None:
+                i = index[key] = len(names)
+                names.append(key)
+                labels.append(entry["exercise"])
+            dates.append(_entry_date(entry))
+            ids.append(i)
+            sets.append(entry["sets"])
+            reps.append(entry["reps"])
+            weights.append(entry["weight_kg"])
+        day = (np.array(dates, dtype="datetime64[D]") - _EPOCH).astype(np.int32)
+        # Stable sort: entries of the same day keep their logging order.
+        order = np.argsort(day, kind="stable")
+        return cls(
+            day[order],
+            np.array(ids, dtype=np.int32)[order],
+            np.array(sets, dtype=np.int16)[order],
+            np.array(reps, dtype=np.int16)[order],
+            np.array(weights, dtype=np.float32)[order],
+            names, labels,
+        )
+
+    def __len__(self) -> int:
+        return len(self.day)
+
+    @property
+    def nbytes(self) -> int:
+        return self.day.nbytes + self.exercise.nbytes + self.sets.nbytes + self.reps.nbytes + self.weight.nbytes
+
+    def exercise_id(self, exercise: str) -> int | None:
+        return self._ids.get(canonical_exercise(exercise))
+
+    def mask(self, exercise: str | None = None, start=None, end=None):
+        """Boolean row mask for an exercise and an inclusive ISO date range (all optional)."""
+        selected = np.ones(len(self), dtype=bool)
+        if exercise is not None:
+            i = self.exercise_id(exercise)
+            if i is None:
+                return np.zeros(len(self), dtype=bool)
+            selected &= self.exercise == i
+        if start is not None:
+            selected &= self.day >= _day(start)
+        if end is not None:
+            selected &= self.day <= _day(end)
+        return selected
+
+    def weight_kg(self):
+        """Weights as float64, rounded back to the logged 0.1 kg precision."""
+        return np.round(self.weight.astype(np.float64), 1)
+
+    def volume(self):
+        """sets × reps × weight of every row."""
+        return self.sets.astype(np.float64) * self.reps * self.weight_kg()
+
+    def e1rm(self):
+        """Epley estimated 1RM of every row (the weight itself for singles), rounded like db.aggregates."""
+        weight = self.weight_kg()
+        return np.round(np.where(self.reps <= 1, weight, weight * (1 + self.reps / 30)), 1)
+
+    def daily_volume(self, exercise: str | None = None, start=None, end=None) -> list[tuple[str, float]]:
+        """[(date, volume)] per training day."""
+        selected = self.mask(exercise, start, end)
+        return self._group_sum(self.day[selected], self.volume()[selected])
+
+    def weekly_tonnage(self, exercise: str | None = None, start=None, end=None) -> list[tuple[str, float]]:
+        """[(monday of the ISO week, volume)] per week with training."""
+        selected = self.mask(exercise, start, end)
+        # 1970-01-01 was a Thursday: shifting by 3 days makes weeks start on Monday.
+        monday = (self.day[selected] + 3) // 7 * 7 - 3
+        return self._group_sum(monday, self.volume()[selected])
+
+    def e1rm_curve(self, exercise: str, start=None, end=None) -> list[tuple[str, float]]:
+        """[(date, best estimated 1RM of the day)] for one exercise."""
+        selected = self.mask(exercise, start, end)
+        days = self.day[selected]
+        if not len(days):
+            return []
+        values = self.e1rm()[selected]
+        # Rows are sorted by day, so each day is one contiguous run.
+        starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+        best = np.maximum.reduceat(values, starts)
+        return [(_iso(d), round(float(v), 1)) for d, v in zip(days[starts], best)]
+
+    def personal_records(self, exercise: str | None = None, metric: str = "e1rm",
+                         baseline: float | None = None) -> list[dict]:
+        """
+        Rows that beat every earlier row of the same exercise on `metric`
+        ("e1rm" or "weight"); an exercise's first row is not counted as a PR.
+        With `exercise`, `baseline` is its best `metric` before these rows (e.g.
+        before a date window): every row, the first one included, must beat it.
+        """
+        selected = np.flatnonzero(self.mask(exercise))
+        if not len(selected):
+            return []
+        values = (self.e1rm() if metric == "e1rm" else self.weight_kg())[selected]
+        if baseline is not None:
+            if exercise is None:
+                raise ValueError("a baseline needs an exercise")
+            earlier_best = np.maximum.accumulate(np.r_[baseline, values])[:-1]
+            records = selected[values > earlier_best]
+        else:
+            ids = self.exercise[selected]
+            # Group rows by exercise (keeping time order) and take a running max per
+            # group: offsetting each group above the previous ones lets a single
+            # np.maximum.accumulate run over all groups at once.
+            order = np.lexsort((np.arange(len(ids)), ids))
+            ids, values, rows = ids[order], values[order], selected[order]
+            shifted = values + ids * (float(values.max()) + 1)
+            running = np.maximum.accumulate(shifted)
+            first = np.r_[True, ids[1:] != ids[:-1]]
+            beats = np.r_[False, shifted[1:] > running[:-1]] & ~first
+            records = np.sort(rows[beats])
+        weight, e1rm = self.weight_kg(), self.e1rm()
+        return [
+            {
+                "exercise": self.labels[self.exercise[r]],
+                "date": _iso(self.day[r]),
+                "sets": int(self.sets[r]),
+                "reps": int(self.reps[r]),
+                "weight_kg": float(weight[r]),
+                "e1rm": float(e1rm[r]),
+            }
+            for r in records
+        ]
+
+    @staticmethod
+    def _group_sum(keys, values) -> list[tuple[str, float]]:
+        if not len(keys):
+            return []
+        unique, inverse = np.unique(keys, return_inverse=True)
+        totals = np.bincount(inverse, weights=values)
+        return [(_iso(k), round(float(v), 1)) for k, v in zip(unique, totals)]
@@ -0,0 +1,155 @@
+import copy
+import threading
+import time
+
+# In-memory stand-in for the slice of the Firestore client Gymini uses
+# (collection/document set with merge + ArrayUnion, batches, order_by/limit/
+# stream), so Firestore code paths can run offline. Every RPC is counted in
+# `rpc_count`.
+
+
+class ArrayUnion:
+    def __init__(self, values):
+        self.values = list(values)
+
+
+class Query:
+    DESCENDING = "DESCENDING"
+    ASCENDING = "ASCENDING"
+
+
+class FakeSnapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+
+class FakeDocument:
+    def __init__(self, store, collection, doc_id):
+        self._store = store
+        self._collection = collection
+        self.id = doc_id
+
+    def set(self, data, merge=False, timeout=None):
+        self._store._count_rpc()
+        self._store._apply_set(self._collection, self.id, data, merge)
+
+    def get(self):
+        self._store._count_rpc()
+        with self._store._lock:
+            data = self._store.collections.get(self._collection, {}).get(self.id)
+            return FakeSnapshot(self.id, copy.deepcopy(data))
+
+
+class FakeQuery:
+    def __init__(self, store, collection, filters=(), order=None, limit=None, fields=None):
+        self._store = store
+        self._collection = collection
+        self._filters = list(filters)
+        self._order = order
+        self._limit = limit
+        self._fields = fields
+
+    def where(self, field, op, value):
+        return FakeQuery(self._store, self._collection, self._filters + [(field, op, value)],
+                         self._order, self._limit, self._fields)
+
+    def order_by(self, field, direction=Query.ASCENDING):
+        return FakeQuery(self._store, self._collection, self._filters, (field, direction), self._limit, self._fields)
+
+    def limit(self, count):
+        return FakeQuery(self._store, self._collection, self._filters, self._order, count, self._fields)
+
+    def select(self, fields):
+        return FakeQuery(self._store, self._collection, self._filters, self._order, self._limit, list(fields))
+
+    def stream(self, timeout=None):
+        self._store._count_rpc()
+        ops = {
+            "==": lambda a, b: a == b, "<": lambda a, b: a < b, "<=": lambda a, b: a <= b,
+            ">": lambda a, b: a > b, ">=": lambda a, b: a >= b,
+            "array_contains": lambda a, b: b in a,
+        }
+        with self._store._lock:
+            docs = [(doc_id, copy.deepcopy(data)) for doc_id, data in self._store.collections.get(self._collection, {}).items()]
+        docs = [d for d in docs if all(field in d[1] and ops[op](d[1][field], value) for field, op, value in self._filters)]
+        if self._order:
+            field, direction = self._order
+            docs.sort(key=lambda d: d[1].get(field), reverse=direction == Query.DESCENDING)
+        if self._limit is not None:
+            docs = docs[: self._limit]
+        for doc_id, data in docs:
+            if self._fields is not None:
+                data = {k: v for k, v in data.items() if k in self._fields}
+            self._store.reads += 1
+            yield FakeSnapshot(doc_id, data)
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, store, name):
+        super().__init__(store, name)
+
+    def document(self, doc_id):
+        return FakeDocument(self._store, self._collection, doc_id)
+
+
+class FakeBatch:
+    def __init__(self, store):
+        self._store = store
+        self._writes = []
+
+    def set(self, doc_ref, data, merge=False):
+        self._writes.append((doc_ref, data, merge))
+
+    def commit(self, timeout=None):
+        self._store._count_rpc()
+        for doc_ref, data, merge in self._writes:
+            self._store._apply_set(doc_ref._collection, doc_ref.id, data, merge)
+        self._writes = []
+
+
+class FakeFirestore:
+    def __init__(self, latency=0.0, fail_next=0, failure=None):
+        self.collections = {}
+        self.rpc_count = 0
+        self.reads = 0
+        self.latency = latency
+        # Raise `failure` on the next `fail_next` RPCs (to exercise retry paths).
+        self.fail_next = fail_next
+        self.failure = failure or ConnectionError("fake transient failure")
+        self._lock = threading.Lock()
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def _count_rpc(self):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            if self.fail_next > 0:
+                self.fail_next -= 1
+                raise self.failure
+            self.rpc_count += 1
+
+    def _apply_set(self, collection, doc_id, data, merge):
+        with self._lock:
+            docs = self.collections.setdefault(collection, {})
+            current = docs.get(doc_id, {}) if merge else {}
+            for key, value in data.items():
+                if hasattr(value, "values") and not isinstance(value, dict):
+                    existing = list(current.get(key, []))
+                    existing.extend(v for v in value.values if v not in existing)
+                    current[key] = existing
+                else:
+                    current[key] = copy.deepcopy(value)
+            docs[doc_id] = current
@@ -1,19 +1,100 @@
+import atexit
+import os
+import threading
 import uuid
-from firebase_admin import firestore
-from db.firebase_init import initialize_firebase
+import resilience
+from agents.exercise_names import canonical_exercise
+from db.backend import DEFAULT_USER_ID
+from db.write_behind import MAX_BATCH_WRITES, WriteBehindQueue, exercise_keys, has_journal, transient_errors
 
+# Firestore backend. Nothing is initialized at import time: the Firebase app,
+# the Firestore client (and the firebase_admin/gRPC imports behind them) and
+# the write-behind queue are created on first use.
 
-db = initialize_firebase()
+# Write-behind logging: save_session returns as soon as the exercise is queued,
+# and the queue commits batches per session document in the background.
+# Set GYMINI_FIRESTORE_WRITE_BEHIND=0 to write synchronously instead.
+WRITE_BEHIND = os.getenv("GYMINI_FIRESTORE_WRITE_BEHIND", "1") == "1"
+# Queued writes that could not be committed are kept here and replayed on the next start.
+JOURNAL_PATH = os.getenv("GYMINI_FIRESTORE_JOURNAL", ".gymini_firestore_journal.jsonl")
 
-def save_session(date, exercise_data)-> dict:
+# Turn-blocking Firestore calls (synchronous writes and reads) share one call
+# policy; background write-behind commits keep their own retry loop.
+FIRESTORE_POLICY = resilience.CallPolicy(
+    "firestore", timeout=float(os.getenv("GYMINI_FIRESTORE_TIMEOUT", "10")), max_attempts=3, base_delay=0.2,
+    is_retryable=lambda e: isinstance(e, transient_errors()), hedge=True,
+)
+
+_db = None
+_write_queue = None
+_lock = threading.Lock()
+
+
+def sessions_collection(user_id: str = DEFAULT_USER_ID) -> str:
+    """
+    Collection path of a user's session documents (one per date). The default
+    user keeps the original top-level "sessions" collection.
+    """
+    return "sessions" if user_id == DEFAULT_USER_ID else f"users/{user_id}/sessions"
+
+
+def get_db():
+    """Initializes Firebase and returns the Firestore client on first call."""
+    global _db
+    if _db is None:
+        with _lock:
+            if _db is None:
+                from db.firebase_init import initialize_firebase
+                _db = initialize_firebase()
+    return _db
+
+
+def get_write_queue():
+    """Returns the write-behind queue (None when disabled), starting it on first call."""
+    global _write_queue
+    if WRITE_BEHIND and _write_queue is None:
+        with _lock:
+            if _write_queue is None:
+                from firebase_admin import firestore
+                _write_queue = WriteBehindQueue(
+                    get_db,
+                    collection="sessions",
+                    max_batch=int(os.getenv("GYMINI_FIRESTORE_BATCH_SIZE", "20")),
+                    max_delay=float(os.getenv("GYMINI_FIRESTORE_BATCH_DELAY", "1.0")),
+                    array_union=firestore.ArrayUnion,
+                    journal_path=JOURNAL_PATH,
+                )
+                atexit.register(_write_queue.close)
+    return _write_queue
+
+
+def _flush_writes():
+    """Lets reads see queued writes, including journaled ones left by an earlier run."""
+    write_queue = _write_queue
+    if write_queue is None and has_journal(JOURNAL_PATH):
+        write_queue = get_write_queue()
+    if write_queue is not None:
+        write_queue.flush(timeout=5.0)
+
+
+def save_session(date, exercise_data, user_id: str = DEFAULT_USER_ID)-> dict:
     mock_id = str(uuid.uuid4())[:8]
     exercise_data["id"] = mock_id
-    doc_ref = db.collection("sessions").document(date)
-    doc_ref.set({
-        "date": date,
-        "exercises": firestore.ArrayUnion([exercise_data])
-    }, merge=True)
-    print(f"🔥 Logged to Firebase: {exercise_data}")
+    collection = sessions_collection(user_id)
+    write_queue = get_write_queue()
+    if write_queue is not None:
+        write_queue.submit(date, exercise_data, collection)
+        print(f"🔥 Queued for Firebase: {exercise_data}")
+    else:
+        from firebase_admin import firestore
+        doc_ref = get_db().collection(collection).document(date)
+        # ArrayUnion of the same exercise (same id) is idempotent, so retries are safe.
+        FIRESTORE_POLICY.call(lambda timeout: doc_ref.set({
+            "date": date,
+            "exercises": firestore.ArrayUnion([exercise_data]),
+            "exercise_keys": firestore.ArrayUnion(exercise_keys([exercise_data])),
+        }, merge=True, timeout=timeout))
+        print(f"🔥 Logged to Firebase: {exercise_data}")
     return {
     "id": mock_id,
     "message": f"✅ Successfully logged {exercise_data['sets']} sets of "
@@ -22,15 +103,124 @@ def save_session(date, exercise_data)-> dict:
 }
 
 
-def get_last_session() -> dict | None:
+def save_sessions(date, exercises: list[dict], user_id: str = DEFAULT_USER_ID) -> list[dict]:
+    """
+    Bulk variant of save_session: all exercises land in the date's session
+    document with one write (queued together, or one synchronous set).
+    """
+    for exercise_data in exercises:
+        exercise_data["id"] = str(uuid.uuid4())[:8]
+    collection = sessions_collection(user_id)
+    write_queue = get_write_queue()
+    if write_queue is not None:
+        for exercise_data in exercises:
+            write_queue.submit(date, exercise_data, collection)
+        print(f"🔥 Queued {len(exercises)} exercises for Firebase")
+    else:
+        from firebase_admin import firestore
+        doc_ref = get_db().collection(collection).document(date)
+        FIRESTORE_POLICY.call(lambda timeout: doc_ref.set({
+            "date": date,
+            "exercises": firestore.ArrayUnion(exercises),
+            "exercise_keys": firestore.ArrayUnion(exercise_keys(exercises)),
+        }, merge=True, timeout=timeout))
+        print(f"🔥 Logged {len(exercises)} exercises to Firebase")
+    return [
+        {
+            "id": ex["id"],
+            "message": f"✅ Successfully logged {ex['sets']} sets of {ex['reps']} reps of {ex['exercise']} "
+                       f"at {ex['weight_kg']}kg."
+        }
+        for ex in exercises
+    ]
+
+
+def import_sessions(sessions: dict[str, list[dict]], user_id: str = DEFAULT_USER_ID) -> int:
+    """
+    Bulk import (importer.py): merges {date: [exercise dicts with ids]} into the
+    user's session documents with batched writes of up to MAX_BATCH_WRITES documents,
+    bypassing the write-behind queue. ArrayUnion ignores exercises already in
+    the document, so re-importing a batch is harmless. Returns the exercise count.
+    """
+    from firebase_admin import firestore
+    client = get_db()
+    collection = sessions_collection(user_id)
+    dates = sorted(sessions)
+    for start in range(0, len(dates), MAX_BATCH_WRITES):
+        batch = client.batch()
+        for date in dates[start:start + MAX_BATCH_WRITES]:
+            batch.set(client.collection(collection).document(date), {
+                "date": date,
+                "exercises": firestore.ArrayUnion(sessions[date]),
+                "exercise_keys": firestore.ArrayUnion(exercise_keys(sessions[date])),
+            }, merge=True)
+        FIRESTORE_POLICY.call(lambda timeout: batch.commit(timeout=timeout))
+    return sum(len(exercises) for exercises in sessions.values())
+
+
+def iter_logs(user_id: str = DEFAULT_USER_ID):
+    """
+    Streams every exercise the user logged, oldest session first. Reads the
+    user's whole collection: meant for analytics and backfills, not per-turn lookups.
+    """
+    _flush_writes()
+    query = get_db().collection(sessions_collection(user_id)).order_by("date")
+    docs = FIRESTORE_POLICY.call(lambda timeout: list(query.stream(timeout=timeout)))
+    for doc in docs:
+        session = doc.to_dict()
+        for exercise in session.get("exercises", []):
+            yield {**exercise, "date_string": exercise.get("date_string") or session["date"]}
+
+
+def query_logs(exercise: str | None = None, start_date: str | None = None, end_date: str | None = None,
+               last_sessions: int | None = None, user_id: str = DEFAULT_USER_ID) -> list[dict]:
+    """
+    The user's logged exercises matching an exercise, an inclusive ISO date range and/or
+    the last N sessions, oldest first. Filters run in Firestore (array_contains
+    on exercise_keys, a range on date, limit), so only the session documents in
+    the window are read. Combining the exercise filter with a date range needs
+    a composite index on (exercise_keys, date); session documents written
+    before exercise_keys existed only match queries without an exercise.
+    """
+    from firebase_admin import firestore
+    _flush_writes()
+    key = canonical_exercise(exercise) if exercise else None
+    query = get_db().collection(sessions_collection(user_id))
+    if key:
+        query = query.where("exercise_keys", "array_contains", key)
+    if start_date:
+        query = query.where("date", ">=", start_date)
+    if end_date:
+        query = query.where("date", "<=", end_date)
+    if last_sessions:
+        query = query.order_by("date", direction=firestore.Query.DESCENDING).limit(last_sessions)
+    else:
+        query = query.order_by("date")
+    query = query.select(["date", "exercises"])
+    docs = FIRESTORE_POLICY.call(lambda timeout: list(query.stream(timeout=timeout)))
+    sessions = [doc.to_dict() for doc in docs]
+    if last_sessions:
+        sessions.reverse()
+    return [
+        {**exercise, "date_string": exercise.get("date_string") or session["date"]}
+        for session in sessions
+        for exercise in session.get("exercises", [])
+        if key is None or canonical_exercise(exercise["exercise"]) == key
+    ]
+
+
+def get_last_session(user_id: str = DEFAULT_USER_ID) -> dict | None:
     """
-    Fetch the most recent workout session from Firestore.
+    Fetch the user's most recent workout session from Firestore.
     Returns the document dict or None if no sessions exist.
     """
-    sessions_ref = db.collection("sessions")
+    from firebase_admin import firestore
+    # Read our own queued writes.
+    _flush_writes()
+    sessions_ref = get_db().collection(sessions_collection(user_id))
     # Order by the 'date' field descending, limit to 1
     query = sessions_ref.order_by("date", direction=firestore.Query.DESCENDING).limit(1)
-    docs = query.stream()
+    docs = FIRESTORE_POLICY.call(lambda timeout: list(query.stream(timeout=timeout)))
 
     for doc in docs:
         return doc.to_dict()
@@ -1,14 +1,24 @@
 import datetime as dt
 import uuid
+from db.backend import DEFAULT_USER_ID
 
-# This is our mock database: a simple list in memory.
+# This is our mock database: {user_id: {date: session}} in memory.
 WORKOUT_LOGS = {}
 
-def log_session_mock(exercise: str, sets: int, reps: int, weight_kg: float) -> dict:
+
+def _user_logs(user_id: str) -> dict:
+    return WORKOUT_LOGS.setdefault(user_id, {})
+
+
+def log_session_mock(exercise: str, sets: int, reps: int, weight_kg: float, logs: dict | None = None,
+                     user_id: str = DEFAULT_USER_ID) -> dict:
     """
     Simulates logging a workout session to a database.
     Instead of writing to Firestore, it appends the data to a Python list.
+    `logs` selects another in-memory store (e.g. an evaluation sandbox).
     """
+    if logs is None:
+        logs = _user_logs(user_id)
     # Generate a mock document ID
     mock_id = str(uuid.uuid4())[:8]
     # Date of today
@@ -22,15 +32,15 @@ def log_session_mock(exercise: str, sets: int, reps: int, weight_kg: float) -> d
         "weight_kg": weight_kg,
         "timestamp": dt.datetime.now().isoformat(),
         "date_string": dt.date.today().isoformat(),
-        "user_id": "mock_reviewer" # Use a consistent ID for testing
+        "user_id": user_id,
     }
 
     # Check if this is the first log of the day
-    if today not in WORKOUT_LOGS:
-        WORKOUT_LOGS[today] = {"date": today, "exercises": []}
+    if today not in logs:
+        logs[today] = {"date": today, "exercises": []}
 
     # "Write" the data to the mock database
-    WORKOUT_LOGS[today]["exercises"].append(new_exercise)
+    logs[today]["exercises"].append(new_exercise)
 
 
 
@@ -48,6 +58,62 @@ def log_session_mock(exercise: str, sets: int, reps: int, weight_kg: float) -> d
     }
 
 
-def get_all_logs():
-    """Returns the entire mock database list for debugging/verification."""
-    return WORKOUT_LOGS
\ No newline at end of file
+def log_sessions_mock(entries: list[dict], logs: dict | None = None, user_id: str = DEFAULT_USER_ID) -> list[dict]:
+    """
+    Bulk variant of log_session_mock: `entries` ({"exercise", "sets", "reps",
+    "weight_kg", "timestamp"}) are appended to today's session in one update.
+    """
+    if logs is None:
+        logs = _user_logs(user_id)
+    today = dt.date.today().isoformat()
+    new_exercises = [
+        {
+            "id": str(uuid.uuid4())[:8],
+            "exercise": entry["exercise"],
+            "sets": entry["sets"],
+            "reps": entry["reps"],
+            "weight_kg": entry["weight_kg"],
+            "timestamp": entry.get("timestamp") or dt.datetime.now().isoformat(),
+            "date_string": today,
+            "user_id": user_id,
+        }
+        for entry in entries
+    ]
+    logs.setdefault(today, {"date": today, "exercises": []})["exercises"].extend(new_exercises)
+    return [
+        {
+            "id": ex["id"],
+            "message": f"✅ Successfully logged {ex['sets']} sets of {ex['reps']} reps of {ex['exercise']} at {ex['weight_kg']}kg."
+        }
+        for ex in new_exercises
+    ]
+
+
+def query_logs(exercise: str | None = None, start_date: str | None = None, end_date: str | None = None,
+               last_sessions: int | None = None, logs: dict | None = None, user_id: str = DEFAULT_USER_ID) -> list[dict]:
+    """
+    Logged exercises matching an exercise (canonical name), an inclusive ISO
+    date range and/or the last N sessions, oldest first. Only the sessions
+    inside the window are visited.
+    """
+    from agents.exercise_names import canonical_exercise
+    if logs is None:
+        logs = _user_logs(user_id)
+    key = canonical_exercise(exercise) if exercise else None
+    dates = sorted(
+        date for date in logs
+        if (not start_date or date >= start_date) and (not end_date or date <= end_date)
+    )
+    sessions = []
+    for date in reversed(dates):
+        exercises = [ex for ex in logs[date]["exercises"] if key is None or canonical_exercise(ex["exercise"]) == key]
+        if exercises:
+            sessions.append(exercises)
+            if last_sessions and len(sessions) == last_sessions:
+                break
+    return [ex for exercises in reversed(sessions) for ex in exercises]
+
+
+def get_all_logs(user_id: str = DEFAULT_USER_ID) -> dict:
+    """Returns a user's sessions ({date: {"date", "exercises"}}) for debugging/verification."""
+    return _user_logs(user_id)
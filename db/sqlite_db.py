@@ -0,0 +1,189 @@
+import datetime as dt
+import functools
+import os
+import sqlite3
+import threading
+import uuid
+from agents.exercise_names import canonical_exercise
+from db.backend import DEFAULT_USER_ID
+
+# Durable local workout store.
+# One row per logged exercise in a SQLite file (WAL mode, so readers never
+# block the writer), indexed by user + date and user + exercise + date so
+# "last bench session" or "all squats this month" are index range scans
+# instead of full-history walks.
+
+DB_PATH = os.getenv("GYMINI_DB_PATH", "db/gymini.sqlite3")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS exercises (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    exercise TEXT NOT NULL,
+    exercise_key TEXT NOT NULL,
+    sets INTEGER NOT NULL,
+    reps INTEGER NOT NULL,
+    weight_kg REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_exercises_user_date ON exercises (user_id, date);
+CREATE INDEX IF NOT EXISTS idx_exercises_user_exercise_date ON exercises (user_id, exercise_key, date);
+"""
+
+COLUMNS = "id, user_id, date, timestamp, exercise, sets, reps, weight_kg"
+
+_local = threading.local()
+
+
+def get_connection() -> sqlite3.Connection:
+    """One connection per thread, created on first use."""
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "path", None) != DB_PATH:
+        conn = sqlite3.connect(DB_PATH)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        _local.conn, _local.path = conn, DB_PATH
+    return conn
+
+
+def _row_to_exercise(row: sqlite3.Row) -> dict:
+    return {
+        "id": row["id"],
+        "exercise": row["exercise"],
+        "sets": row["sets"],
+        "reps": row["reps"],
+        "weight_kg": row["weight_kg"],
+        "timestamp": row["timestamp"],
+        "date_string": row["date"],
+        "user_id": row["user_id"],
+    }
+
+
+def _group_by_date(rows) -> dict:
+    sessions = {}
+    for row in rows:
+        date = row["date"]
+        if date not in sessions:
+            sessions[date] = {"date": date, "exercises": []}
+        sessions[date]["exercises"].append(_row_to_exercise(row))
+    return sessions
+
+
+def log_session_sqlite(exercise: str, sets: int, reps: int, weight_kg: float, user_id: str = DEFAULT_USER_ID) -> dict:
+    """
+    Logs one exercise to the local SQLite store.
+    Returns the same id + message shape as log_session_mock.
+    """
+    new_id = str(uuid.uuid4())[:8]
+    now = dt.datetime.now()
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            f"INSERT INTO exercises ({COLUMNS}, exercise_key) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (new_id, user_id, now.date().isoformat(), now.isoformat(), exercise, sets, reps, weight_kg,
+             canonical_exercise(exercise)),
+        )
+    return {
+        "id": new_id,
+        "message": f"✅ Successfully logged {sets} sets of {reps} reps of {exercise} at {weight_kg}kg."
+    }
+
+
+def log_sessions_sqlite(entries: list[dict], user_id: str = DEFAULT_USER_ID) -> list[dict]:
+    """Bulk insert of several exercises in one transaction (executemany)."""
+    now = dt.datetime.now()
+    rows = []
+    for entry in entries:
+        timestamp = entry.get("timestamp") or now.isoformat()
+        rows.append((str(uuid.uuid4())[:8], user_id, timestamp[:10], timestamp, entry["exercise"], entry["sets"],
+                     entry["reps"], entry["weight_kg"], canonical_exercise(entry["exercise"])))
+    conn = get_connection()
+    with conn:
+        conn.executemany(
+            f"INSERT INTO exercises ({COLUMNS}, exercise_key) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+        )
+    return [
+        {"id": row[0], "message": f"✅ Successfully logged {row[5]} sets of {row[6]} reps of {row[4]} at {row[7]}kg."}
+        for row in rows
+    ]
+
+
+# Imports repeat a handful of exercise names across millions of rows.
+_exercise_key = functools.lru_cache(maxsize=4096)(canonical_exercise)
+
+
+def import_rows_sqlite(rows: list[dict]) -> int:
+    """
+    Bulk import (importer.py): inserts normalized rows carrying their own id,
+    user_id and timestamp in one transaction. Rows whose id is already stored
+    are skipped, so re-importing a batch after a crash is harmless.
+    Returns the number of rows inserted.
+    """
+    conn = get_connection()
+    before = conn.total_changes
+    with conn:
+        conn.executemany(
+            f"INSERT OR IGNORE INTO exercises ({COLUMNS}, exercise_key) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (row["id"], row["user_id"], row["timestamp"][:10], row["timestamp"], row["exercise"], row["sets"],
+                 row["reps"], row["weight_kg"], _exercise_key(row["exercise"]))
+                for row in rows
+            ],
+        )
+    return conn.total_changes - before
+
+
+def iter_logs(user_id: str = DEFAULT_USER_ID, batch_size: int = 1000):
+    """Streams a user's exercises oldest first without loading the whole history."""
+    cursor = get_connection().execute(
+        f"SELECT {COLUMNS} FROM exercises WHERE user_id = ? ORDER BY date, timestamp", (user_id,)
+    )
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        for row in rows:
+            yield _row_to_exercise(row)
+
+
+def get_last_session(user_id: str = DEFAULT_USER_ID) -> dict | None:
+    """Most recent session for the user, or None (same shape as db.firebase_db.get_last_session)."""
+    conn = get_connection()
+    last = conn.execute(
+        "SELECT date FROM exercises WHERE user_id = ? ORDER BY date DESC LIMIT 1", (user_id,)
+    ).fetchone()
+    if last is None:
+        return None
+    rows = conn.execute(
+        f"SELECT {COLUMNS} FROM exercises WHERE user_id = ? AND date = ? ORDER BY timestamp",
+        (user_id, last["date"]),
+    )
+    return _group_by_date(rows).get(last["date"])
+
+
+def query_logs(exercise: str | None = None, start_date: str | None = None, end_date: str | None = None,
+               last_sessions: int | None = None, user_id: str = DEFAULT_USER_ID) -> list[dict]:
+    """
+    Logged exercises matching an exercise (canonical name), an inclusive ISO
+    date range and/or the last N sessions, oldest first. Every filter is an
+    index range scan on (user_id, exercise_key, date) or (user_id, date).
+    """
+    where, params = "user_id = ?", [user_id]
+    if exercise:
+        where += " AND exercise_key = ?"
+        params.append(canonical_exercise(exercise))
+    if start_date:
+        where += " AND date >= ?"
+        params.append(start_date)
+    if end_date:
+        where += " AND date <= ?"
+        params.append(end_date)
+    query = f"SELECT {COLUMNS} FROM exercises WHERE {where}"
+    if last_sessions:
+        query += f" AND date >= (SELECT MIN(date) FROM (SELECT DISTINCT date FROM exercises WHERE {where} ORDER BY date DESC LIMIT ?))"
+        params = params + params + [last_sessions]
+    rows = get_connection().execute(query + " ORDER BY date, timestamp", params)
+    return [_row_to_exercise(row) for row in rows]
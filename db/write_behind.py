@@ -0,0 +1,330 @@
+import json
+import os
+import random
+import threading
+import time
+from agents.exercise_names import canonical_exercise
+from logs import log_event
+
+# Firestore rejects batches with more than 500 writes.
+MAX_BATCH_WRITES = 500
+
+# Write-behind queue for Firestore session logging.
+# save_session() enqueues the exercise and returns at once; a background
+# thread coalesces everything pending per session document (the date, in the
+# user's collection) and commits it as one Firestore batch when `max_batch`
+# exercises are waiting or `max_delay` seconds have passed since the oldest one.
+# Transient failures are retried with backoff, and whatever is still pending
+# is flushed on shutdown.
+#
+# The user has already been told the exercise was logged, so nothing is
+# dropped: a batch that keeps failing goes back into the queue (retried after
+# `retry_delay`, doubling up to MAX_RETRY_DELAY), and one that cannot be
+# committed at all (a permanent error, or still failing at shutdown) is
+# appended to the `journal_path` file and replayed when the next queue starts.
+# The next queue first moves the journal aside (`<journal>.replay`) and only
+# deletes that file once the replayed exercises are committed or journaled
+# again, so a crash while replaying loses nothing. Replays are safe:
+# ArrayUnion ignores exercises the document already holds.
+
+MAX_RETRY_DELAY = 60.0
+
+
+def transient_errors() -> tuple:
+    try:
+        from google.api_core.exceptions import (
+            Aborted, DeadlineExceeded, InternalServerError, ResourceExhausted, ServiceUnavailable,
+        )
+    except ImportError:
+        return (ConnectionError, TimeoutError)
+    return (Aborted, DeadlineExceeded, InternalServerError, ResourceExhausted, ServiceUnavailable,
+            ConnectionError, TimeoutError)
+
+
+def exercise_keys(exercises: list[dict]) -> list[str]:
+    """Canonical names stored on each session document, so queries can filter by exercise."""
+    return sorted({canonical_exercise(exercise["exercise"]) for exercise in exercises})
+
+
+def replay_path(journal_path: str) -> str:
+    """Where a starting queue keeps the journal it is replaying."""
+    return f"{journal_path}.replay"
+
+
+def has_journal(journal_path: str | None) -> bool:
+    """True when uncommitted exercises are journaled (or still being replayed) at `journal_path`."""
+    return bool(journal_path) and (os.path.exists(journal_path) or os.path.exists(replay_path(journal_path)))
+
+
+def _default_array_union(values):
+    from google.cloud.firestore_v1 import ArrayUnion
+    return ArrayUnion(values)
+
+
+class WriteBehindQueue:
+    def __init__(self, client, collection: str = "sessions", max_batch: int = 20, max_delay: float = 1.0,
+                 max_attempts: int = 5, array_union=_default_array_union, journal_path: str | None = None,
+                 retry_delay: float = 5.0):
+        # `client` is a Firestore client (or db.fake_firestore.FakeFirestore), or a
+        # callable returning one, resolved on the first commit.
+        self._client = client
+        self.collection = collection
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.array_union = array_union
+        self.journal_path = journal_path
+        self.retry_delay = retry_delay
+        self.stats = {
+            "enqueued": 0, "committed": 0, "commits": 0, "retries": 0, "failures": 0,
+            "requeued": 0, "journaled": 0, "replayed": 0,
+        }
+        self._pending = {}
+        self._pending_count = 0
+        self._oldest = None
+        self._inflight = 0
+        self._flush_waiters = 0
+        self._closed = False
+        self._backoff = retry_delay
+        self._retry_at = None
+        self._replaying = False
+        self._cond = threading.Condition()
+        self._replay_journal()
+        self._thread = threading.Thread(target=self._run, name="firestore-write-behind", daemon=True)
+        self._thread.start()
+
+    @property
+    def client(self):
+        if callable(self._client) and not hasattr(self._client, "collection"):
+            self._client = self._client()
+        return self._client
+
+    def submit(self, doc_id: str, exercise_data: dict, collection: str | None = None):
+        """
+        Queues one exercise for the session document `doc_id` (the date) of
+        `collection` (default: the queue's) without blocking.
+        """
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("write-behind queue is closed")
+            self._pending.setdefault((collection or self.collection, doc_id), []).append(exercise_data)
+            self._pending_count += 1
+            self.stats["enqueued"] += 1
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            self._cond.notify_all()
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Blocks until everything queued so far is committed. Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            # While someone is flushing, pending work is committed without waiting for max_delay.
+            self._flush_waiters += 1
+            self._cond.notify_all()
+            try:
+                while self._pending_count or self._inflight:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            finally:
+                self._flush_waiters -= 1
+        return True
+
+    def close(self, timeout: float | None = 10.0):
+        """
+        Flushes pending writes and stops the worker (registered with atexit by
+        db.firebase_db). Whatever could not be committed is journaled.
+        """
+        self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        with self._cond:
+            pending, self._pending, self._pending_count = self._pending, {}, 0
+        if pending:
+            self._spill(pending)
+        if not self._thread.is_alive():
+            self._release_replay()
+
+    def _due(self) -> bool:
+        if not self._pending_count:
+            return False
+        if self._retry_at is not None and time.monotonic() < self._retry_at:
+            return False
+        return (
+            self._flush_waiters > 0
+            or self._pending_count >= self.max_batch
+            or time.monotonic() - self._oldest >= self.max_delay
+        )
+
+    def _next_wakeup(self) -> float | None:
+        if self._oldest is None:
+            return None
+        wait = self.max_delay - (time.monotonic() - self._oldest)
+        if self._retry_at is not None:
+            wait = max(wait, self._retry_at - time.monotonic())
+        return max(0.0, wait)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and not self._due():
+                    self._cond.wait(self._next_wakeup())
+                if self._closed and not self._pending_count:
+                    return
+                batch, count = self._pending, self._pending_count
+                self._pending, self._pending_count, self._oldest = {}, 0, None
+                self._inflight = count
+            try:
+                retry, failed = self._commit(batch)
+                self._requeue(retry)
+                if failed:
+                    self._spill(failed)
+                if not retry:
+                    # Everything queued before this batch, replayed exercises included, is committed or journaled.
+                    self._release_replay()
+            finally:
+                with self._cond:
+                    self._inflight = 0
+                    self._cond.notify_all()
+
+    def _requeue(self, pending: dict):
+        """Puts a batch that kept failing back in front of the queue, retried after a growing delay."""
+        with self._cond:
+            if not pending:
+                self._backoff = self.retry_delay
+                self._retry_at = None
+                return
+            if self._closed:
+                closed = True
+            else:
+                closed = False
+                count = sum(len(exercises) for exercises in pending.values())
+                for key, exercises in self._pending.items():
+                    pending.setdefault(key, []).extend(exercises)
+                self._pending = pending
+                self._pending_count += count
+                self._oldest = time.monotonic() - self.max_delay
+                self._retry_at = time.monotonic() + self._backoff
+                self.stats["requeued"] += count
+                log_event("Firestore Write-Behind", f"Requeued {count} exercises, retrying in {self._backoff:.0f}s")
+                self._backoff = min(self._backoff * 2, MAX_RETRY_DELAY)
+        if closed:
+            self._spill(pending)
+
+    def _spill(self, pending: dict):
+        """Appends exercises that could not be committed to the journal, for the next queue to replay."""
+        count = sum(len(exercises) for exercises in pending.values())
+        if not self.journal_path:
+            self.stats["failures"] += count
+            log_event("Firestore Write-Behind", f"Lost {count} exercises: no journal configured")
+            return
+        with self._cond:
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                for (collection, doc_id), exercises in pending.items():
+                    for exercise in exercises:
+                        f.write(json.dumps({"collection": collection, "doc_id": doc_id, "exercise": exercise}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.stats["journaled"] += count
+        log_event("Firestore Write-Behind",
+                  f"Journaled {count} uncommitted exercises to {self.journal_path}; they are replayed on next start")
+
+    def _replay_journal(self):
+        if not has_journal(self.journal_path):
+            return
+        replaying = replay_path(self.journal_path)
+        # Move the journal aside, so exercises spilled from now on start a new one.
+        # A replay file left behind is an earlier replay that never finished.
+        try:
+            if os.path.exists(replaying):
+                with open(self.journal_path, encoding="utf-8") as src, open(replaying, "a", encoding="utf-8") as dst:
+                    dst.write("\n" + src.read())
+                os.remove(self.journal_path)
+            else:
+                os.replace(self.journal_path, replaying)
+        except FileNotFoundError:
+            # No new journal, or another process moved it first.
+            pass
+        count = 0
+        try:
+            with open(replaying, encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A line cut short by a crash while journaling.
+                        continue
+                    key = (entry.get("collection", self.collection), entry["doc_id"])
+                    self._pending.setdefault(key, []).append(entry["exercise"])
+                    count += 1
+        except FileNotFoundError:
+            # Another process replayed and removed it in the meantime.
+            return
+        self._replaying = True
+        if not count:
+            self._release_replay()
+            return
+        self._pending_count += count
+        self._oldest = time.monotonic() - self.max_delay
+        self.stats["replayed"] += count
+        log_event("Firestore Write-Behind", f"Replaying {count} journaled exercises")
+
+    def _release_replay(self):
+        """Deletes the replayed journal once none of its exercises is held only in memory."""
+        with self._cond:
+            if not self._replaying:
+                return
+            self._replaying = False
+        try:
+            os.remove(replay_path(self.journal_path))
+        except FileNotFoundError:
+            pass
+
+    def _commit(self, pending: dict) -> tuple[dict, dict]:
+        """Commits `pending` in chunks. Returns (transiently failed, permanently failed) documents."""
+        retry, failed = {}, {}
+        items = list(pending.items())
+        for start in range(0, len(items), MAX_BATCH_WRITES):
+            chunk = dict(items[start:start + MAX_BATCH_WRITES])
+            outcome = self._commit_chunk(chunk, sum(len(exercises) for exercises in chunk.values()))
+            if outcome == "transient":
+                retry.update(chunk)
+            elif outcome == "permanent":
+                failed.update(chunk)
+        return retry, failed
+
+    def _commit_chunk(self, pending: dict, count: int) -> str:
+        """Commits one chunk, retrying transient errors. Returns "ok", "transient" or "permanent"."""
+        delay = 0.2
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                client = self.client
+                batch = client.batch()
+                for (collection, doc_id), exercises in pending.items():
+                    doc_ref = client.collection(collection).document(doc_id)
+                    batch.set(doc_ref, {
+                        "date": doc_id,
+                        "exercises": self.array_union(exercises),
+                        "exercise_keys": self.array_union(exercise_keys(exercises)),
+                    }, merge=True)
+                batch.commit()
+                self.stats["commits"] += 1
+                self.stats["committed"] += count
+                log_event("Firestore Write-Behind", f"Committed {count} exercises in {len(pending)} documents")
+                return "ok"
+            except transient_errors() as e:
+                log_event("Firestore Write-Behind", f"Commit attempt {attempt} failed: {e}")
+                if attempt == self.max_attempts or self._closed:
+                    return "transient"
+                self.stats["retries"] += 1
+                time.sleep(delay + random.uniform(0, delay))
+                delay *= 2
+            except Exception as e:
+                log_event("Firestore Write-Behind", f"Commit of {count} exercises failed permanently: {e}")
+                return "permanent"
+        return "transient"
@@ -0,0 +1,392 @@
+import argparse
+import csv
+import datetime as dt
+import functools
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from agents.exercise_names import canonical_exercise
+from agents.router_agent import KG_PER_LB
+from agents.tool_schemas import MAX_WEIGHT_KG
+from db.backend import DEFAULT_USER_ID
+
+# Bulk import / backfill of workout history exported from other trackers.
+# CSV or JSONL files are streamed record by record through validation and
+# normalization (column aliases, canonical exercise names, lb -> kg, dates),
+# consecutive identical sets are collapsed into one row, and rows are written
+# in large batches (one SQLite transaction, or Firestore batches of up to 500
+# session documents). Files are imported in parallel by a process pool, and
+# each file keeps a checkpoint of the records already committed, so an
+# interrupted import resumes where it stopped. Row ids are derived from the
+# source record, so a batch written twice is stored once.
+#
+#   python importer.py exports/*.csv --backend sqlite --user alice
+#   python importer.py history.jsonl --unit lb --workers 4
+
+BATCH_SIZE = int(os.getenv("GYMINI_IMPORT_BATCH_SIZE", "5000"))
+CHECKPOINT_DIR = os.getenv("GYMINI_IMPORT_CHECKPOINTS", ".gymini_import")
+MAX_REPS = 1000
+MAX_SETS = 100
+TODAY = dt.date.today()
+# Distinct rejection reasons kept per file for the report.
+MAX_REASONS = 20
+
+# Export column names (lowercase, non-alphanumerics as "_") for each field.
+FIELD_ALIASES = {
+    "date": ("date", "day", "workout_date", "start_time", "started_at", "timestamp", "datetime", "performed_at"),
+    "exercise": ("exercise", "exercise_name", "exercise_title", "movement", "name"),
+    "sets": ("sets", "set_count"),
+    "reps": ("reps", "repetitions", "rep_count"),
+    "weight": ("weight", "load", "weight_kg", "weight_kgs", "weight_lb", "weight_lbs"),
+    "unit": ("unit", "units", "weight_unit"),
+    "user": ("user_id", "user", "username", "athlete"),
+}
+# Equipment suffixes that name the default variant ("Bench Press (Barbell)").
+DEFAULT_EQUIPMENT_RE = re.compile(r"\s*\((barbell|bb)\)\s*$", re.I)
+
+
+class RecordError(ValueError):
+    """A record that cannot be imported (the message is the rejection reason)."""
+
+
+def _column(name: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "_", name.strip().lower()).strip("_")
+
+
+@functools.lru_cache(maxsize=256)
+def _field_map(columns: tuple) -> dict:
+    """{field: source column} for the export's columns (plus "lb" when the weight column says so)."""
+    normalized = {_column(column): column for column in columns}
+    fields = {}
+    for field, aliases in FIELD_ALIASES.items():
+        for alias in aliases:
+            if alias in normalized:
+                fields[field] = normalized[alias]
+                if field == "weight" and alias.startswith("weight_lb"):
+                    fields["lb"] = True
+                break
+    return fields
+
+
+def read_records(path: str):
+    """Yields the raw records (dicts) of a CSV or JSONL export, in file order."""
+    if path.endswith((".jsonl", ".ndjson")):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            yield from csv.DictReader(f)
+
+
+@functools.lru_cache(maxsize=4096)
+def exercise_name(raw: str) -> str:
+    """Display name of the canonical exercise ("back squats" -> "Squat")."""
+    name = canonical_exercise(DEFAULT_EQUIPMENT_RE.sub("", raw))
+    if not name:
+        raise RecordError("missing exercise")
+    return name.title()
+
+
+@functools.lru_cache(maxsize=65536)
+def _parse_date(value: str, date_format: str | None) -> dt.datetime:
+    value = value.strip()
+    try:
+        if date_format:
+            return dt.datetime.strptime(value, date_format)
+        return dt.datetime.fromisoformat(value.replace("Z", "+00:00")).replace(tzinfo=None)
+    except ValueError:
+        raise RecordError(f"unreadable date {value!r}")
+
+
+def _number(value, kind, field: str, default=None):
+    if value is None or value == "":
+        if default is None:
+            raise RecordError(f"missing {field}")
+        return default
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise RecordError(f"invalid {field} {value!r}")
+    if kind is int:
+        if not number.is_integer():
+            raise RecordError(f"invalid {field} {value!r}")
+        return int(number)
+    return number
+
+
+def normalize(record: dict, fields: dict, unit: str = "kg", user_id: str = DEFAULT_USER_ID,
+              date_format: str | None = None) -> dict:
+    """
+    Validates one export record and returns it in the stored shape
+    (user_id, timestamp, exercise, sets, reps, weight_kg). Raises RecordError.
+    """
+    def get(field):
+        value = record.get(fields[field]) if field in fields else None
+        return value.strip() if isinstance(value, str) else value
+
+    date = get("date")
+    if not date:
+        raise RecordError("missing date")
+    when = _parse_date(str(date), date_format)
+    if when.date() > TODAY:
+        raise RecordError("date in the future")
+    sets = _number(get("sets"), int, "sets", default=1)
+    reps = _number(get("reps"), int, "reps")
+    weight = _number(get("weight"), float, "weight", default=0.0)
+    weight_unit = (get("unit") or ("lb" if "lb" in fields else unit)).lower()
+    if weight_unit.startswith(("lb", "pound")):
+        weight *= KG_PER_LB
+    elif not weight_unit.startswith(("kg", "kilo")):
+        raise RecordError(f"unknown unit {weight_unit!r}")
+    weight_kg = round(weight, 1)
+    if not 1 <= sets <= MAX_SETS:
+        raise RecordError(f"sets out of range ({sets})")
+    if not 1 <= reps <= MAX_REPS:
+        raise RecordError(f"reps out of range ({reps})")
+    if not 0 <= weight_kg <= MAX_WEIGHT_KG:
+        raise RecordError(f"weight out of range ({weight_kg}kg)")
+    return {
+        "user_id": str(get("user") or user_id),
+        "timestamp": when.isoformat(),
+        "exercise": exercise_name(str(get("exercise") or "")),
+        "sets": sets,
+        "reps": reps,
+        "weight_kg": weight_kg,
+    }
+
+
+def row_id(source: str, record_no: int, row: dict) -> str:
+    """Stable id of the row starting at `record_no`, so re-imports are idempotent."""
+    raw = f"{row['user_id']}|{source}|{record_no}|{row['timestamp']}|{row['exercise']}|{row['reps']}|{row['weight_kg']}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+# Checkpoints: one JSON file per input, replaced atomically after each committed batch.
+def _checkpoint_path(checkpoint_dir: str, path: str) -> str:
+    digest = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(checkpoint_dir, f"{os.path.basename(path)}.{digest}.json")
+
+
+def load_checkpoint(checkpoint_dir: str, path: str) -> dict:
+    stat = os.stat(path)
+    fresh = {"path": os.path.abspath(path), "size": stat.st_size, "mtime": stat.st_mtime,
+             "records": 0, "rows": 0, "rejected": 0, "done": False}
+    try:
+        with open(_checkpoint_path(checkpoint_dir, path), encoding="utf-8") as f:
+            saved = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return fresh
+    # A file that changed since the checkpoint is imported again from the start.
+    if saved.get("size") != stat.st_size or saved.get("mtime") != stat.st_mtime:
+        return fresh
+    return saved
+
+
+def save_checkpoint(checkpoint_dir: str, path: str, state: dict):
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    target = _checkpoint_path(checkpoint_dir, path)
+    with open(f"{target}.tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(f"{target}.tmp", target)
+
+
+class BatchWriter:
+    """Buffers normalized rows and writes them to the backend `batch_size` at a time."""
+
+    def __init__(self, backend: str, batch_size: int = BATCH_SIZE, aggregates=None):
+        from db.backend import get_backend
+        if backend not in ("sqlite", "firebase"):
+            raise ValueError("bulk import needs a durable backend (sqlite or firebase), not the in-memory mock")
+        self.backend = backend
+        self.module = get_backend(backend)
+        self.batch_size = batch_size
+        self.aggregates = aggregates
+        self.rows = []
+        self.written = 0
+
+    def add(self, row: dict) -> bool:
+        """Buffers a row; returns True when the batch is full and should be flushed."""
+        self.rows.append(row)
+        return len(self.rows) >= self.batch_size
+
+    def flush(self):
+        if not self.rows:
+            return
+        if self.backend == "sqlite":
+            self.module.import_rows_sqlite(self.rows)
+        else:
+            users = {}
+            for row in self.rows:
+                # Firestore keeps each user's sessions in their own collection.
+                users.setdefault(row["user_id"], {}).setdefault(row["timestamp"][:10], []).append(
+                    {key: row[key] for key in ("id", "timestamp", "exercise", "sets", "reps", "weight_kg")}
+                )
+            for user_id, sessions in users.items():
+                self.module.import_sessions(sessions, user_id=user_id)
+        if self.aggregates:
+            for row in self.rows:
+                aggregates = self.aggregates.get(row["user_id"])
+                if aggregates is not None:
+                    aggregates.record({**row, "date_string": row["timestamp"][:10]})
+        self.written += len(self.rows)
+        self.rows = []
+
+
+def import_file(path: str, backend: str, user_id: str = DEFAULT_USER_ID, unit: str = "kg",
+                date_format: str | None = None, batch_size: int = BATCH_SIZE,
+                checkpoint_dir: str = CHECKPOINT_DIR, aggregates=None) -> dict:
+    """
+    Imports one export file, resuming from its checkpoint. Consecutive records
+    of the same set (user, time, exercise, reps, weight) become one row with
+    their set count. `aggregates` ({user_id: db.aggregates.TrainingAggregates})
+    is fed every committed row of those users. Returns the file's report.
+    """
+    start = time.perf_counter()
+    state = load_checkpoint(checkpoint_dir, path)
+    if state["done"]:
+        return {**state, "skipped": True, "elapsed_s": 0.0}
+    source = os.path.basename(path)
+    writer = BatchWriter(backend, batch_size, aggregates)
+    reasons = Counter(state.get("reasons", {}))
+    resume_at, rows_before = state["records"], state["rows"]
+
+    def commit(records: int):
+        # Every record before `records` is now written (or rejected).
+        writer.flush()
+        state.update(records=records, rows=rows_before + writer.written, reasons=dict(reasons))
+        save_checkpoint(checkpoint_dir, path, state)
+
+    pending, pending_key = None, None
+    record_no = -1
+    for record_no, record in enumerate(read_records(path)):
+        if record_no < resume_at:
+            continue
+        try:
+            row = normalize(record, _field_map(tuple(record)), unit, user_id, date_format)
+        except RecordError as e:
+            state["rejected"] += 1
+            if str(e) in reasons or len(reasons) < MAX_REASONS:
+                reasons[str(e)] += 1
+            continue
+        key = (row["user_id"], row["timestamp"], row["exercise"], row["reps"], row["weight_kg"])
+        if key == pending_key:
+            pending["sets"] += row["sets"]
+            continue
+        if pending is not None and writer.add(pending):
+            commit(record_no)
+        row["id"] = row_id(source, record_no, row)
+        # Distinct timestamps keep the rows of a day in export order.
+        row["timestamp"] = (dt.datetime.fromisoformat(row["timestamp"])
+                            + dt.timedelta(microseconds=record_no % 1_000_000)).isoformat()
+        pending, pending_key = row, key
+    if pending is not None:
+        writer.add(pending)
+    state["done"] = True
+    commit(record_no + 1)
+    return {**state, "skipped": False, "elapsed_s": round(time.perf_counter() - start, 3)}
+
+
+def _import_worker(path: str, options: dict) -> dict:
+    try:
+        return import_file(path, **options)
+    except Exception as e:
+        return {"path": os.path.abspath(path), "error": f"{type(e).__name__}: {e}"}
+
+
+def _live_aggregates() -> dict:
+    """
+    {user_id: rollups} loaded in this process (the others are rebuilt from the
+    backend on first use).
+    """
+    import db.aggregates
+    from db.backend import current_sandbox
+    store = current_sandbox()
+    if store is not None:
+        # A sandbox keeps one set of rollups for every user.
+        return defaultdict(lambda: store.aggregates) if store.aggregates.loaded else {}
+    return db.aggregates.loaded_users()
+
+
+def _invalidate_aggregates():
+    """Marks every loaded rollup stale, after rows were written by other processes."""
+    import db.aggregates
+    from db.backend import current_sandbox
+    store = current_sandbox()
+    for aggregates in [store.aggregates] if store is not None else db.aggregates.loaded_users().values():
+        aggregates.invalidate()
+
+
+def import_files(paths: list[str], backend: str, workers: int = 1, **options) -> list[dict]:
+    """
+    Imports several files, in a process pool when workers > 1 (files are the
+    unit of parallelism). Rollups already loaded in this process are fed as
+    rows are written in-process, or marked stale for a rebuild after a pooled run.
+    """
+    options["backend"] = backend
+    if workers <= 1 or len(paths) <= 1:
+        aggregates = _live_aggregates()
+        return [import_file(path, aggregates=aggregates, **options) for path in paths]
+    reports = []
+    with ProcessPoolExecutor(max_workers=min(workers, len(paths))) as pool:
+        futures = [pool.submit(_import_worker, path, options) for path in paths]
+        for future in as_completed(futures):
+            reports.append(future.result())
+    _invalidate_aggregates()
+    return sorted(reports, key=lambda report: report["path"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import workout history from CSV/JSONL exports.")
+    parser.add_argument("paths", nargs="+", help="CSV or JSONL export files")
+    parser.add_argument("--backend", choices=("sqlite", "firebase"), default=os.getenv("GYMINI_DB", "sqlite").lower())
+    parser.add_argument("--user", default=DEFAULT_USER_ID, help="user id for records without one")
+    parser.add_argument("--unit", choices=("kg", "lb"), default="kg", help="weight unit for records without one")
+    parser.add_argument("--date-format", help="strptime format of the date column (default: ISO 8601)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="parallel import processes")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="rows per write")
+    parser.add_argument("--checkpoint-dir", default=CHECKPOINT_DIR)
+    parser.add_argument("--restart", action="store_true", help="ignore checkpoints and import everything again")
+    args = parser.parse_args()
+    if args.backend not in ("sqlite", "firebase"):
+        parser.error("bulk import needs --backend sqlite or firebase")
+
+    if args.restart:
+        for path in args.paths:
+            try:
+                os.remove(_checkpoint_path(args.checkpoint_dir, path))
+            except FileNotFoundError:
+                pass
+    start = time.perf_counter()
+    reports = import_files(
+        args.paths, args.backend, args.workers, user_id=args.user, unit=args.unit, date_format=args.date_format,
+        batch_size=args.batch_size, checkpoint_dir=args.checkpoint_dir,
+    )
+    elapsed = time.perf_counter() - start
+    records = rows = processed = 0
+    failed = False
+    for report in reports:
+        if "error" in report:
+            failed = True
+            print(f"{report['path']}: FAILED ({report['error']}); rerun to resume from its checkpoint")
+            continue
+        records += report["records"]
+        rows += report["rows"]
+        processed += 0 if report["skipped"] else report["records"]
+        status = "already imported" if report["skipped"] else f"{report['elapsed_s']}s"
+        print(f"{report['path']}: {report['records']} records -> {report['rows']} rows, "
+              f"{report['rejected']} rejected ({status})")
+        for reason, count in sorted(report.get("reasons", {}).items(), key=lambda item: -item[1]):
+            print(f"    {count} × {reason}")
+    print(f"Imported {records} records as {rows} rows in {elapsed:.1f}s ({processed / elapsed:.0f} records/s)")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,270 @@
-import uuid, logging
+import uuid, logging, contextvars, functools, json, os, threading, time
+from contextlib import contextmanager
 logging.basicConfig(level=logging.INFO)
 
+# Session the current turn belongs to (set per connection in server mode).
+SESSION_ID = contextvars.ContextVar("gymini_session", default=None)
+
 def log_event(event_type, details, trace_id=None):
+    current = _CURRENT_SPAN.get()
     if trace_id is None:
-        trace_id = uuid.uuid4()
-    logging.info(f"[{trace_id}] {event_type}: {details}")
+        trace_id = current.trace_id if current else uuid.uuid4()
+    if current is not None:
+        current.events.append({"at_ms": current.elapsed_ms(), "type": event_type, "details": str(details)[:500]})
+    session_id = SESSION_ID.get()
+    prefix = f"[{session_id}] " if session_id else ""
+    logging.info(f"{prefix}[{trace_id}] {event_type}: {details}")
     return trace_id
+
+
+# Tracing
+# Nested spans (turn -> router -> controller/tool -> external call) with
+# durations and attributes (token counts, cache outcomes, errors). Finished
+# spans feed the in-process metrics below and the configured exporters:
+# GYMINI_TRACE_PATH=<file.jsonl> appends one JSON object per span, and
+# GYMINI_OTEL=1 mirrors the spans to OpenTelemetry (the opentelemetry-api
+# package and whatever tracer provider the process configures).
+
+TRACE_PATH = os.getenv("GYMINI_TRACE_PATH")
+USE_OTEL = os.getenv("GYMINI_OTEL", "0") == "1"
+
+_CURRENT_SPAN = contextvars.ContextVar("gymini_span", default=None)
+
+
+class Span:
+    def __init__(self, name: str, parent=None, **attributes):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.session_id = SESSION_ID.get()
+        # The Metrics this span is recorded in (see use_metrics).
+        self.metrics = _METRICS.get()
+        self.attributes = attributes
+        self.events = []
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.duration_ms = None
+        self.otel = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self._start) * 1000, 3)
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "session_id": str(self.session_id) if self.session_id else None,
+            "start_time": self.start_time,
+            "duration_ms": self.duration_ms,
+            "attributes": self.attributes,
+            "events": self.events,
+        }
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Times the block as a child of the current span."""
+    current = Span(name, _CURRENT_SPAN.get(), **attributes)
+    for exporter in EXPORTERS:
+        exporter.start(current)
+    token = _CURRENT_SPAN.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.set(error=f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        _CURRENT_SPAN.reset(token)
+        current.duration_ms = current.elapsed_ms()
+        metrics = current.metrics
+        metrics.observe(name, current.duration_ms)
+        if current.attributes.get("tool"):
+            # Controller spans also get one histogram per dispatched tool.
+            metrics.observe(f"{name}.{current.attributes['tool']}", current.duration_ms)
+        if "error" in current.attributes:
+            metrics.count(f"{name}.errors")
+        for exporter in EXPORTERS:
+            exporter.end(current)
+
+
+@contextmanager
+def root_span(name: str, **attributes):
+    """Starts a new trace, e.g. for background work that outlives the turn that scheduled it."""
+    token = _CURRENT_SPAN.set(None)
+    try:
+        with span(name, **attributes) as current:
+            yield current
+    finally:
+        _CURRENT_SPAN.reset(token)
+
+
+def traced(name: str):
+    """Decorator form of span()."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_span():
+    return _CURRENT_SPAN.get()
+
+
+def annotate(**attributes):
+    """Adds attributes (e.g. tokens, tool name) to the current span, if any."""
+    current = _CURRENT_SPAN.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+def record_cache(cache: str, outcome: str):
+    """Counts a cache lookup ("hit"/"miss") and tags the current span with it."""
+    _METRICS.get().count(f"cache.{cache}.{outcome}")
+    annotate(**{f"cache.{cache}": outcome})
+
+
+# Metrics: latency histograms per span name plus plain counters.
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value_ms: float):
+        index = next((i for i, bound in enumerate(BUCKETS_MS) if value_ms <= bound), len(BUCKETS_MS))
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += value_ms
+        self.max = max(self.max, value_ms)
+
+    def percentile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th percentile."""
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for bound, hits in zip(BUCKETS_MS, self.buckets):
+            seen += hits
+            if seen >= rank:
+                return min(float(bound), self.max)
+        return self.max
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count, 3) if self.count else 0.0,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+            "max_ms": round(self.max, 3),
+            "buckets": {f"le_{bound}": hits for bound, hits in zip(BUCKETS_MS, self.buckets)}
+                       | {"le_inf": self.buckets[-1]},
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value_ms: float):
+        with self._lock:
+            self.histograms.setdefault(name, Histogram()).observe(value_ms)
+
+    def count(self, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "latency": {name: hist.snapshot() for name, hist in sorted(self.histograms.items())},
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+
+METRICS = Metrics()
+# Where spans of the current context are recorded (evaluations keep their own).
+_METRICS = contextvars.ContextVar("gymini_metrics", default=METRICS)
+
+
+def use_metrics(metrics: Metrics):
+    """Records the current context's spans and cache lookups in `metrics` instead of METRICS."""
+    return _METRICS.set(metrics)
+
+
+def dump_metrics(path: str | None = None) -> dict:
+    """Returns the current histograms and counters, also writing them to `path` as JSON if given."""
+    snapshot = METRICS.snapshot()
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, indent=2)
+    return snapshot
+
+
+# Exporters
+class JsonlExporter:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def start(self, current: Span):
+        pass
+
+    def end(self, current: Span):
+        line = json.dumps(current.to_dict(), default=str)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+class OpenTelemetryExporter:
+    def __init__(self):
+        # Imported lazily: only when GYMINI_OTEL=1.
+        from opentelemetry import trace
+        self._trace = trace
+        self._tracer = trace.get_tracer("gymini")
+
+    def start(self, current: Span):
+        parent = _CURRENT_SPAN.get()
+        context = self._trace.set_span_in_context(parent.otel) if parent is not None and parent.otel else None
+        current.otel = self._tracer.start_span(current.name, context=context, start_time=int(current.start_time * 1e9))
+
+    def end(self, current: Span):
+        if current.otel is None:
+            return
+        for key, value in current.attributes.items():
+            if isinstance(value, (str, bool, int, float)):
+                current.otel.set_attribute(key, value)
+        for event in current.events:
+            current.otel.add_event(event["type"], {"details": event["details"]})
+        current.otel.end(end_time=int((current.start_time + current.duration_ms / 1000) * 1e9))
+
+
+EXPORTERS = []
+if TRACE_PATH:
+    EXPORTERS.append(JsonlExporter(TRACE_PATH))
+if USE_OTEL:
+    try:
+        EXPORTERS.append(OpenTelemetryExporter())
+    except ImportError:
+        logging.warning("GYMINI_OTEL=1 but opentelemetry-api is not installed; OpenTelemetry export disabled")
@@ -1,7 +1,6 @@
 import os
-import json
+from contextlib import ExitStack
 from dotenv import load_dotenv
-from db.mock_db import get_all_logs
 import agents.memory_agent
 import agents.summary_agent
 import agents.coach_agent
@@ -9,31 +8,88 @@ import agents.logging_agent
 import agents.evaluation_agent
 import agents.stateful_agent
 import agents.gymini_agent
-from logs import log_event
-import google.generativeai as genai
+import agents.router_agent
+import agents.tool_schemas
+import agents.model_registry
+import agents.response_cache
+import agents.response_parser
+import agents.intent_classifier
+import agents.prefetcher
+import resilience
+from agents.context_manager import ConversationContext
+from logs import annotate, dump_metrics, log_event, span, traced
 
 load_dotenv()
-# Loading the GEMINI key
+# Loading the GEMINI key (Gemini itself is configured lazily by agents.model_registry)
 GEMINI_API_KEY = os.getenv('GOOGLE_API_KEY')
 
 
-# Initialize Gemini
-genai.configure(api_key=GEMINI_API_KEY)
+CHAT_HISTORY = ConversationContext(on_switch=agents.prefetcher.prefetch_tip)
 
+# Routing mode for turns the local router does not handle:
+# "chain"   -> ask_main_agent_with_history, then ask_gymini in the controller (two calls)
+# "unified" -> one function-calling request whose command is dispatched directly
+ROUTING_MODE = os.getenv("GYMINI_ROUTING_MODE", "chain").lower()
 
-CHAT_HISTORY = []
+
+# Streaming free-text replies: the chat loop prints them chunk by chunk.
+STREAM_REPLIES = os.getenv("GYMINI_STREAM", "1") == "1"
+
+
+# Templated replies used instead of a Gemini rewrite while Gemini is unavailable.
+OFFLINE_HELP = (
+    "I'm running in offline mode right now, but I can still:\n"
+    "- log workouts (e.g. 'bench 3x8 at 80kg')\n"
+    "- summarize your last session\n"
+    "- show your progress (e.g. 'how has my squat moved in the last 8 weeks?')\n"
+    "- find coaching tips for an exercise\n"
+    "- remember your name"
+)
+OFFLINE_FALLBACK = "I can't chat freely right now, but I can still log workouts, summarize sessions and show your progress."
+OFFLINE_LOG_HINT = "To log that while I'm offline, tell me the sets, reps and weight, e.g. 'deadlift 3x5 at 140kg'."
+
+
+# Free-text replies go through here: a string when buffered, a chunk iterator when streamed.
+# Tool-JSON routing always uses the buffered ask_gymini. `cache_branch` names the
+# controller branch for the response cache (only opted-in branches are cached);
+# `offline` is the templated reply to give when Gemini is unavailable.
+def ask_free_text(prompt: str, stream: bool = False, cache_branch: str | None = None, offline: str | None = None):
+    if stream:
+        return agents.gymini_agent.stream_gymini(prompt, cache_branch, offline)
+    return agents.gymini_agent.ask_gymini(prompt, cache_branch, offline)
 
 
 # Controller
-def controller(user_input: str) -> str:
-    text = agents.gymini_agent.ask_gymini(user_input).strip()
+# When the local router already produced a tool command, it is passed in as
+# `command` and dispatched directly, without asking Gymini to re-emit it.
+# With `stream=True`, free-text replies come back as chunk iterators.
+@traced("controller")
+def controller(user_input: str, command: dict | None = None, stream: bool = False):
+    if command is not None:
+        text = user_input
+        # Every command is validated before it can write anything, whichever router produced it.
+        try:
+            command = agents.tool_schemas.validate_command(command)
+        except ValueError as e:
+            log_event("Controller", f"Invalid routed command {command}: {e}")
+            return fallback_response(text, stream)
+    else:
+        # Re-emitting the routed tool JSON is part of routing: interactive priority.
+        with resilience.priority("interactive"):
+            text = agents.gymini_agent.generate_reply(user_input)
+        if text is None:
+            # Gemini failed (outage, bad credentials, blocked reply): asking it for a fallback would fail too.
+            return OFFLINE_FALLBACK
+        text = agents.gymini_agent.personalize_response(text).strip()
 
-    # Remove the extra backticks to get a Raw JSON format.
-    if text.startswith("```"):
-        text = text.strip("`")
-        text = text.replace("json", "")
+        # Extract, repair and validate the tool JSON locally (code fences, stray
+        # text, trailing commas...); Gymini is only asked again when that fails.
+        command = agents.response_parser.parse_with_retry(text, lambda error: _ask_again(user_input, error))
+        if command is None:
+            return fallback_response(text, stream)
     try:
-        data = json.loads(text)
+        data = command
+        annotate(tool=data.get("tool"))
 
         # Controller: Logging Agent
         # Handles exercise logging requests. Extracts sets, reps, and weight,
@@ -49,29 +105,44 @@ def controller(user_input: str) -> str:
             results = agents.logging_agent.log_session(exercise, sets, reps, weight)
             print(f"Results after calling the agent : {results}")
             log_event("Logging Agent", f"Exercise logged successfully (ID: {results['id']})", trace_id)
+            agents.prefetcher.after_log(exercise)
+            return results["message"]
+
+        # Controller: Logging Agent (whole workout)
+        # Several exercises, or sets with different reps/weights, logged in one turn
+        # with a single bulk write. Model-produced JSON is validated here first.
+        elif data.get("tool") == "log_workout":
+            exercises = agents.tool_schemas.validate_workout(data.get("exercises"))
+            trace_id = log_event("Log Workout", f"Routing {len(exercises)} exercises to logging_agent")
+            results = agents.logging_agent.log_workout(exercises)
+            log_event("Logging Agent", f"Workout logged successfully (IDs: {', '.join(results['ids'])})", trace_id)
+            agents.prefetcher.after_log(exercises[-1]["exercise"])
             return results["message"]
         
         # Controller: Summary Agent
-        # Retrieves all workout logs from the database, generates a raw summary,
+        # Reads the raw summary from the precomputed training rollups,
         # then rewrites it into a motivational tone for the user.
         elif data.get("tool") == "get_summary":
-            trace_id = log_event("Get Summary", "Fetching all workout logs")
-            # This only will get data while working with mock_db
-            data = get_all_logs()
-            raw_summary = agents.summary_agent.get_summary(data)
+            trace_id = log_event("Get Summary", "Reading training rollups")
+            raw_summary = agents.summary_agent.get_summary()
             log_event("Summary Agent", f"Generated raw summary: {raw_summary}", trace_id)
-            # Check if a name is saved in memory
-            user_name = agents.memory_agent.get_name()
-            if user_name:
-                personalized_prompt = (
-                    f"Rewrite this workout summary in a motivational tone, "
-                    f"and address the user by name ({user_name}): {raw_summary}"
-                )
-            else:
-                personalized_prompt = (
-                    f"Rewrite this workout summary in a motivational tone: {raw_summary}"
-                )
-            return agents.gymini_agent.ask_gymini(personalized_prompt)
+            # Addresses the user by name if one is saved in memory
+            personalized_prompt = agents.summary_agent.rewrite_prompt(raw_summary)
+            # A prefetched rewrite is already in the response cache (or about to be).
+            if agents.prefetcher.claim_summary():
+                log_event("Summary Agent", "Serving the prefetched rewrite", trace_id)
+            return ask_free_text(personalized_prompt, stream, cache_branch="summary", offline=raw_summary["message"])
+
+        # Controller: Summary Agent (progress)
+        # Reads only the requested window from the store and reports the
+        # exercise's e1RM trend, top set, weekly tonnage and PRs.
+        elif data.get("tool") == "get_progress":
+            command = agents.tool_schemas.validate_command(data)
+            trace_id = log_event("Get Progress", f"Querying {command['exercise']} over {command['weeks']} weeks")
+            progress = agents.summary_agent.get_progress(command["exercise"], command["weeks"])
+            log_event("Summary Agent", f"Generated progress report: {progress}", trace_id)
+            agents.prefetcher.prefetch_tip(command["exercise"])
+            return progress["message"]
 
         # Controller: Memory Agent (Set Name)
         # Saves the user’s name into memory for personalization.
@@ -91,7 +162,9 @@ def controller(user_input: str) -> str:
             trace_id = log_event("Get Name", "Retrieving stored name")
             raw = agents.memory_agent.get_name()
             log_event("Memory Agent", f"Retrieved name: {raw}", trace_id)
-            return personalize_response(raw)
+            if not raw:
+                return "I don't know your name yet. Tell me with \"my name is ...\"."
+            return agents.gymini_agent.personalize_response(raw)
         
         # Controller: Coach Agent
         # Provides exercise tips. Delegates to ask_coach() for raw results,
@@ -101,22 +174,45 @@ def controller(user_input: str) -> str:
             exercise = data.get("exercise")
             trace_id = log_event("Coach Agent", f"Received exercise input: {exercise}")
 
+            if agents.prefetcher.claim_tip(exercise):
+                log_event("Coach Agent", "Tip was prefetched", trace_id)
+            cached_tip = agents.coach_agent.get_cached_tip(exercise)
+            if cached_tip:
+                log_event("Coach Agent", "Served tips from cache", trace_id)
+                return agents.gymini_agent.personalize_response(cached_tip)
+
             response_text = agents.coach_agent.ask_coach(exercise)
             log_event("Coach Agent", f"Raw response from ask_coach: {response_text}", trace_id)
-            try:
-                response_json = json.loads(response_text)
-            except json.JSONDecodeError:
-                log_event("Coach Agent", "Error: response was not valid JSON", trace_id)
-                return None
+            response_json = agents.response_parser.extract_json(response_text)
+            if response_json is None or response_json.get("tool") != "search_web" or not response_json.get("query"):
+                # The coach only turns the exercise into a search query: search for it directly.
+                log_event("Coach Agent", "Response had no usable search query, searching for the exercise", trace_id)
+                response_json = {"tool": "search_web", "query": exercise}
             # Now check the tool field
             if response_json.get("tool") == "search_web":
 
                 query = response_json.get("query")
                 log_event("Coach Agent", f"Delegating to search_web with query: {query}", trace_id)
-                results = agents.coach_agent.coach_tools(query)
+                try:
+                    results = agents.coach_agent.coach_tools(query)
+                except resilience.DependencyUnavailable as e:
+                    log_event("Coach Agent", f"Search unavailable: {e}", trace_id)
+                    return f"I can't reach my coaching sources for {exercise} right now. Please try again in a few minutes."
                 log_event("Coach Agent", f"Final results from coach_tools: {results}", trace_id)
                 log_event("Coach Agent", "Delivered motivational confirmation to user", trace_id)
-                return agents.gymini_agent.ask_gymini(results)
+                # The tip cache is shared by all users: it keeps the raw rewrite, personalized
+                # on every read. Offline, the formatted search results are shown as they are
+                # (and not cached).
+                if stream:
+                    return agents.gymini_agent.stream_gymini(
+                        results, "coach_rewrite", offline=results,
+                        on_done=lambda tip: agents.coach_agent.store_tip(exercise, tip),
+                    )
+                tip = agents.gymini_agent.generate_reply(results, "coach_rewrite")
+                if tip is None:
+                    return results
+                agents.coach_agent.store_tip(exercise, tip)
+                return agents.gymini_agent.personalize_response(tip)
             
         # Controller: Evaluation Agent
         # Runs evaluation across all agents using EvaluationAgent.
@@ -125,16 +221,20 @@ def controller(user_input: str) -> str:
             evaluator = agents.evaluation_agent.EvaluationAgent()
             results = evaluator.run_all()
             log_event("Evaluation Agent", f"Completed evaluation: {results}")
-            return agents.gymini_agent.ask_gymini(f"Report these evaluation results to the user: {results}")
+            return ask_free_text(f"Report these evaluation results to the user: {results}", stream,
+                                 offline=f"Evaluation results: {results}")
         
         
         # Controller: Help user
         # Responds to user who needs help about Gymini's functions.
         elif data.get("tool") == "help":
-            return agents.gymini_agent.ask_gymini(
+            return ask_free_text(
         "Explain your features in a friendly way. \
-        Mention logging workouts, summaries, coaching tips, memory, and evaluation. \
-        leave evaluation out. Keep it warm, simple, and focused on the gym ritual."
+        Mention logging workouts, summaries, progress tracking, coaching tips, memory, and evaluation. \
+        leave evaluation out. Keep it warm, simple, and focused on the gym ritual.",
+        stream,
+        cache_branch="help",
+        offline=OFFLINE_HELP,
     )
         # Controller: Creator Signature
         # Responds to identity queries ("who made you") with a fixed signature line.
@@ -142,14 +242,137 @@ def controller(user_input: str) -> str:
             return "I was made with ❤️ by Aymen Kalaï Ezar."
 
     except Exception:
-        # Friendly fallback: explain Gymini's abilities
-        print("This is the fallback agent...")
+        return fallback_response(text, stream)
+
+
+# One more routing request for a tool reply that could not be parsed or validated.
+def _ask_again(user_input: str, error: str) -> str:
+    log_event("Controller", f"Unusable tool JSON ({error}), asking Gymini again")
+    with resilience.priority("interactive"):
         return agents.gymini_agent.ask_gymini(
-            f"Analyze user input ({text}) and suggest the closest feature Gymini can perform. "
-            f"Available features: log workouts, workout summaries, coaching tips, memory (name). "
-            f"IMPORTANT: Do NOT mention tools or functions."
-            f"List each feature as a bullet point starting with '-' and keep the tone friendly."
+            f"{user_input}\n\nYour previous reply could not be used ({error}). Respond ONLY with the JSON object."
+        ).strip()
+
+
+# Friendly fallback: explain Gymini's abilities
+def fallback_response(text: str, stream: bool = False):
+    print("This is the fallback agent...")
+    return ask_free_text(
+        f"Analyze user input ({text}) and suggest the closest feature Gymini can perform. "
+        f"Available features: log workouts, workout summaries, progress over recent weeks, coaching tips, memory (name). "
+        f"IMPORTANT: Do NOT mention tools or functions."
+        f"List each feature as a bullet point starting with '-' and keep the tone friendly.",
+        stream,
+        cache_branch="fallback",
+        offline=OFFLINE_FALLBACK,
     )
+
+
+# One chat turn: route the input, run the tool, update the session history.
+# Shared by the CLI loop and the server mode (each server session passes its own history).
+# With `stream=True` the reply may be a chunk iterator; history is updated once it is consumed.
+# Every external call made while routing and running the tool shares one turn budget
+# (GYMINI_TURN_BUDGET seconds); past it, calls fail fast to a degraded reply.
+# Background prefetch jobs (agents.prefetcher) wait while a turn is running.
+# A streamed reply does its Gemini work while it is consumed, so the turn's span,
+# budget and foreground scope stay open until the last chunk.
+def handle_turn(user_input: str, history: ConversationContext, stream: bool = False):
+    with ExitStack() as scope:
+        scope.enter_context(span("turn", stream=stream))
+        scope.enter_context(resilience.turn_budget())
+        scope.enter_context(agents.prefetcher.PREFETCHER.foreground())
+        final_response = _run_turn(user_input, history, stream)
+
+        # 3. Update history
+        if final_response is None or isinstance(final_response, str):
+            _record_turn(history, user_input, final_response)
+            return final_response
+        relay = _relay_stream(history, user_input, final_response, scope.pop_all())
+    # Started up to its first chunk, so closing it early still closes the turn scope.
+    next(relay)
+    return relay
+
+
+def _run_turn(user_input: str, history: ConversationContext, stream: bool):
+    # 1. Try the local fast-path router, then the main agent with history
+    command = agents.router_agent.route_locally(user_input, history)
+    if command is not None:
+        stats = agents.router_agent.get_router_stats()
+        log_event("Router", f"Fast path hit: {command['tool']} (hit rate {stats['hit_rate']:.0%})")
+        annotate(route="local")
+        return controller(user_input, command, stream)
+    # Gemini is down or over quota: route with the local classifier instead of waiting on it.
+    if not agents.model_registry.available():
+        return _run_offline(user_input, history, stream)
+    annotate(route=ROUTING_MODE)
+    if ROUTING_MODE == "unified":
+        try:
+            command = agents.stateful_agent.route_with_history(user_input, history)
+        except ValueError as e:
+            log_event("Router", f"Unified routing returned an invalid command: {e}")
+        except resilience.DependencyUnavailable as e:
+            log_event("Router", f"Unified routing unavailable: {e}")
+            return _run_offline(user_input, history, stream)
+        log_event("Router", f"Unified routing: {command}")
+        if command is not None:
+            return controller(user_input, command, stream)
+        return fallback_response(user_input, stream)
+    try:
+        raw_json_response = agents.stateful_agent.ask_main_agent_with_history(user_input, history)
+    except resilience.DependencyUnavailable as e:
+        log_event("Router", f"Chain routing unavailable: {e}")
+        return _run_offline(user_input, history, stream)
+    except ValueError as e:
+        # The routing reply was blocked and has no text.
+        log_event("Router", f"Chain routing returned no text: {e}")
+        return fallback_response(user_input, stream)
+
+    # 2. Process JSON through controller
+    return controller(raw_json_response, stream=stream)
+
+
+# Quota-free routing: local intent classifier + slot extractor, templated replies.
+def _run_offline(user_input: str, history: ConversationContext, stream: bool):
+    annotate(route="offline")
+    command = agents.intent_classifier.classify(user_input, history)
+    log_event("Router", f"Offline routing: {command}")
+    if command is None:
+        # Never log invented numbers: ask for the ones that are missing.
+        if agents.intent_classifier.is_incomplete_log(user_input):
+            return OFFLINE_LOG_HINT
+        return OFFLINE_FALLBACK
+    return controller(user_input, command, stream)
+
+
+def _record_turn(history: ConversationContext, user_input: str, final_response):
+    history.append({"role": "user", "parts": [{"text": user_input}]})
+    history.append({"role": "model", "parts": [{"text": final_response}]})
+
+
+def _relay_stream(history: ConversationContext, user_input: str, chunks, scope: ExitStack):
+    with scope:
+        yield
+        parts = []
+        for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+    _record_turn(history, user_input, "".join(parts))
+
+
+def log_session_stats():
+    log_event("Router", f"Local fast-path stats: {agents.router_agent.get_router_stats()}")
+    log_event("Router", f"Offline routing stats: {agents.intent_classifier.get_offline_stats()}")
+    log_event("Coach Agent", f"Tip cache stats: {agents.coach_agent.get_cache_stats()}")
+    log_event("Controller", f"Tool JSON parsing stats: {agents.response_parser.get_stats()}")
+    log_event("Response Cache", f"LLM response cache stats: {agents.response_cache.get_stats()}")
+    log_event("Prefetch", f"Prefetch stats: {agents.prefetcher.get_stats()}")
+    log_event("Resilience", f"Call policy stats: {resilience.policy_stats()}")
+    log_event("Resilience", f"Rate limit and coalescing stats: {resilience.limiter_stats()}")
+    latency = dump_metrics(os.getenv("GYMINI_METRICS_PATH"))["latency"]
+    summary = {name: (hist["count"], hist["p50_ms"], hist["p95_ms"]) for name, hist in latency.items()}
+    log_event("Metrics", f"Latency (count, p50 ms, p95 ms): {summary}")
+
+
 # The Chatbot logic
 def smart_chat_loop():
     global CHAT_HISTORY
@@ -159,24 +382,24 @@ def smart_chat_loop():
         if not user_input:
             continue
         if user_input.lower() == "quit":
+            log_session_stats()
             print("Gymini: Goodbye! Keep training strong 💪")
             break
 
-        # 1. Ask the main agent with history
-        raw_json_response = agents.stateful_agent.ask_main_agent_with_history(user_input, CHAT_HISTORY)
-        
-        # 2. Process JSON through controller
-        final_response = controller(raw_json_response)
-
-        # 3. Update history
-        CHAT_HISTORY.append({"role": "user", "parts": [{"text": user_input}]})
-        CHAT_HISTORY.append({"role": "model", "parts": [{"text": final_response}]})
+        final_response = handle_turn(user_input, CHAT_HISTORY, stream=STREAM_REPLIES)
 
-        # 4. Print response
-        print(f"Gymini: {final_response}")
+        # 4. Print response (chunk by chunk when streamed)
+        if final_response is None or isinstance(final_response, str):
+            print(f"Gymini: {final_response}")
+        else:
+            print("Gymini: ", end="", flush=True)
+            for chunk in final_response:
+                print(chunk, end="", flush=True)
+            print()
 
 def main():
-
+    # Build the shared Gemini models and open the connection while the user types
+    agents.model_registry.warm_up_in_background()
     smart_chat_loop()
 
 if __name__ == "__main__":
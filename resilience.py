@@ -0,0 +1,411 @@
+import contextvars
+import hashlib
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from logs import METRICS, annotate, log_event, span
+
+# Shared call policies for every external dependency (Gemini, Custom Search,
+# Firestore): per-attempt timeouts bounded by the turn's latency budget,
+# jittered exponential backoff, a circuit breaker that fails fast while a
+# dependency is down, and optional hedged duplicate requests once a call
+# runs past a latency percentile. Calls to rate-limited APIs also take a token
+# from a shared per-key/per-model bucket first (interactive routing ahead of
+# rewrites, rewrites ahead of background work), and identical concurrent
+# requests can be collapsed into one upstream call (SingleFlight).
+
+TURN_BUDGET = float(os.getenv("GYMINI_TURN_BUDGET", "30"))
+# e.g. GYMINI_HEDGE_PERCENTILE=95 sends a duplicate request when a call is
+# slower than 95% of recent ones (only for policies that allow hedging).
+HEDGE_PERCENTILE = float(os.getenv("GYMINI_HEDGE_PERCENTILE", "0")) or None
+
+_TURN_DEADLINE = contextvars.ContextVar("gymini_turn_deadline", default=None)
+# Priority classes for rate-limited calls, highest first. Background work
+# (evaluations, prefetching) may only use the upper part of a bucket, so a
+# burst of it never leaves interactive turns waiting for tokens.
+PRIORITIES = {"interactive": 0, "normal": 1, "background": 2}
+BACKGROUND_RESERVE = float(os.getenv("GYMINI_BACKGROUND_RESERVE", "0.5"))
+_PRIORITY = contextvars.ContextVar("gymini_priority", default=None)
+_EXECUTOR = ThreadPoolExecutor(max_workers=int(os.getenv("GYMINI_CALL_WORKERS", "32")), thread_name_prefix="gymini-call")
+
+
+class DependencyUnavailable(Exception):
+    """An external dependency could not answer within its policy."""
+
+
+class CircuitOpenError(DependencyUnavailable):
+    pass
+
+
+class DeadlineExceededError(DependencyUnavailable, TimeoutError):
+    pass
+
+
+@contextmanager
+def turn_budget(seconds: float = TURN_BUDGET):
+    """Bounds every policy call made inside the block by one overall deadline."""
+    token = _TURN_DEADLINE.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _TURN_DEADLINE.reset(token)
+
+
+def remaining_budget() -> float | None:
+    deadline = _TURN_DEADLINE.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+@contextmanager
+def priority(level: str):
+    """Runs the block's rate-limited calls with priority `level` (see PRIORITIES)."""
+    token = _PRIORITY.set(level)
+    try:
+        yield
+    finally:
+        _PRIORITY.reset(token)
+
+
+def current_priority(default: str = "normal") -> str:
+    return _PRIORITY.get() or default
+
+
+def key_id(api_key: str | None) -> str:
+    """Short fingerprint of an API key, to name its rate limiter without logging the key."""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:8] if api_key else "default"
+
+
+class RateLimiter:
+    """
+    Token bucket allowing `per_minute` requests (with bursts of up to `burst`),
+    shared by every thread calling one API key/model. Waiting callers are
+    served by priority, then in arrival order. per_minute=0 disables it.
+    """
+
+    def __init__(self, name: str, per_minute: float, burst: float | None = None):
+        self.name = name
+        self.rate = per_minute / 60
+        self.capacity = burst or max(1.0, per_minute / 10)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.stats = {"acquired": 0, "waited": 0, "rejected": 0, "queue": 0, "max_queue": 0, "wait_ms": 0.0}
+        self._waiters = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _floor(self, level: str) -> float:
+        if level != "background":
+            return 1.0
+        return max(1.0, min(self.capacity, 1 + self.capacity * BACKGROUND_RESERVE))
+
+    def try_acquire(self, level: str | None = None) -> bool:
+        """Takes a token only if one is free right now and nobody is waiting."""
+        if self.rate <= 0:
+            return True
+        with self._cond:
+            self._refill(time.monotonic())
+            if self._waiters or self.tokens < self._floor(level or current_priority()):
+                return False
+            self.tokens -= 1
+            self.stats["acquired"] += 1
+            return True
+
+    def acquire(self, timeout: float | None = None, level: str | None = None) -> float:
+        """
+        Takes one token, waiting up to `timeout` seconds. Returns the seconds
+        waited; raises DeadlineExceededError if no token is free in time.
+        """
+        if self.rate <= 0:
+            return 0.0
+        level = level or current_priority()
+        start = time.monotonic()
+        deadline = None if timeout is None else start + timeout
+        entry = (PRIORITIES.get(level, 1), next(self._seq))
+        with self._cond:
+            heapq.heappush(self._waiters, entry)
+            self.stats["queue"] = len(self._waiters)
+            self.stats["max_queue"] = max(self.stats["max_queue"], len(self._waiters))
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    first = self._waiters[0] == entry
+                    floor = self._floor(level)
+                    if first and self.tokens >= floor:
+                        self.tokens -= 1
+                        break
+                    # The head of the queue knows when its token will be there; the others wait for their turn.
+                    wait = (floor - self.tokens) / self.rate if first else None
+                    if deadline is not None:
+                        remaining = deadline - now
+                        if remaining <= 0 or (wait is not None and wait > remaining):
+                            self.stats["rejected"] += 1
+                            METRICS.count(f"ratelimit.{self.name}.rejected")
+                            raise DeadlineExceededError(f"{self.name} rate limit: no request slot within the turn budget")
+                        wait = remaining if wait is None else min(wait, remaining)
+                    self._cond.wait(wait)
+            finally:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self.stats["queue"] = len(self._waiters)
+                self._cond.notify_all()
+            waited = time.monotonic() - start
+            self.stats["acquired"] += 1
+            if waited > 0.001:
+                self.stats["waited"] += 1
+                self.stats["wait_ms"] += waited * 1000
+        METRICS.observe(f"ratelimit.{self.name}.wait", waited * 1000)
+        return waited
+
+
+RATE_LIMITERS = {}
+_limiters_lock = threading.Lock()
+
+
+def rate_limiter(api: str, api_key: str | None, per_minute: float, burst: float | None = None) -> RateLimiter:
+    """The shared limiter for `api` (e.g. "gemini/<model>") called with `api_key`."""
+    name = f"{api}/{key_id(api_key)}"
+    with _limiters_lock:
+        if name not in RATE_LIMITERS:
+            RATE_LIMITERS[name] = RateLimiter(name, per_minute, burst)
+        return RATE_LIMITERS[name]
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same key into one: the first caller
+    runs `fn`, the others wait for it and share its result (or its error).
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.stats = {"calls": 0, "coalesced": 0}
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn):
+        with self._lock:
+            self.stats["calls"] += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.stats["coalesced"] += 1
+        if not leader:
+            METRICS.count(f"singleflight.{self.name}.coalesced")
+            annotate(coalesced=True)
+            if not flight.done.wait(remaining_budget()):
+                raise DeadlineExceededError(f"{self.name}: shared request did not finish within the turn budget")
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+
+FLIGHTS = {}
+
+
+def single_flight(name: str) -> SingleFlight:
+    with _limiters_lock:
+        if name not in FLIGHTS:
+            FLIGHTS[name] = SingleFlight(name)
+        return FLIGHTS[name]
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Let one trial call through.
+                self.state = "half_open"
+                return True
+            return self.state != "open"
+
+    def is_open(self) -> bool:
+        """True while calls are refused (checked without starting a trial call)."""
+        with self._lock:
+            return self.state == "open" and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    log_event("Resilience", f"Circuit opened after {self.failures} failures")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+
+class CallPolicy:
+    def __init__(self, name: str, timeout: float, max_attempts: int = 3, base_delay: float = 0.5,
+                 max_delay: float = 8.0, is_retryable=None, hedge: bool = False,
+                 breaker: CircuitBreaker | None = None, limiter: RateLimiter | None = None):
+        self.name = name
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.is_retryable = is_retryable or (lambda e: isinstance(e, (ConnectionError, TimeoutError)))
+        self.hedge = hedge
+        self.breaker = breaker or CircuitBreaker()
+        self.limiter = limiter
+        self.latencies = deque(maxlen=200)
+        self.stats = {"calls": 0, "failures": 0, "retries": 0, "timeouts": 0, "short_circuited": 0, "hedges": 0,
+                      "rate_limited": 0}
+        POLICIES[name] = self
+
+    def call(self, fn, max_attempts: int | None = None):
+        """
+        Runs `fn(timeout)` under the policy; `timeout` is the seconds left for
+        this attempt, to pass on to the client library. Raises
+        DependencyUnavailable when the dependency cannot answer in time, or
+        at once (without retrying) on a non-transient error such as bad
+        credentials or an invalid request.
+        """
+        self.stats["calls"] += 1
+        with span(f"external.{self.name}"):
+            return self._call(fn, max_attempts or self.max_attempts)
+
+    def _call(self, fn, attempts: int):
+        for attempt in range(1, attempts + 1):
+            annotate(attempts=attempt)
+            if not self.breaker.allow():
+                self.stats["short_circuited"] += 1
+                METRICS.count(f"external.{self.name}.short_circuited")
+                raise CircuitOpenError(f"{self.name} is unavailable (circuit open)")
+            timeout = self._attempt_timeout()
+            if self.limiter is not None:
+                waited = self.limiter.acquire(remaining_budget())
+                if waited > 0.001:
+                    self.stats["rate_limited"] += 1
+                    annotate(rate_limit_wait_ms=round(waited * 1000, 3))
+                    timeout = self._attempt_timeout()
+            start = time.monotonic()
+            try:
+                result = self._run(fn, timeout)
+            except Exception as e:
+                retryable = isinstance(e, DeadlineExceededError) or self.is_retryable(e)
+                self.breaker.record_failure()
+                self.stats["failures"] += 1
+                log_event("Resilience", f"{self.name} attempt {attempt} failed: {e}")
+                if not retryable:
+                    # Retrying would fail the same way; callers degrade as for an outage.
+                    if isinstance(e, DependencyUnavailable):
+                        raise
+                    raise DependencyUnavailable(f"{self.name} failed: {type(e).__name__}: {e}") from e
+                delay = self._backoff(attempt)
+                budget = remaining_budget()
+                if attempt == attempts or (budget is not None and budget <= delay):
+                    if isinstance(e, DependencyUnavailable):
+                        raise
+                    raise DependencyUnavailable(f"{self.name} failed after {attempt} attempts: {e}") from e
+                self.stats["retries"] += 1
+                time.sleep(delay)
+                continue
+            self.latencies.append(time.monotonic() - start)
+            self.breaker.record_success()
+            return result
+
+    def _attempt_timeout(self) -> float:
+        budget = remaining_budget()
+        if budget is not None and budget <= 0:
+            raise DeadlineExceededError(f"turn budget exhausted before calling {self.name}")
+        return self.timeout if budget is None else min(self.timeout, budget)
+
+    def _backoff(self, attempt: int) -> float:
+        # "Full jitter" exponential backoff.
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def _hedge_after(self) -> float | None:
+        if not (self.hedge and HEDGE_PERCENTILE) or len(self.latencies) < 20:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * HEDGE_PERCENTILE / 100))]
+
+    def _run(self, fn, timeout: float):
+        context = contextvars.copy_context()
+        deadline = time.monotonic() + timeout
+        futures = [_EXECUTOR.submit(context.run, fn, timeout)]
+        hedge_after = self._hedge_after()
+        if hedge_after is not None and hedge_after < timeout:
+            done, _ = wait(futures, timeout=hedge_after)
+            # A hedge is a second upstream request: only sent if the rate limit has a token to spare.
+            if not done and (self.limiter is None or self.limiter.try_acquire()):
+                self.stats["hedges"] += 1
+                annotate(hedged=True)
+                futures.append(_EXECUTOR.submit(contextvars.copy_context().run, fn, deadline - time.monotonic()))
+        error = None
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        if error is not None and not pending:
+            raise error
+        self.stats["timeouts"] += 1
+        raise DeadlineExceededError(f"{self.name} did not answer within {timeout:.1f}s")
+
+
+POLICIES = {}
+
+
+def policy_stats() -> dict:
+    return {
+        name: {**policy.stats, "circuit": policy.breaker.state}
+        for name, policy in POLICIES.items()
+    }
+
+
+def limiter_stats() -> dict:
+    with _limiters_lock:
+        limiters, flights = list(RATE_LIMITERS.values()), list(FLIGHTS.values())
+    return {
+        "rate_limits": {
+            limiter.name: {**limiter.stats, "wait_ms": round(limiter.stats["wait_ms"], 1)} for limiter in limiters
+        },
+        "single_flight": {flight.name: dict(flight.stats) for flight in flights},
+    }
@@ -0,0 +1,176 @@
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import re
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import agents.memory_agent
+import agents.model_registry
+import agents.prefetcher
+from agents.context_manager import ConversationContext
+import db.backend
+import logs
+from logs import log_event
+from main import handle_turn, log_session_stats
+
+# Multi-session server mode.
+# Line protocol over TCP: each connection is one session with its own chat
+# history, name memory and log context. Clients send one message per line
+# (plain text or {"message": "..."}) and get one JSON line back per turn.
+# With {"message": "...", "stream": true}, free-text replies are also sent as
+# {"chunk": "..."} lines while Gemini produces them, before the final reply.
+# Each session logs and reads its own lifter's history: the connection's
+# session id unless the client names the user ({"user": "...", ...}, kept for
+# the rest of the connection).
+# Turns run on a bounded thread pool; a semaphore caps how many turns (and so
+# how many model calls) are in flight, and new turns are refused with a
+# "busy" reply once too many are already waiting.
+
+MAX_INFLIGHT = int(os.getenv("GYMINI_MAX_INFLIGHT", "16"))
+MAX_WAITING = int(os.getenv("GYMINI_MAX_WAITING", "64"))
+WORKERS = int(os.getenv("GYMINI_WORKERS", str(MAX_INFLIGHT)))
+
+BUSY_REPLY = "Gymini is busy with a lot of lifters right now. Please try again in a moment."
+ERROR_REPLY = "Sorry, something went wrong with that message. Please try again."
+USER_ID_RE = re.compile(r"[A-Za-z0-9_.\-]{1,64}")
+
+
+class Session:
+    def __init__(self):
+        self.id = uuid.uuid4().hex[:8]
+        self.user_id = self.id
+        self.history = ConversationContext(on_switch=agents.prefetcher.prefetch_tip)
+        self.memory = {}
+
+
+class GyminiServer:
+    def __init__(self, max_inflight: int = MAX_INFLIGHT, max_waiting: int = MAX_WAITING, workers: int = WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gymini-turn")
+        self.inflight = asyncio.Semaphore(max_inflight)
+        self.max_waiting = max_waiting
+        self.waiting = 0
+        self.sessions = {}
+
+    async def run_turn(self, session: Session, message: str, on_chunk=None) -> str:
+        if self.waiting >= self.max_waiting:
+            log_event("Server", f"Rejected turn, {self.waiting} turns waiting")
+            return BUSY_REPLY
+        self.waiting += 1
+        try:
+            await self.inflight.acquire()
+        finally:
+            self.waiting -= 1
+        loop = asyncio.get_running_loop()
+
+        def work():
+            reply = handle_turn(message, session.history, stream=on_chunk is not None)
+            if reply is None or isinstance(reply, str):
+                return reply
+            parts = []
+            for chunk in reply:
+                parts.append(chunk)
+                loop.call_soon_threadsafe(on_chunk, chunk)
+            return "".join(parts)
+
+        try:
+            # The session's memory and log context travel with the turn into the worker thread.
+            context = contextvars.copy_context()
+            return await loop.run_in_executor(self.executor, context.run, work)
+        finally:
+            self.inflight.release()
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        session = Session()
+        self.sessions[session.id] = session
+        # Each connection runs in its own task, so these bindings are per session.
+        agents.memory_agent.use_memory(session.memory)
+        db.backend.use_user(session.user_id)
+        logs.SESSION_ID.set(session.id)
+        log_event("Server", f"Session opened from {writer.get_extra_info('peername')}")
+        await self.send(writer, {"session": session.id, "reply": "🤖 Gymini is ready! Send 'quit' to exit."})
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = line.decode("utf-8").strip()
+                stream = False
+                if message.startswith("{"):
+                    try:
+                        request = json.loads(message)
+                        if request.get("metrics"):
+                            await self.send(writer, {"session": session.id, "metrics": logs.dump_metrics()})
+                            continue
+                        user_id = str(request.get("user") or session.user_id)
+                        if user_id != session.user_id:
+                            if not USER_ID_RE.fullmatch(user_id):
+                                await self.send(writer, {"session": session.id, "error": "invalid user id",
+                                                         "done": True})
+                                continue
+                            session.user_id = user_id
+                            db.backend.use_user(user_id)
+                        message = str(request.get("message", "")).strip()
+                        stream = bool(request.get("stream"))
+                    except json.JSONDecodeError:
+                        pass
+                if not message:
+                    continue
+                if message.lower() == "quit":
+                    await self.send(writer, {"session": session.id, "reply": "Goodbye! Keep training strong 💪"})
+                    break
+                on_chunk = self._chunk_writer(writer, session.id) if stream else None
+                try:
+                    reply = await self.run_turn(session, message, on_chunk)
+                except Exception as e:
+                    # One failed turn must not end the session.
+                    log_event("Server", f"Turn failed: {type(e).__name__}: {e}")
+                    await self.send(writer, {"session": session.id, "reply": ERROR_REPLY, "error": type(e).__name__,
+                                             "done": True})
+                    continue
+                await self.send(writer, {"session": session.id, "reply": reply, "done": True})
+        except (ConnectionResetError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.sessions.pop(session.id, None)
+            log_event("Server", "Session closed")
+            writer.close()
+
+    @staticmethod
+    def _chunk_writer(writer: asyncio.StreamWriter, session_id: str):
+        """Callback writing each streamed reply chunk as a {"chunk": ...} line."""
+        def on_chunk(chunk: str):
+            writer.write((json.dumps({"session": session_id, "chunk": chunk}, ensure_ascii=False) + "\n").encode("utf-8"))
+        return on_chunk
+
+    @staticmethod
+    async def send(writer: asyncio.StreamWriter, payload: dict):
+        writer.write((json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8"))
+        await writer.drain()
+
+    async def serve(self, host: str, port: int):
+        agents.model_registry.warm_up_in_background()
+        server = await asyncio.start_server(self.handle_client, host, port)
+        log_event("Server", f"Gymini listening on {host}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            log_session_stats()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run Gymini as a multi-session line-protocol server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    try:
+        asyncio.run(GyminiServer().serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()